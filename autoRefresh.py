@@ -8,54 +8,84 @@ import argparse                         # use argparse to parse arguments
 import time                             # import time functions
 import logging                          # standard library for logging   
 import pathlib             
+import itertools
+import heapq
 
-######################################################
-# Parametrage du parser d'arguments
-###################################################### 
-
-curworkdir = os.getcwd()
+from refreshConfig import iter_config
+from refreshJournal import unit_id
+from refreshPlan import write_plan
+from refreshSelection import build_selector
+from refreshIncremental import get_client, load_watermarks, query_partitions, plan_incremental, unit_key, watermark_line
+from refreshPartitions import TIME_TYPES, header_bounds, detect_date_format, parse_bound, add_partitions, partition_count
 
-parser=argparse.ArgumentParser()
-parser.add_argument('--log', help='Log level', choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"], default="INFO")
-parser.add_argument('--project', help='Project Name', required=True)
-parser.add_argument('--subenv', help='Sous-environnement', required=True)
-parser.add_argument('--target_env', help='Environnement cible', required=True)
-parser.add_argument('--repertoire_bash', help='Repertoire du fichier Bash', required=True)
-parser.add_argument('--emplacement_config', help='Chemin du fichier de configuration', required=True)
-parser.add_argument('--logFile', help='Path du fichier de log', default=curworkdir+"/logs/"+os.path.splitext(os.path.basename(__file__))[0]+time.strftime("_%Y%m%d_%H%M%S")+".log")
+from datetime import datetime, timedelta
 
-args = parser.parse_args()
-
-######################################################
-# Parametrage du logging
-######################################################
-
-# création du répertoire de logs si non existant
-curlogdir = f"{curworkdir}/logs"
-if not os.path.exists(curlogdir):
-    os.makedirs(curlogdir)
+curworkdir = os.getcwd()
 
-# create logger
 logger = logging.getLogger(os.path.basename(__file__))
-logger.setLevel(args.log)
-
-# create formatter
-formatter = logging.Formatter('%(asctime)s %(name)s %(levelname)-5s %(message)s')
 
-# create console handler with a higher log level
-ch = logging.StreamHandler(sys.stdout)
-ch.setFormatter(formatter)
-logger.addHandler(ch)
+# Surcoût fixe estimé d'un rafraîchissement en secondes, indépendant de la volumétrie
+UNIT_OVERHEAD = 10
+# Débit estimé par défaut en octets par seconde
+DEFAULT_THROUGHPUT = 100e6
 
-# create file handler which logs even debug messages
-fh = logging.FileHandler(args.logFile)
-fh.setFormatter(formatter)
-logger.addHandler(fh)
+# Arguments obligatoires de la ligne de commande
+REQUIRED_ARGS = ['project', 'subenv', 'target_env', 'repertoire_bash', 'emplacement_config']
 
 ######################################################
 # Fonctions
 ######################################################
 
+######################################################
+# build_parser : parser des arguments de la ligne de commande
+# Out : ArgumentParser
+def build_parser():
+    parser=argparse.ArgumentParser()
+    parser.add_argument('--log', help='Log level', choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"], default="INFO")
+    parser.add_argument('--project', help='Project Name', required=True)
+    parser.add_argument('--subenv', help='Sous-environnement', required=True)
+    parser.add_argument('--target_env', help='Environnement cible', required=True)
+    parser.add_argument('--repertoire_bash', help='Repertoire du fichier Bash', required=True)
+    parser.add_argument('--emplacement_config', help='Chemin du fichier de configuration', required=True)
+    parser.add_argument('--max_parallel', help='Nombre maximum de rafraîchissements exécutés en parallèle', type=int, default=1)
+    parser.add_argument('--batch', help='Rafraîchit toutes les tables dans un seul processus Python (refreshBatch.py) au lieu d\'un processus par table', action='store_true')
+    parser.add_argument('--incremental', help='Rafraîchit uniquement les partitions modifiées depuis le dernier rafraîchissement réussi', action='store_true')
+    parser.add_argument('--credpath', help='Path du credential GCP de production, requis en mode incrémental')
+    parser.add_argument('--watermarks', help='Fichier des watermarks du mode incrémental (défaut : <repertoire_bash>/watermarks.jsonl)')
+    parser.add_argument('--chunk_days', help='Découpe la plage des tables à partitionnement temporel en tranches de N jours (mois de 30 jours, années de 365 jours)', type=int, default=0)
+    parser.add_argument('--chunk_values', help='Découpe la plage des tables partitionnées par valeur entière en tranches de N valeurs', type=int, default=0)
+    parser.add_argument('--max_retries', help='Nombre de relances d\'un rafraîchissement en échec', type=int, default=2)
+    parser.add_argument('--retry_delay', help='Délai initial avant relance en secondes, doublé à chaque tentative', type=int, default=30)
+    parser.add_argument('--retry_max_delay', help='Délai maximum avant relance en secondes', type=int, default=600)
+    parser.add_argument('--max_bytes', help='Budget d\'octets par exécution : les unités au-delà sont reportées (0 pour ne pas limiter)', type=int, default=0)
+    parser.add_argument('--throughput', help='Débit estimé en octets par seconde, utilisé pour l\'estimation de la durée', type=float, default=DEFAULT_THROUGHPUT)
+    parser.add_argument('--include', nargs='+', help='Tables à rafraîchir : globs ou expressions régulières préfixées par re: (toutes si absent)')
+    parser.add_argument('--exclude', nargs='+', help='Tables à ne pas rafraîchir : globs ou expressions régulières préfixées par re:')
+    parser.add_argument('--partition_types', nargs='+', help='Types de partitionnement rafraîchis (DAY, NUMBER, ..., NONE pour les tables non partitionnées)')
+    parser.add_argument('--min_table_bytes', help='Taille minimale des tables rafraîchies en octets', type=int)
+    parser.add_argument('--max_table_bytes', help='Taille maximale des tables rafraîchies en octets', type=int)
+    parser.add_argument('--rules', help='Fichier de règles de sélection (include=, exclude=, partition_type=, min_bytes=, max_bytes=)')
+    parser.add_argument('--prometheus', help='Fichier textfile Prometheus (.prom) recevant le résumé de chaque exécution du script')
+    parser.add_argument('--logFile', help='Path du fichier de log', default=curworkdir+"/logs/"+os.path.splitext(os.path.basename(__file__))[0]+time.strftime("_%Y%m%d_%H%M%S")+".log")
+    return parser
+
+######################################################
+# make_args : arguments de generate_script pour un appel depuis Python
+# Les options non précisées prennent la valeur par défaut de la ligne de commande
+# In  : options nommées comme les arguments de la ligne de commande (project, subenv, ...)
+# Out : Namespace des arguments
+#       Lève une TypeError si une option obligatoire manque ou si une option est inconnue
+def make_args(**options):
+    missing = [key for key in REQUIRED_ARGS if key not in options]
+    if missing:
+        raise TypeError(f"Options obligatoires manquantes : {', '.join(missing)}")
+    args = build_parser().parse_args([item for key in REQUIRED_ARGS for item in (f"--{key}", str(options[key]))])
+    for key, value in options.items():
+        if not hasattr(args, key):
+            raise TypeError(f"Option inconnue : {key}")
+        setattr(args, key, value)
+    return args
+
 ######################################################
 # extract_partition_info : retourne les informations de partitionnement
 # In  : parition_info 
@@ -70,78 +100,739 @@ def extract_partition_info(partition_info):
     else:
         return '', '', '', ''
     
-######################################################    
-# extract_header : extrait les valeurs du header
-# In  : fichier de configuration
-# Out : header values, dictionnaire contenant les informations du header
-#       debut, date de debut afin de la renseigner dans le titre
-#       fin, date de fin afin de la renseigner dans le titre
-def extract_header(config_file):
-    header_values = {}
-    # Lecture du fichier
-    logger.info(f"Lecture du fichier de configuration")
-    lines = config_file.readlines()
-    # Extraction du header
-    logger.info(f"Extraction des valeurs du header")
-    for line in lines:
-        if line.strip() == '-----------':
+######################################################
+# build_unit : construit l'unité de rafraîchissement d'une table
+# In  : line_data, ligne du fichier de configuration
+#       header_values, valeurs du header
+# Out : dictionnaire contenant dataset_id, table_id, project_id si la table appartient à un projet
+#       renseigné dans la configuration et, si la table est partitionnée, les bornes 
+#       partition_start et partition_end du type de partitionnement (refreshPartitions.header_bounds)
+def build_unit(line_data, header_values):
+    unit = {'dataset_id': line_data['dataset_id'], 'table_id': line_data['table_id']}
+    if line_data.get('project_id'):
+        unit['project_id'] = line_data['project_id']
+    partition_key, partition_type, partition_start, partition_end = extract_partition_info(line_data['partition_info'])
+    # Vérifier si la table est partitionnée avant de renseigner les bornes de partition
+    if line_data['partition_info']['partitioned']:
+        unit['partition_type'] = partition_type
+        unit['partition_start'], unit['partition_end'] = header_bounds(header_values, partition_type)
+    return unit
+
+######################################################
+# partition_params : paramètres de partition de la ligne de commande refreshSubEnv.py
+# In  : unit, unité de rafraîchissement
+# Out : paramètres --partition_date_start/--partition_date_end, chaîne vide si la table n'est pas partitionnée
+def partition_params(unit):
+    if 'partition_start' in unit:
+        return f"--partition_date_start {unit['partition_start']} --partition_date_end {unit['partition_end']}"
+    return ""
+
+######################################################
+# command_prefix : début de la commande de rafraîchissement d'une unité dans le script bash
+# In  : unit, unité de rafraîchissement
+#       args, arguments de la génération (projet, environnements)
+# Out : "${vCmd[@]}" pour le projet de la génération, la commande complète pour une
+#       table d'un autre projet de la configuration
+def command_prefix(unit, args):
+    if unit.get('project_id', args.project) == args.project:
+        return '"${vCmd[@]}"'
+    return f"python3 ./refreshSubEnv.py --project {unit['project_id']} --subenv {args.subenv} --target_env {args.target_env}"
+
+######################################################
+# chunk_unit : découpe la plage de partitions d'une unité en tranches indépendantes
+# Chaque tranche est une unité de rafraîchissement à part entière, exécutable en
+# parallèle et relançable seule en cas d'échec. Une partition n'est jamais
+# partagée entre deux tranches : pour MONTH et YEAR, la taille en jours est
+# arrondie à un nombre entier de mois (30 jours) ou d'années (365 jours), au 
+# moins un ; pour une plage d'entiers, à un multiple de l'intervalle aligné sur
+# le début de la plage
+# In  : unité de rafraîchissement
+#       taille des tranches en jours (partitionnement temporel), 0 pour ne pas découper
+#       taille des tranches en valeurs (plages d'entiers), 0 pour ne pas découper
+#       plage d'entiers de la table (start, end, interval), None si inconnue
+# Out : liste des unités, l'unité d'origine si la plage n'est pas découpée
+def chunk_unit(unit, chunk_days, chunk_values, partition_range=None):
+    if not unit.get('partition_start') or not unit.get('partition_end'):
+        return [unit]
+    bounds = []
+    partition_type = unit['partition_type']
+    if partition_type in TIME_TYPES and chunk_days > 0:
+        date_format = detect_date_format(unit['partition_start'], partition_type)
+        start = datetime.strptime(unit['partition_start'], date_format)
+        end = datetime.strptime(unit['partition_end'], date_format)
+        # Taille des tranches en nombre de partitions
+        step = {'HOUR': chunk_days * 24, 'DAY': chunk_days, 'MONTH': max(1, chunk_days // 30), 'YEAR': max(1, chunk_days // 365)}[partition_type]
+        while start <= end:
+            chunk_end = min(add_partitions(start, partition_type, step - 1), end)
+            bounds.append((start.strftime(date_format), chunk_end.strftime(date_format)))
+            start = add_partitions(chunk_end, partition_type, 1)
+    elif partition_type not in TIME_TYPES and chunk_values > 0:
+        start = int(unit['partition_start'])
+        end = int(unit['partition_end'])
+        origin, size = start, chunk_values
+        if partition_range:
+            interval = int(partition_range['interval'])
+            origin, size = int(partition_range['start']), -(-chunk_values // interval) * interval
+        while start <= end:
+            chunk_end = min(origin + ((start - origin) // size + 1) * size - 1, end)
+            bounds.append((str(start), str(chunk_end)))
+            start = chunk_end + 1
+    if len(bounds) <= 1:
+        return [unit]
+    chunks = []
+    for i, (chunk_start, chunk_end) in enumerate(bounds):
+        chunk = dict(unit, partition_start=chunk_start, partition_end=chunk_end)
+        # Le watermark n'est validé qu'une fois toutes les tranches de la table rafraîchies
+        if 'watermark' in unit:
+            chunk['chunk'] = i
+            chunk['chunks'] = len(bounds)
+        chunks.append(chunk)
+    return chunks
+
+######################################################
+# iter_units : construit les unités de rafraîchissement des tables du fichier de configuration
+# En mode incrémental, chaque unité est restreinte aux partitions modifiées depuis 
+# son watermark et les tables non modifiées sont ignorées
+# Les plages de partitions sont ensuite découpées selon --chunk_days/--chunk_values
+# In  : tables du fichier de configuration
+#       header_values, valeurs du header
+#       client, Bigquery client (mode incrémental uniquement)
+#       watermarks, dictionnaire des watermarks (mode incrémental uniquement)
+#       taille des tranches en jours et en valeurs (0 pour ne pas découper)
+# Out : générateur d'unités de rafraîchissement
+def iter_units(records, header_values, client=None, watermarks=None, chunk_days=0, chunk_values=0):
+    partitions = {}
+    for line_data in records:
+        unit = build_unit(line_data, header_values)
+        if client is not None:
+            # Dates de modification des partitions, interrogées une fois par dataset
+            dataset_key = (line_data.get('project_id') or client.project, line_data['dataset_id'])
+            if dataset_key not in partitions:
+                partitions[dataset_key] = query_partitions(client, *dataset_key)
+            unit = plan_incremental(unit, line_data, partitions[dataset_key].get(line_data['table_id']), watermarks.get(unit_key(line_data)))
+            if unit is None:
+                logger.debug(f"Table non modifiée depuis le dernier rafraîchissement : {unit_key(line_data)}")
+                continue
+        requires = line_data.get('depends_on', []) + line_data.get('declared_depends_on', [])
+        for chunk in chunk_unit(unit, chunk_days, chunk_values, line_data['partition_info'].get('range')):
+            est_bytes = estimate_bytes(chunk, line_data)
+            if est_bytes is not None:
+                chunk['est_bytes'] = est_bytes
+            if requires:
+                chunk['requires'] = requires
+            yield chunk
+
+######################################################
+# range_span : nombre de partitions couvertes par la plage d'une unité
+# In  : unité de rafraîchissement
+#       plage d'entiers de la table (start, end, interval), None si inconnue
+# Out : nombre de partitions (heures, jours, mois, années, intervalles de la plage d'entiers) 
+#       ou de valeurs si l'intervalle est inconnu, None si la plage n'est pas bornée
+def range_span(unit, partition_range=None):
+    if not unit.get('partition_start') or not unit.get('partition_end'):
+        return None
+    partition_type = unit['partition_type']
+    try:
+        start = parse_bound(unit['partition_start'], partition_type)
+        end = parse_bound(unit['partition_end'], partition_type)
+    except ValueError:
+        return None
+    if partition_type in TIME_TYPES:
+        return partition_count(start, end, partition_type)
+    if partition_range:
+        origin, interval = int(partition_range['start']), int(partition_range['interval'])
+        return (end - origin) // interval - (start - origin) // interval + 1
+    return end - start + 1
+
+######################################################
+# estimate_bytes : volume estimé d'une unité de rafraîchissement
+# Pour une plage de partitions, la taille de la table est répartie au prorata
+# du nombre de partitions couvertes
+# In  : unité de rafraîchissement
+#       ligne de configuration de la table
+# Out : nombre d'octets estimé, None si la volumétrie de la table est inconnue
+def estimate_bytes(unit, line_data):
+    size_info = line_data.get('size_info')
+    if not size_info:
+        return None
+    num_bytes = size_info.get('num_bytes') or 0
+    span = range_span(unit, line_data['partition_info'].get('range'))
+    if span and size_info.get('num_partitions'):
+        return int(num_bytes * min(1, span / size_info['num_partitions']))
+    return num_bytes
+
+######################################################
+# unit_duration : durée estimée d'une unité en secondes
+# In  : unité de rafraîchissement
+#       débit estimé en octets par seconde
+# Out : surcoût fixe + volume / débit
+def unit_duration(unit, throughput=DEFAULT_THROUGHPUT):
+    return UNIT_OVERHEAD + unit.get('est_bytes', 0) / throughput
+
+######################################################
+# deferred_key : table d'une unité, identifiant des reports d'une exécution à l'autre
+# In  : unité de rafraîchissement
+# Out : [projet.]dataset.table, sans la plage de partitions
+def deferred_key(unit):
+    return unit_id(unit).split(':', 1)[0]
+
+######################################################
+# load_deferred : lecture des tables reportées par l'exécution précédente
+# In  : chemin du fichier des reports
+# Out : dictionnaire table -> date du premier report
+def load_deferred(deferred_path):
+    deferred = {}
+    if not os.path.exists(deferred_path):
+        return deferred
+    with open(deferred_path, 'r') as deferred_file:
+        for line in deferred_file:
+            if line.strip(): # Vérifie si la ligne n'est pas vide
+                entry = json.loads(line)
+                deferred[entry['table']] = entry['since']
+    return deferred
+
+######################################################
+# write_deferred : remplace le fichier des reports par les tables reportées de l'exécution
+# In  : chemin du fichier des reports
+#       unités reportées
+#       reports de l'exécution précédente (date du premier report conservée)
+def write_deferred(deferred_path, units, previous):
+    tables = {}
+    for unit in units:
+        key = deferred_key(unit)
+        entry = tables.setdefault(key, {'table': key, 'since': previous.get(key, datetime.now().isoformat(timespec='seconds')), 'est_bytes': 0})
+        entry['est_bytes'] += unit.get('est_bytes', 0)
+    tmp_path = f"{deferred_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'w') as deferred_file:
+            for entry in tables.values():
+                deferred_file.write(json.dumps(entry) + "\n")
+        os.replace(tmp_path, deferred_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+######################################################
+# schedule_units : ordonne les unités, les plus volumineuses en premier
+# En parallèle, démarrer les plus grosses tables en premier évite qu'une 
+# table volumineuse lancée en dernier fixe la durée totale. Avec un budget 
+# d'octets, les unités qui ne tiennent pas dans le budget sont reportées ; les
+# tables reportées par l'exécution précédente passent en premier pour qu'une
+# table ne soit pas reportée indéfiniment
+# In  : unités de rafraîchissement
+#       nombre de rafraîchissements en parallèle
+#       budget d'octets (0 pour ne pas limiter)
+#       tables reportées par l'exécution précédente (load_deferred)
+# Out : liste des unités retenues, liste des unités reportées
+def schedule_units(units, max_parallel, max_bytes, deferred=None):
+    units = list(units)
+    deferred = deferred or {}
+    if max_parallel > 1 or max_bytes:
+        units.sort(key=lambda unit: (deferred_key(unit) in deferred, unit.get('est_bytes', 0)), reverse=True)
+    if not max_bytes:
+        return units, []
+    selected, deferred = [], []
+    total = 0
+    for unit in units:
+        if total + unit.get('est_bytes', 0) <= max_bytes:
+            total += unit.get('est_bytes', 0)
+            selected.append(unit)
+        else:
+            deferred.append(unit)
+    return selected, deferred
+
+######################################################
+# estimate_makespan : durée estimée de l'exécution des unités dans l'ordre donné
+# Chaque unité est attribuée au premier worker libre
+# In  : unités ordonnées
+#       nombre de workers
+#       débit estimé en octets par seconde
+# Out : durée estimée en secondes, durée cumulée en secondes
+def estimate_makespan(units, workers, throughput=DEFAULT_THROUGHPUT):
+    loads = [0.0] * max(1, workers)
+    total = 0.0
+    for unit in units:
+        duration = unit_duration(unit, throughput)
+        total += duration
+        heapq.heapreplace(loads, loads[0] + duration)
+    return max(loads), total
+
+######################################################
+# reference_key : identifiant de la table référencée par une unité, au format de unit_key
+# Une référence dataset.table désigne le projet de l'unité ; sans projet renseigné
+# dans la configuration, une référence projet.dataset.table est rapprochée de dataset.table
+# In  : référence (dataset.table ou projet.dataset.table)
+#       unité qui la référence
+# Out : identifiant de la table référencée
+def reference_key(reference, unit):
+    parts = reference.split('.')
+    if not unit.get('project_id'):
+        return '.'.join(parts[-2:])
+    if len(parts) == 3:
+        return reference
+    return f"{unit['project_id']}.{'.'.join(parts[-2:])}"
+
+######################################################
+# order_units : ordonne les unités selon leurs dépendances
+# Une unité dépend de toutes les unités (tranches comprises) des tables qu'elle
+# référence (depends_on des vues, declared_depends_on déclarés dans la configuration).
+# Les références à des tables absentes du plan sont ignorées. Parmi les unités
+# prêtes, l'ordre d'entrée (volumétrie décroissante) est conservé. En cas de
+# dépendance circulaire, l'ordre des unités concernées n'est pas contraint
+# In  : unités ordonnées, avec la liste des tables référencées ('requires')
+# Out : unités en ordre topologique, avec la liste des identifiants des unités
+#       dont elles dépendent ('depends_on')
+def order_units(units):
+    positions = {}
+    for i, unit in enumerate(units):
+        positions.setdefault(unit_key(unit), []).append(i)
+    deps = []
+    for i, unit in enumerate(units):
+        table = unit_key(unit)
+        names = {reference_key(reference, unit) for reference in unit.pop('requires', [])}
+        deps.append({j for name in names if name != table for j in positions.get(name, [])})
+    dependents = [[] for unit in units]
+    pending = [len(unit_deps) for unit_deps in deps]
+    for i, unit_deps in enumerate(deps):
+        for j in unit_deps:
+            dependents[j].append(i)
+    ready = [i for i in range(len(units)) if not pending[i]]
+    heapq.heapify(ready)
+    order = []
+    while ready:
+        i = heapq.heappop(ready)
+        order.append(i)
+        for k in dependents[i]:
+            pending[k] -= 1
+            if not pending[k]:
+                heapq.heappush(ready, k)
+    if len(order) < len(units):
+        ordered = set(order)
+        cycle = [i for i in range(len(units)) if i not in ordered]
+        logger.error(f"Dépendances circulaires, ordre non contraint pour : {', '.join(unit_id(units[i]) for i in cycle)}")
+        for i in cycle:
+            deps[i] &= ordered
+        order += cycle
+    for i in order:
+        if deps[i]:
+            units[i]['depends_on'] = [unit_id(units[j]) for j in sorted(deps[i])]
+    return [units[i] for i in order]
+
+######################################################
+# stream_units : transmet les unités au fil de l'eau, dans l'ordre de la configuration
+# Les unités sans dépendance sont transmises dès leur construction ; seules les
+# unités qui référencent d'autres tables (vues, dépendances déclarées) sont 
+# conservées puis transmises en dernier, dans l'ordre de leurs dépendances.
+# En mémoire ne restent que ces unités et les identifiants des unités transmises
+# In  : unités de rafraîchissement, avec la liste des tables référencées ('requires')
+#       débit estimé en octets par seconde
+# Out : générateur d'unités en ordre topologique, avec 'depends_on' comme order_units
+def stream_units(units, throughput=DEFAULT_THROUGHPUT):
+    emitted = {}
+    held = []
+    count, total_bytes, total = 0, 0, 0.0
+    for unit in units:
+        if unit.get('requires'):
+            held.append(unit)
+            continue
+        emitted.setdefault(unit_key(unit), []).append(unit_id(unit))
+        count, total_bytes, total = count + 1, total_bytes + unit.get('est_bytes', 0), total + unit_duration(unit, throughput)
+        yield unit
+    # Dépendances des unités conservées envers les unités déjà transmises
+    external = {}
+    for unit in held:
+        table = unit_key(unit)
+        names = {reference_key(reference, unit) for reference in unit['requires']}
+        external[unit_id(unit)] = [key for name in sorted(names) if name != table for key in emitted.get(name, [])]
+    for unit in order_units(held):
+        depends_on = external[unit_id(unit)] + unit.get('depends_on', [])
+        if depends_on:
+            unit['depends_on'] = depends_on
+        count, total_bytes, total = count + 1, total_bytes + unit.get('est_bytes', 0), total + unit_duration(unit, throughput)
+        yield unit
+    logger.info(f"{count} unité(s), {format_bytes(total_bytes)} estimés, "
+                f"durée estimée {timedelta(seconds=int(total))} sur 1 worker(s) (cumulée {timedelta(seconds=int(total))})")
+
+######################################################
+# format_bytes : taille lisible
+# In  : nombre d'octets
+# Out : chaîne (ex : 1.5 Go)
+def format_bytes(num_bytes):
+    for unit in ['o', 'Ko', 'Mo', 'Go', 'To']:
+        if num_bytes < 1024 or unit == 'To':
+            return f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+
+######################################################
+# write_units : écrit dans le script bash une ligne de rafraîchissement par unité, au fil de l'eau
+# In  : script bash
+#       unités de rafraîchissement
+#       nom du journal des unités terminées
+#       args, arguments de la génération (projet, environnements, parallélisme, relances)
+#       fichier des watermarks (mode incrémental uniquement)
+def write_units(bash_script, units, nom_journal, args, watermarks_path=None):
+    bash_script.write(f'''# Nombre maximum de rafraîchissements exécutés en parallèle
+vMaxParallel={args.max_parallel}
+
+# Répertoire temporaire recevant le code retour de chaque rafraîchissement lancé en parallèle
+vStatusDir=$(mktemp -d)
+
+# Fichier des watermarks du mode incrémental
+vWatermarkFile="{watermarks_path or ''}"
+
+# Journal des unités terminées : une nouvelle exécution le réinitialise, 
+# une reprise (--resume) ignore les unités qu'il contient
+vJournalFile="${{vScriptDir}}/{nom_journal}"
+declare -A vDone
+if [ "$vDryRun" = "False" ]; then
+    if [ "$vResume" = "True" ] && [ -f "$vJournalFile" ]; then
+        while IFS= read -r vLine; do
+            vKey=${{vLine#*\\"unit\\": \\"}}
+            vDone[${{vKey%%\\"*}}]=1
+        done < "$vJournalFile"
+        echo "Reprise : ${{#vDone[@]}} unité(s) déjà terminée(s)"
+    else
+        : > "$vJournalFile"
+    fi
+fi
+
+# Relances : nombre maximum, délai initial et délai maximum en secondes
+vMaxRetries={args.max_retries}
+vRetryDelay={args.retry_delay}
+vRetryMaxDelay={args.retry_max_delay}
+
+# Ajoute au fichier des métriques l'enregistrement de l'unité en cours : horodatages, durée,
+# attente dans le pool, volume estimé, nombre de tentatives et code retour
+function write_metrics () {{
+    local vDuration vWait vStartIso vEndIso
+    printf -v vDuration '%d.%06d' $(( (vEnd - vStart) / 1000000 )) $(( (vEnd - vStart) % 1000000 ))
+    printf -v vWait '%d.%06d' $(( (vStart - vQueued) / 1000000 )) $(( (vStart - vQueued) % 1000000 ))
+    printf -v vStartIso '%(%Y-%m-%dT%H:%M:%S)T' $(( vStart / 1000000 ))
+    printf -v vEndIso '%(%Y-%m-%dT%H:%M:%S)T' $(( vEnd / 1000000 ))
+    printf '{{"run": "%s", "unit": "%s", "start": "%s", "end": "%s", "duration": %s, "wait": %s, "est_bytes": %s, "attempts": %d, "status": %d}}\n' "$vTsLog" "$vKey" "$vStartIso" "$vEndIso" "$vDuration" "$vWait" "$vEstBytes" "$vAttempt" "$vRc" >> "$vMetricsFile"
+}}
+
+# Exécute la commande de rafraîchissement passée en paramètre et trace son résultat
+# En cas d'échec, la commande est relancée jusqu'à vMaxRetries fois après un délai 
+# exponentiel avec gigue (entre la moitié et la totalité du délai)
+# $1 : identifiant de l'unité, ajouté au journal en cas de succès
+# $2 : volume estimé de l'unité en octets (null si inconnu)
+# $3 : ligne de watermark à ajouter au fichier des watermarks en cas de succès (vide hors mode incrémental)
+function run_refresh () {{
+    vKey=$1
+    vEstBytes=$2
+    vWatermark=$3
+    shift 3
+    now_us vStart
+    vAttempt=1
+    while true; do
+        "$@"
+        vRc=$?
+        if [ $vRc -eq 0 ] || [ $vAttempt -gt $vMaxRetries ]; then
             break
-        elif line.startswith('debut_DAY='):
-            header_values['debut_DAY'] = line.strip().split('=')[1]
-        elif line.startswith('fin_DAY='):
-            header_values['fin_DAY'] = line.strip().split('=')[1]
-        elif line.startswith('debut_NUM='):
-            header_values['debut_NUM'] = line.strip().split('=')[1]
-            debut = line.strip().split('=')[1]
-        elif line.startswith('fin_NUM='):
-            header_values['fin_NUM'] = line.strip().split('=')[1]
-            fin = line.strip().split('=')[1]
-    return header_values, debut, fin
+        fi
+        vDelay=$(( vRetryDelay * (1 << (vAttempt - 1)) ))
+        if [ $vDelay -gt $vRetryMaxDelay ]; then
+            vDelay=$vRetryMaxDelay
+        fi
+        vDelay=$(( vDelay / 2 + RANDOM % (vDelay / 2 + 1) ))
+        vAttempt=$((vAttempt + 1))
+        log "WARN" "Échec de $vKey (code retour $vRc), tentative $vAttempt dans ${{vDelay}}s"
+        sleep $vDelay
+    done
+    now_us vEnd
+    write_metrics
+    if [ $vRc -ne 0 ]; then
+        log "ERR" "Erreur de connexion au projet {args.project}, au sous-environnement {args.subenv} ou à l'environnement cible {args.target_env} - $vKey ($vAttempt tentative(s))"
+        return 1
+    fi
+    log "INFO" "Connexion au projet {args.project}, le sous-environnement est {args.subenv} et l'environnement cible est {args.target_env} - $vKey ($vAttempt tentative(s))"
+    printf -v vAt '%(%Y-%m-%dT%H:%M:%S)T' -1
+    echo "{{\\"unit\\": \\"${{vKey}}\\", \\"at\\": \\"${{vAt}}\\"}}" >> "$vJournalFile"
+    if [ -n "$vWatermark" ]; then
+        echo "$vWatermark" >> "$vWatermarkFile"
+    fi
+}}
 
-################################################################################################################
-# main
-################################################################################################################
-if __name__ == "__main__":
+# État des dépendances d'une unité, écrit dans vDepState : 
+# ready (toutes terminées avec succès), pending (une au moins en cours ou en attente),
+# skip (une au moins en échec ou ignorée)
+# $1 : numéros des unités dont elle dépend, séparés par des espaces
+function dep_status () {{
+    local vDep vDepRc
+    vDepState=ready
+    for vDep in $1; do
+        if [ ! -e "${{vStatusDir}}/${{vDep}}.rc" ]; then
+            vDepState=pending
+            continue
+        fi
+        read -r vDepRc < "${{vStatusDir}}/${{vDep}}.rc"
+        if [ "$vDepRc" != "0" ]; then
+            vDepState=skip
+            return
+        fi
+    done
+}}
+
+# Lance une unité en tâche de fond dès qu'une place se libère dans le pool
+# Le code retour est écrit dans vStatusDir par renommage, le fichier n'est jamais lu incomplet
+# $1 : numéro de l'unité
+# $2 : horodatage de mise en file (attente dans le pool des métriques), les paramètres suivants sont ceux de run_refresh
+function start_unit () {{
+    local vNo=$1 vQueuedAt=$2
+    shift 2
+    while [ $(jobs -rp | wc -l) -ge "$vMaxParallel" ]; do
+        wait -n
+    done
+    ( vQueued=$vQueuedAt; run_refresh "$@"; echo $? > "${{vStatusDir}}/${{vNo}}.tmp"; mv "${{vStatusDir}}/${{vNo}}.tmp" "${{vStatusDir}}/${{vNo}}.rc" ) &
+}}
+
+# File des unités en attente de leurs dépendances, indexée par numéro d'unité
+declare -a vPendingDeps vPendingQueued vPendingKey vPendingArgs
+
+# Lance les unités en attente dont les dépendances sont terminées, par numéro croissant,
+# et ignore celles dont une dépendance est en échec
+function start_ready () {{
+    local vNo
+    for vNo in "${{!vPendingDeps[@]}}"; do
+        dep_status "${{vPendingDeps[$vNo]}}"
+        if [ "$vDepState" = "pending" ]; then
+            continue
+        fi
+        if [ "$vDepState" = "skip" ]; then
+            log "WARN" "Unité ignorée, une unité dont elle dépend est en échec : ${{vPendingKey[$vNo]}}"
+            echo skip > "${{vStatusDir}}/${{vNo}}.rc"
+        else
+            eval "start_unit $vNo ${{vPendingQueued[$vNo]}} ${{vPendingArgs[$vNo]}}"
+        fi
+        unset "vPendingDeps[$vNo]" "vPendingQueued[$vNo]" "vPendingKey[$vNo]" "vPendingArgs[$vNo]"
+    done
+}}
+
+# Lance un rafraîchissement
+# $1 : numéro de l'unité
+# $2 : numéros des unités dont elle dépend, séparés par des espaces
+# $3 : identifiant de l'unité ([projet.]dataset.table:debut:fin)
+# $4 : volume estimé en octets (null si inconnu)
+# $5 : ligne de watermark (vide hors mode incrémental), les paramètres suivants forment la commande
+# En mode dryrun, la commande est seulement affichée
+# Une unité est ignorée si l'une des unités dont elle dépend est en échec ou a elle-même été ignorée
+# En mode séquentiel (vMaxParallel=1), la commande est exécutée directement : les unités étant
+# écrites dans l'ordre de leurs dépendances, celles-ci sont déjà terminées
+# En mode parallèle, une unité dont les dépendances sont terminées est lancée en tâche de fond dès 
+# qu'une place se libère dans le pool ; les autres sont mises en file (start_ready) sans bloquer 
+# le lancement des unités indépendantes écrites après elles
+# Le code retour de chaque unité est écrit dans vStatusDir puis collecté en fin de script
+function refresh () {{
+    vUnit=$1
+    vDeps=$2
+    shift 2
+    if [ "$vDryRun" = "True" ]; then
+        echo "${{*:4}} "
+        return
+    fi
+    if [ -n "${{vDone[$1]}}" ]; then
+        log "INFO" "Unité déjà terminée, ignorée : $1"
+        echo 0 > "${{vStatusDir}}/${{vUnit}}.rc"
+        return
+    fi
+    now_us vQueued
+    if [ "$vMaxParallel" -gt 1 ]; then
+        start_ready
+    fi
+    dep_status "$vDeps"
+    if [ "$vDepState" = "skip" ]; then
+        log "WARN" "Unité ignorée, une unité dont elle dépend est en échec : $1"
+        echo skip > "${{vStatusDir}}/${{vUnit}}.rc"
+    elif [ "$vMaxParallel" -le 1 ]; then
+        run_refresh "$@"
+        echo $? > "${{vStatusDir}}/${{vUnit}}.rc"
+    elif [ "$vDepState" = "pending" ]; then
+        vPendingDeps[$vUnit]=$vDeps
+        vPendingQueued[$vUnit]=$vQueued
+        vPendingKey[$vUnit]=$1
+        printf -v "vPendingArgs[$vUnit]" '%q ' "$@"
+    else
+        start_unit "$vUnit" "$vQueued" "$@"
+    fi
+}}
+
+# Commande de rafraîchissement commune aux unités du projet {args.project}
+# (les tables d'un autre projet de la configuration portent leur propre commande)
+vCmd=(python3 ./refreshSubEnv.py --project {args.project} --subenv {args.subenv} --target_env {args.target_env})
+
+# Une ligne par unité : numéro, dépendances, identifiant, volume estimé, watermark et paramètres de la commande
+''')
+    # Les unités arrivent dans l'ordre de leurs dépendances : les numéros des unités dont dépend 
+    # une unité sont connus lorsqu'elle est écrite
+    positions = {}
+    for i, unit in enumerate(units):
+        key = unit_id(unit)
+        positions[key] = i
+        deps = ' '.join(str(positions[dep]) for dep in unit.get('depends_on', []))
+        line = f"refresh {i} '{deps}' {key} {unit.get('est_bytes', 'null')} '{watermark_line(unit)}' {command_prefix(unit, args)} --datasets {unit['dataset_id']} --tables {unit['table_id']} {partition_params(unit)}"
+        bash_script.write(line.rstrip() + "\n")
+    bash_script.write('''
+
+# Lancement des unités restées en file au fil de la fin des unités dont elles dépendent
+while [ ${#vPendingDeps[@]} -gt 0 ]; do
+    start_ready
+    if [ ${#vPendingDeps[@]} -gt 0 ]; then
+        wait -n
+    fi
+done
+
+# Attente de la fin des rafraîchissements lancés en parallèle et collecte de leurs codes retour
+# Une unité ignorée suite à l'échec d'une unité dont elle dépend compte comme une erreur
+wait
+vSkipped=0
+for vStatusFile in "${vStatusDir}"/*.rc; do
+    [ -e "$vStatusFile" ] || continue
+    read -r vRc < "$vStatusFile"
+    if [ "$vRc" = "skip" ]; then
+        vSkipped=$((vSkipped + 1))
+        error=$((error + 1))
+    elif [ "$vRc" -ne 0 ]; then
+        error=$((error + 1))
+    fi
+done
+if [ $vSkipped -gt 0 ]; then
+    echo "Nombre d'unités ignorées (dépendance en échec) : $vSkipped"
+fi
+rm -rf "${vStatusDir}"
+''')
+
+######################################################
+# write_batch : écrit le plan d'exécution (refreshPlan.py) à côté du script bash, 
+# et l'appel unique à refreshBatch.py qui l'exécute
+# In  : script bash
+#       unités de rafraîchissement
+#       nom du script bash
+#       nom du journal des unités terminées
+#       args, arguments de la génération (projet, environnements, parallélisme, relances)
+#       fichier des watermarks (mode incrémental uniquement)
+def write_batch(bash_script, units, nom_fichier, nom_journal, args, watermarks_path=None):
+    nom_units = os.path.splitext(nom_fichier)[0] + ".jsonl"
+    write_plan(f'{args.repertoire_bash}/{nom_units}', units, {'project': args.project, 'subenv': args.subenv, 'target_env': args.target_env})
+    bash_script.write(f'''# Rafraîchissement de l'ensemble des tables dans un seul processus Python
+python3 ./refreshBatch.py --project {args.project} --subenv {args.subenv} --target_env {args.target_env} --units "${{vScriptDir}}/{nom_units}" --max_parallel {args.max_parallel} --max_retries {args.max_retries} --retry_delay {args.retry_delay} --retry_max_delay {args.retry_max_delay} --dryrun $vDryRun --journal "${{vScriptDir}}/{nom_journal}" --metrics "$vMetricsFile" --run $vTsLog $([ "$vResume" = "True" ] && echo --resume){f' --watermarks "{watermarks_path}"' if watermarks_path else ''}
+if [ $? -ne 0 ]; then
+    error=$((error + 1))
+fi
+''')
+
+######################################################
+# refresh_name : nom commun du script, du journal et des métriques d'une configuration
+# In  : dataset de la première table
+#       header_values, valeurs du header
+# Out : nom sans extension (refresh_<dataset>_<debut>_<fin>)
+def refresh_name(dataset_id, header_values):
+    return f"refresh_{dataset_id}_{header_values.get('debut_NUM', '')}_{header_values.get('fin_NUM', '')}"
+
+######################################################
+# plan_units : unités à rafraîchir pour les tables d'une configuration
+# Applique la sélection, le mode incrémental, le budget d'octets et l'ordre des dépendances
+# In  : args, arguments de la ligne de commande (build_parser) ou de make_args
+#       header_values, valeurs du header
+#       records, lignes de configuration
+#       client BigQuery du mode incrémental (None pour le créer à partir de --credpath)
+#       stream, transmet les unités au fil de l'eau lorsqu'elles n'ont pas à être triées 
+#       (exécution séquentielle sans budget d'octets)
+#       fichier des tables reportées par le budget d'octets, relu et remplacé (None pour ne pas le conserver)
+# Out : unités ordonnées (liste, ou générateur au fil de l'eau)
+#       chemin du fichier des watermarks (None hors mode incrémental)
+#       liste des unités reportées au prochain lancement
+#       Lève une RuntimeError si les règles de sélection ou le credential sont invalides
+def plan_units(args, header_values, records, client=None, stream=False, deferred_path=None):
+    # Sélection d'un sous-ensemble des tables sans modifier le fichier de configuration
+    try :
+        select = build_selector(args.include, args.exclude, args.partition_types, args.min_table_bytes, args.max_table_bytes, args.rules)
+    except (OSError, ValueError) as e:
+        raise RuntimeError(f"Règles de sélection invalides : {e}") from e
+    if select is not None:
+        records = filter(select, records)
+
+    # Mode incrémental : lecture des watermarks et connexion à BigQuery pour lire les dates de modification des partitions
+    watermarks, watermarks_path = None, None
+    if args.incremental:
+        watermarks_path = os.path.abspath(args.watermarks or f"{args.repertoire_bash}/watermarks.jsonl")
+        watermarks = load_watermarks(watermarks_path)
+        logger.info(f"Mode incrémental : {len(watermarks)} watermark(s) lu(s) dans {watermarks_path}")
+        if client is None:
+            if not args.credpath:
+                raise RuntimeError("Le mode incrémental nécessite --credpath")
+            try :
+                client = get_client(args.credpath)
+            except Exception as e:
+                raise RuntimeError("Fichier credential inexistant : "+args.credpath) from e
+    else:
+        client = None
+    units = iter_units(records, header_values, client, watermarks, args.chunk_days, args.chunk_values)
+    if stream and args.max_parallel <= 1 and not args.max_bytes:
+        return stream_units(units, args.throughput), watermarks_path, []
 
+    # Ordonnancement par volumétrie décroissante, budget d'octets et estimation de la durée
+    previous = load_deferred(deferred_path) if args.max_bytes and deferred_path else {}
+    units, deferred = schedule_units(units, args.max_parallel, args.max_bytes, previous)
+    units = order_units(units)
+    for unit in deferred:
+        if unit.get('est_bytes', 0) > args.max_bytes:
+            logger.warning(f"Unité plus volumineuse que le budget de {format_bytes(args.max_bytes)}, jamais rafraîchie sans augmenter "
+                           f"--max_bytes ou découper la table (--chunk_days, --chunk_values) : {unit_id(unit)} ({format_bytes(unit['est_bytes'])})")
+        else:
+            logger.warning(f"Unité reportée (budget de {format_bytes(args.max_bytes)} atteint) : {unit_id(unit)} ({format_bytes(unit.get('est_bytes', 0))})")
+    if deferred:
+        logger.warning(f"{len(deferred)} unité(s) reportée(s) au prochain lancement, "
+                       f"{format_bytes(sum(unit.get('est_bytes', 0) for unit in deferred))} estimés")
+    if args.max_bytes and deferred_path:
+        write_deferred(deferred_path, deferred, previous)
+    makespan, total = estimate_makespan(units, args.max_parallel, args.throughput)
+    logger.info(f"{len(units)} unité(s), {format_bytes(sum(unit.get('est_bytes', 0) for unit in units))} estimés, "
+                f"durée estimée {timedelta(seconds=int(makespan))} sur {args.max_parallel} worker(s) (cumulée {timedelta(seconds=int(total))})")
+    return units, watermarks_path, deferred
+
+######################################################
+# generate_script : génère le script bash de rafraîchissement d'un fichier de configuration
+# In  : args, arguments de la ligne de commande (build_parser) ou de make_args
+# Out : chemin du script bash généré
+#       Lève une RuntimeError si la configuration, les règles de sélection ou le credential sont invalides
+def generate_script(args):
     # Lire le fichier de configuration et extraire les valeurs du header
-    header_values = {}
+    # Le fichier est lu en une seule passe : header puis tables, au fil de l'écriture du script
     if os.path.exists(f'{args.emplacement_config}'): 
-        with open(args.emplacement_config, 'r') as config_file:
-            header_values, debut, fin = extract_header(config_file)
+        logger.info(f"Lecture du fichier de configuration")
+        config = iter_config(args.emplacement_config)
+        header_values = next(config)
     else :
-        logger.error("Fichier de configuration non existant : "+args.emplacement_config)
-        exit()
+        raise RuntimeError("Fichier de configuration non existant : "+args.emplacement_config)
 
-    with open(args.emplacement_config, 'r') as config_file:
-        lines = config_file.readlines()
-
-    # Récupère l'identifiant du dataset
-    i= 0
-    for line in lines:
-        i = i+1
-        # Ignore les lignes du header
-        if i<=6 :
-            continue
-        if i > 7 :
-            break
-        else :
-            if line.strip(): # Vérifie si la ligne n'est pas vide
-                line_data = eval(line.strip()) # Évaluer la ligne comme une expression Python
-                dataset_id = line_data['dataset_id']
+    # Récupère l'identifiant du dataset sur la première table
+    first_record = next(config, None)
+    if first_record is None:
+        raise RuntimeError("Aucune table dans le fichier de configuration : "+args.emplacement_config)
+    dataset_id = first_record['dataset_id']
+    records = itertools.chain([first_record], config)
 
     # Nomme le fichier
-    nom_fichier = f"refresh_{dataset_id}_{debut}_{fin}.sh"
-
-    # Écrire les arguments dans le fichier bash
-    logger.info("Création et remplissage du script bash")
+    nom_refresh = refresh_name(dataset_id, header_values)
+    nom_fichier = f"{nom_refresh}.sh"
+    nom_journal = f"{nom_refresh}.journal.jsonl"
+    nom_metrics = f"{nom_refresh}.metrics.jsonl"
 
     try :
         if not os.path.exists(f'{args.repertoire_bash}'): 
             logger.info(f"Création du repertoire Bash")
             os.mkdir(f'{args.repertoire_bash}')           
-    except:
-        logger.error(f"Nom de fichier déjà existant : {nom_fichier}")
-        exit()
+    except OSError as e:
+        raise RuntimeError(f"Nom de fichier déjà existant : {nom_fichier}") from e
+
+    # Les tables reportées par le budget d'octets passent en premier au lancement suivant
+    units, watermarks_path, deferred = plan_units(args, header_values, records, stream=True,
+                                                  deferred_path=f"{args.repertoire_bash}/{nom_refresh}.deferred.jsonl")
+
+    # Écrire les arguments dans le fichier bash
+    logger.info("Création et remplissage du script bash")
     with open(f'{args.repertoire_bash}/{nom_fichier}', 'w') as bash_script:
         bash_script.write('''#!/bin/bash 
 
@@ -154,13 +845,20 @@ else
     echo "Mode Dryrun activé : Test à blanc, affiche uniquement les informations"   
 fi              
 
+# Détecte la reprise d'une exécution interrompue (deuxième paramètre --resume)
+if [ "$2" = "--resume" ]; then
+    vResume=True
+else
+    vResume=False
+fi
+
 # Activation de l'environnement virtuel                          
 source ./venv/bin/activate     
 
 # Paramétrage de la fonction log
 vScriptDir="$( cd -- "$( dirname -- "${BASH_SOURCE[0]}" )" &> /dev/null && pwd )"  
 
-vTsLog=`date '+%Y%m%d_%H%M%S'`                                                                  
+printf -v vTsLog '%(%Y%m%d_%H%M%S)T' -1                                                                  
 
 vLogFile=${vScriptDir}/logs/autoRefresh_${vTsLog}.log
 vLogFileError=${vScriptDir}/logs/autoRefresh_errors_${vTsLog}.log                          
@@ -168,9 +866,10 @@ vLogFileError=${vScriptDir}/logs/autoRefresh_errors_${vTsLog}.log
 # Création d'une fonction log 
 # Cette fonction permet d'afficher des informations durant le déroulement du script  
 # Cela permet de voir les rafraîchissement qui ont fonctioné et ceux qui ont n'ont pas fonctionné                      
+# L'horodatage est obtenu par printf, sans lancer de processus date à chaque message
 function log () {
     
-    vCurrentLogDate=`date '+%Y-%m-%d %H:%M:%S'` 
+    printf -v vCurrentLogDate '%(%Y-%m-%d %H:%M:%S)T' -1
     echo "$1 - " "${vCurrentLogDate} - $2"
     
     echo "$1 - " "${vCurrentLogDate} - $2" >> ${vLogFile}
@@ -183,48 +882,42 @@ function log () {
     
 }
 
+# Horodatage courant en microsecondes, écrit dans la variable dont le nom est passé en paramètre
+# EPOCHREALTIME (bash 5) évite de lancer un processus ; à défaut, précision à la seconde
+function now_us () {
+    local vNow=${EPOCHREALTIME/[.,]/}
+    if [ -z "$vNow" ]; then
+        printf -v vNow '%(%s)T000000' -1
+    fi
+    printf -v "$1" '%s' "$vNow"
+}
+
 # Compteur d'erreur, est incrémenté de 1 à chaque fois qu'un rafraîchissement d'une table ne fonctionne pas                         
 error=0                          
 
 ''')
-        i= 0
-        for line in lines:
-            i = i+1
-            # Ignore les lignes du header
-            if i<=6 :
-                continue
-            else :
-                if line.strip(): # Vérifie si la ligne n'est pas vide
-                    line_data = eval(line.strip()) # Évaluer la ligne comme une expression Python
-                    table_id = line_data['table_id']
-                    dataset_id = line_data['dataset_id']
-                    partition_key, partition_type, partition_start, partition_end = extract_partition_info(line_data['partition_info'])
-                    # Vérifier si la table est partitionnée avant d'écrire les paramètres de partition
-                    if line_data['partition_info']['partitioned']:
-                        if partition_type == 'DAY' :
-                            partition_params = f"--partition_date_start {header_values.get('debut_DAY', '')} --partition_date_end {header_values.get('fin_DAY', '')}"
-                        else :
-                            partition_params = f"--partition_date_start {header_values.get('debut_NUM', '')} --partition_date_end {header_values.get('fin_NUM', '')}"
-                    else:
-                        partition_params = "" 
-                # Écrire la ligne de commande dans le fichier bash
-                    bash_script.write(f'''
-# Teste si mode dryrun est actif ou non : si oui => affichage seulement de la commande sans exécuter le refresh
-if [ "$vDryRun" = "True" ]; then
-    echo "python3 ./refreshSubEnv.py --project {args.project} --subenv {args.subenv} --target_env {args.target_env} --datasets {dataset_id} --tables {table_id} {partition_params} "
-else 
-    python3 ./refreshSubEnv.py --project {args.project} --subenv {args.subenv} --target_env {args.target_env} --datasets {dataset_id} --tables {table_id} {partition_params}                                        
-    if [ $? -ne 0 ]; then
-        log "ERR" "Erreur de connexion au projet {args.project}, au sous-environnement {args.subenv} ou à l'environnement cible {args.target_env}"
-        error=$((error + 1))
-    else
-        log "INFO" "Connexion au projet {args.project}, le sous-environnement est {args.subenv} et l'environnement cible est {args.target_env}"
-    fi
+        bash_script.write(f'''# Métriques de chaque unité (JSON Lines), conservées d'une exécution à l'autre
+vMetricsFile="${{vScriptDir}}/{nom_metrics}"
+now_us vRunStart
+
+''')
+        if args.batch:
+            write_batch(bash_script, units, nom_fichier, nom_journal, args, watermarks_path)
+        else:
+            write_units(bash_script, units, nom_journal, args, watermarks_path)
+        if args.prometheus:
+            bash_script.write(f'''
+# Résumé de l'exécution au format textfile Prometheus
+if [ "$vDryRun" = "False" ]; then
+    python3 ./refreshMetrics.py --metrics "$vMetricsFile" --run $vTsLog --run_start $(( vRunStart / 1000000 )) --errors $error --prometheus "{os.path.abspath(args.prometheus)}" --refresh {os.path.splitext(nom_fichier)[0]}
 fi
+''')
+        if deferred:
+            bash_script.write(f'''
+# Unités hors du budget --max_bytes, lancées en premier à la prochaine génération du script
+echo "Nombre d'unités reportées (budget de {format_bytes(args.max_bytes)} atteint) : {len(deferred)}"
 ''')
         bash_script.write('''
-
-
 if [ $error -eq 0 ]; then
     # Code retour signifiant que tous les rafraîchissements ont fonctionné
     exit 0
@@ -234,3 +927,41 @@ else
     exit 3
 fi
 ''')
+    return f'{args.repertoire_bash}/{nom_fichier}'
+
+################################################################################################################
+# main
+################################################################################################################
+if __name__ == "__main__":
+
+    args = build_parser().parse_args()
+
+    ######################################################
+    # Parametrage du logging
+    ######################################################
+
+    # création du répertoire de logs si non existant
+    curlogdir = f"{curworkdir}/logs"
+    if not os.path.exists(curlogdir):
+        os.makedirs(curlogdir)
+
+    logger.setLevel(args.log)
+
+    # create formatter
+    formatter = logging.Formatter('%(asctime)s %(name)s %(levelname)-5s %(message)s')
+
+    # create console handler with a higher log level
+    ch = logging.StreamHandler(sys.stdout)
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
+
+    # create file handler which logs even debug messages
+    fh = logging.FileHandler(args.logFile)
+    fh.setFormatter(formatter)
+    logger.addHandler(fh)
+
+    try :
+        generate_script(args)
+    except RuntimeError as e:
+        logger.error(str(e))
+        exit()
@@ -0,0 +1,322 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import os                               # import for operating system commands
+import sys                              # import system commands
+import json                             # import for json functions
+import argparse                         # use argparse to parse arguments
+import time                             # import time functions
+import logging                          # standard library for logging
+import subprocess                       # mesure du temps de démarrage des scripts
+import tempfile                         # répertoire de travail des benchmarks
+import tracemalloc                      # mesure du pic mémoire de chaque étape
+import platform
+
+from datetime import datetime
+
+from autoRefresh import generate_script, make_args
+from fakeBigquery import FakeClient
+from refreshConfig import write_config, merge_config
+from refreshDiscovery import iter_dataset_records
+
+######################################################
+# Benchmark de la génération de configuration et de la planification
+#
+# Pour chaque taille de dataset synthétique (client BigQuery en mémoire,
+# aucun accès réseau), les étapes suivantes sont mesurées :
+#   discovery    : listing des tables et volumétrie (iter_dataset_records)
+#   write_config : écriture du fichier de configuration
+#   merge        : fusion d'une production modifiée (ajouts, suppressions,
+#                  changements de partitionnement, volumétrie)
+#   plan         : génération du script bash (autoRefresh.generate_script) sur 4 workers
+#   plan_stream  : génération au fil de l'eau d'un script séquentiel
+#   plan_batch   : génération au fil de l'eau du plan d'exécution (--batch)
+# La durée retenue est la meilleure de --repeat exécutions ; le pic mémoire
+# est mesuré par tracemalloc sur une exécution supplémentaire, la mesure
+# ralentissant l'exécution.
+#
+# Le temps de démarrage des scripts est mesuré dans un nouvel interpréteur :
+# --help, import de l'API sans chargement des librairies Google et chemin
+# dryrun (génération d'un script --batch sur 100 tables puis refreshBatch.py
+# en dryrun). Chaque démarrage doit rester sous --startup_target secondes.
+# Les résultats sont comparés à une référence.
+######################################################
+
+curworkdir = os.getcwd()
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+BENCH_PROJECT = 'bench-project'
+BENCH_DATASET = 'bench'
+BENCH_HEADER = {'debut_DAY': '2024-01-01', 'fin_DAY': '2024-01-31', 'debut_NUM': '1', 'fin_NUM': '31'}
+
+# Écarts en dessous desquels une variation n'est pas une régression (bruit de mesure)
+MIN_WALL_DELTA = 0.01
+MIN_PEAK_DELTA = 1024 * 1024
+
+# Temps de démarrage cible en secondes des chemins --help et dryrun
+STARTUP_TARGET = 0.3
+
+# Import de l'API, en échec si une librairie Google est chargée
+IMPORT_CHECK = "import sys, autoRefresh, createRefreshConfigFile; sys.exit(any(name.split('.')[0] == 'google' for name in sys.modules))"
+
+# Nombre de tables de la configuration du chemin dryrun
+STARTUP_TABLES = 100
+
+######################################################
+# Fonctions
+######################################################
+
+######################################################
+# measure : durée et pic mémoire d'une étape
+# In  : préparation exécutée avant chaque mesure (non mesurée), None si aucune
+#       étape à mesurer
+#       nombre d'exécutions pour la durée
+# Out : dictionnaire {wall : meilleure durée en secondes, peak : pic mémoire en octets}
+def measure(setup, stage, repeat):
+    walls = []
+    for i in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        stage()
+        walls.append(time.perf_counter() - start)
+    if setup:
+        setup()
+    tracemalloc.start()
+    try:
+        stage()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'wall': min(walls), 'peak': peak}
+
+######################################################
+# mutate_records : production modifiée pour l'étape de fusion
+# 1% des tables supprimées, 1% ajoutées, 1% changent de partitionnement et
+# la volumétrie de toutes les tables évolue
+# In  : tables découvertes
+# Out : nouvelle liste de tables
+def mutate_records(records):
+    step = 100
+    mutated = []
+    for i, record in enumerate(records):
+        if i % step == 0:
+            continue
+        record = dict(record)
+        if i % step == 1:
+            record['partition_info'] = {'partitioned': False}
+        if record.get('size_info'):
+            record['size_info'] = dict(record['size_info'], num_bytes=record['size_info']['num_bytes'] + 1)
+        mutated.append(record)
+    for i in range(max(1, len(records) // step)):
+        mutated.append({'table_id': f"new_table_{i:06d}", 'dataset_id': BENCH_DATASET, 'partition_info': {'partitioned': False}})
+    return mutated
+
+######################################################
+# time_command : meilleure durée d'une commande Python lancée dans un nouvel interpréteur
+# In  : arguments de l'interpréteur
+#       nombre d'exécutions
+#       répertoire de travail (logs des scripts)
+# Out : durée en secondes
+#       Lève une RuntimeError si la commande échoue
+def time_command(argv, repeat, work_dir):
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=script_dir)
+    walls = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        completed = subprocess.run([sys.executable] + argv, cwd=work_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        walls.append(time.perf_counter() - start)
+        if completed.returncode != 0:
+            raise RuntimeError(f"{' '.join(argv)} : code retour {completed.returncode} {completed.stderr.decode(errors='replace').strip()}")
+    return min(walls)
+
+######################################################
+# bench_startup : temps de démarrage des chemins --help et dryrun
+# In  : nombre d'exécutions
+#       répertoire de travail
+#       graine du générateur
+# Out : dictionnaire chemin -> {wall : durée en secondes}
+def bench_startup(repeat, work_dir, seed):
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    client = FakeClient(BENCH_PROJECT, {BENCH_DATASET: STARTUP_TABLES}, seed)
+    config_path = os.path.join(work_dir, 'config_startup.txt')
+    write_config(config_path, BENCH_HEADER, iter_dataset_records(client, [BENCH_DATASET]))
+    bash_dir = os.path.join(work_dir, 'startup')
+    commands = {
+        'help_autoRefresh': [os.path.join(script_dir, 'autoRefresh.py'), '--help'],
+        'help_createRefreshConfigFile': [os.path.join(script_dir, 'createRefreshConfigFile.py'), '--help'],
+        'help_refreshBatch': [os.path.join(script_dir, 'refreshBatch.py'), '--help'],
+        'import_api': ['-c', IMPORT_CHECK],
+        'dryrun_plan': [os.path.join(script_dir, 'autoRefresh.py'), '--project', BENCH_PROJECT, '--subenv', 'bench', '--target_env', 'bench',
+                        '--log', 'WARNING', '--repertoire_bash', bash_dir, '--emplacement_config', config_path, '--batch'],
+        'dryrun_batch': [os.path.join(script_dir, 'refreshBatch.py'), '--project', BENCH_PROJECT, '--subenv', 'bench', '--target_env', 'bench',
+                         '--log', 'WARNING', '--units', os.path.join(bash_dir, 'refresh_bench_1_31.jsonl'), '--dryrun', 'True']
+    }
+    return {name: {'wall': time_command(argv, repeat, work_dir)} for name, argv in commands.items()}
+
+######################################################
+# bench_size : mesure des étapes pour un dataset de num_tables tables
+# In  : nombre de tables
+#       nombre d'exécutions par étape
+#       répertoire de travail
+#       graine du générateur
+# Out : dictionnaire étape -> mesures
+def bench_size(num_tables, repeat, work_dir, seed):
+    client = FakeClient(BENCH_PROJECT, {BENCH_DATASET: num_tables}, seed)
+    config_path = os.path.join(work_dir, f"config_{num_tables}.txt")
+    results = {}
+
+    records = []
+    def discovery():
+        records[:] = iter_dataset_records(client, [BENCH_DATASET])
+    results['discovery'] = measure(None, discovery, repeat)
+
+    results['write_config'] = measure(None, lambda: write_config(config_path, BENCH_HEADER, records), repeat)
+
+    prod_records = mutate_records(records)
+    results['merge'] = measure(lambda: write_config(config_path, BENCH_HEADER, records),
+                               lambda: merge_config(config_path, prod_records), repeat)
+
+    plan_args = make_args(project=BENCH_PROJECT, subenv='bench', target_env='bench', repertoire_bash=os.path.join(work_dir, 'scripts'),
+                          emplacement_config=config_path, max_parallel=4)
+    results['plan'] = measure(None, lambda: generate_script(plan_args), repeat)
+
+    # Exécution séquentielle : unités écrites au fil de l'eau dans le script et dans le plan --batch
+    plan_args = make_args(project=BENCH_PROJECT, subenv='bench', target_env='bench', repertoire_bash=os.path.join(work_dir, 'scripts'),
+                          emplacement_config=config_path)
+    results['plan_stream'] = measure(None, lambda: generate_script(plan_args), repeat)
+    plan_args.batch = True
+    results['plan_batch'] = measure(None, lambda: generate_script(plan_args), repeat)
+    return results
+
+######################################################
+# compare : compare les mesures à la référence
+# In  : résultats courants
+#       résultats de référence
+#       tolérance relative (0.25 pour +25%)
+# Out : liste des régressions (taille ou "startup", étape, métrique, valeur de référence, valeur courante)
+def compare(results, baseline, tolerance):
+    regressions = []
+    sizes = dict(results['sizes'])
+    baseline_sizes = dict(baseline.get('sizes', {}))
+    if 'startup' in results:
+        sizes['startup'] = results['startup']
+        baseline_sizes['startup'] = baseline.get('startup', {})
+    for size, stages in sizes.items():
+        for stage, metrics in stages.items():
+            reference = baseline_sizes.get(size, {}).get(stage)
+            if reference is None:
+                continue
+            for metric, min_delta in [('wall', MIN_WALL_DELTA), ('peak', MIN_PEAK_DELTA)]:
+                if metric not in metrics or metric not in reference:
+                    continue
+                if metrics[metric] > reference[metric] * (1 + tolerance) and metrics[metric] - reference[metric] > min_delta:
+                    regressions.append((size, stage, metric, reference[metric], metrics[metric]))
+    return regressions
+
+######################################################
+# format_metric : valeur lisible d'une mesure
+# In  : métrique (wall ou peak)
+#       valeur
+# Out : chaîne
+def format_metric(metric, value):
+    if metric == 'wall':
+        return f"{value * 1000:.1f} ms"
+    return f"{value / (1024 * 1024):.1f} Mo"
+
+################################################################################################################
+# main
+################################################################################################################
+if __name__ == "__main__":
+
+    ######################################################
+    # Parametrage du parser d'arguments
+    ######################################################
+
+    parser=argparse.ArgumentParser()
+    parser.add_argument('--log', help='Log level', choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"], default="INFO")
+    parser.add_argument('--sizes', nargs='+', help='Nombres de tables des datasets synthétiques', type=int, default=[100, 1000, 10000, 50000])
+    parser.add_argument('--repeat', help='Nombre d\'exécutions par étape, la meilleure durée est retenue', type=int, default=3)
+    parser.add_argument('--seed', help='Graine de génération des datasets synthétiques', type=int, default=0)
+    parser.add_argument('--baseline', help='Fichier JSON des résultats de référence', default=curworkdir+"/benchBaseline.json")
+    parser.add_argument('--save_baseline', help='Enregistre les résultats comme nouvelle référence', action='store_true')
+    parser.add_argument('--tolerance', help='Dégradation relative tolérée par rapport à la référence', type=float, default=0.25)
+    parser.add_argument('--startup_target', help='Temps de démarrage maximum en secondes des chemins --help et dryrun', type=float, default=STARTUP_TARGET)
+    parser.add_argument('--skip_startup', help='Ne mesure pas le temps de démarrage des scripts', action='store_true')
+    parser.add_argument('--output', help='Fichier JSON des résultats')
+    parser.add_argument('--logFile', help='Path du fichier de log', default=curworkdir+"/logs/"+os.path.splitext(os.path.basename(__file__))[0]+time.strftime("_%Y%m%d_%H%M%S")+".log")
+
+    args = parser.parse_args()
+
+    ######################################################
+    # Parametrage du logging
+    ######################################################
+
+    # création du répertoire de logs si non existant
+    curlogdir = f"{curworkdir}/logs"
+    if not os.path.exists(curlogdir):
+        os.makedirs(curlogdir)
+
+    logger.setLevel(args.log)
+
+    # create formatter
+    formatter = logging.Formatter('%(asctime)s %(name)s %(levelname)-5s %(message)s')
+
+    # create console handler with a higher log level
+    ch = logging.StreamHandler(sys.stdout)
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
+
+    # create file handler which logs even debug messages
+    fh = logging.FileHandler(args.logFile)
+    fh.setFormatter(formatter)
+    logger.addHandler(fh)
+
+    results = {'at': datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(),
+               'repeat': args.repeat, 'seed': args.seed, 'sizes': {}}
+    with tempfile.TemporaryDirectory() as work_dir:
+        for num_tables in args.sizes:
+            logger.info(f"Benchmark sur {num_tables} tables")
+            stages = bench_size(num_tables, args.repeat, work_dir, args.seed)
+            results['sizes'][str(num_tables)] = stages
+            for stage, metrics in stages.items():
+                logger.info(f"  {stage:<13} {format_metric('wall', metrics['wall']):>12} {format_metric('peak', metrics['peak']):>10}")
+        slow_startups = []
+        if not args.skip_startup:
+            logger.info(f"Temps de démarrage (cible {args.startup_target:.2f}s)")
+            try :
+                results['startup'] = bench_startup(args.repeat, work_dir, args.seed)
+            except RuntimeError as e:
+                logger.error(f"Échec de la mesure du démarrage : {e}")
+                sys.exit(3)
+            for name, metrics in results['startup'].items():
+                logger.info(f"  {name:<29} {format_metric('wall', metrics['wall']):>12}")
+                if metrics['wall'] > args.startup_target:
+                    slow_startups.append(name)
+                    logger.error(f"Démarrage au-delà de la cible : {name} ({format_metric('wall', metrics['wall'])})")
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+        logger.info(f"Référence enregistrée : {args.baseline}")
+        sys.exit(3 if slow_startups else 0)
+
+    if not os.path.exists(args.baseline):
+        logger.warning(f"Pas de référence à comparer : {args.baseline} (utiliser --save_baseline)")
+        sys.exit(3 if slow_startups else 0)
+    with open(args.baseline, 'r') as baseline_file:
+        baseline = json.load(baseline_file)
+    regressions = compare(results, baseline, args.tolerance)
+    for size, stage, metric, reference, value in regressions:
+        logger.error(f"Régression {stage} sur {size} tables : {format_metric(metric, reference)} -> {format_metric(metric, value)}")
+    if regressions or slow_startups:
+        logger.error(f"Nombre de régressions : {len(regressions) + len(slow_startups)} (référence du {baseline.get('at')})")
+        sys.exit(3)
+    logger.info(f"Aucune régression par rapport à la référence du {baseline.get('at')}")
+    sys.exit(0)
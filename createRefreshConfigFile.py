@@ -9,122 +9,81 @@ import time                             # import time functions
 import logging                          # standard library for logging   
 import pathlib             
 
-from google.oauth2 import service_account
-from google.cloud import bigquery
-
-from deepdiff import DeepDiff
 from datetime import datetime
 
-######################################################
-# Parametrage du parser d'arguments
-###################################################### 
+from refreshConfig import write_header, write_record, write_config, merge_config, config_has_project
+from refreshDiscovery import parse_dataset_ref, iter_dataset_records
+from refreshSelection import build_selector, legacy_patterns
 
 curworkdir = os.getcwd()
 
-parser=argparse.ArgumentParser()
-parser.add_argument('--log', help='Log level', choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"], default="INFO")
-parser.add_argument('--dataset', help='Dataset Name', required=True)
-parser.add_argument('--credpath', help='Path du credential GCP de production (Production sa-replication.json)', required=True)
-parser.add_argument('--repertoire_config', help='Nom du répertoire de configuration', required=True)
-parser.add_argument('--fichier_config', help='Nom du fichier de configuration', required=True)
-parser.add_argument('--exceptions', nargs='+', help='Liste des tables à ignorer')
-parser.add_argument('--logFile', help='Path du fichier de log', default=curworkdir+"/logs/"+os.path.splitext(os.path.basename(__file__))[0]+time.strftime("_%Y%m%d_%H%M%S")+".log")
-
-args = parser.parse_args()
-
-######################################################
-# Parametrage du logging
-######################################################
-
-# création du répertoire de logs si non existant
-curlogdir = f"{curworkdir}/logs"
-if not os.path.exists(curlogdir):
-    os.makedirs(curlogdir)
-
-# create logger
 logger = logging.getLogger(os.path.basename(__file__))
-logger.setLevel(args.log)
-
-# create formatter
-formatter = logging.Formatter('%(asctime)s %(name)s %(levelname)-5s %(message)s')
-
-# create console handler with a higher log level
-ch = logging.StreamHandler(sys.stdout)
-ch.setFormatter(formatter)
-logger.addHandler(ch)
-
-# create file handler which logs even debug messages
-fh = logging.FileHandler(args.logFile)
-fh.setFormatter(formatter)
-logger.addHandler(fh)
-
 
 ######################################################
 # Fonctions
 ######################################################
 
 ######################################################
-# get_tables_list : lister pour un datset la liste de ses tables
-# In  : Bigquery client 
-#     : Dataset spécifié
-# Out : tables list
-def get_tables_list(client, dataset_name):
-    tables_list = []
-    dataset = client.get_dataset(dataset_name)
-    # Liste des tables dans le dataset spécifié
-    tables = client.list_tables(dataset)
-    for table in tables:
-        tables_list.append(table)
-    return tables_list
+# build_parser : parser des arguments de la ligne de commande
+# Out : ArgumentParser
+def build_parser():
+    parser=argparse.ArgumentParser()
+    parser.add_argument('--log', help='Log level', choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"], default="INFO")
+    parser.add_argument('--dataset', nargs='+', help='Nom des datasets, préfixés par le projet (projet.dataset) pour un projet autre que celui du credential', required=True)
+    parser.add_argument('--max_workers', help='Nombre de datasets listés en parallèle', type=int, default=8)
+    parser.add_argument('--page_size', help='Nombre de tables par page de listing (défaut de l\'API si absent)', type=int)
+    parser.add_argument('--cache_dir', help='Répertoire du cache des métadonnées de datasets (pas de cache si absent)')
+    parser.add_argument('--cache_ttl', help='Durée de validité du cache en secondes', type=int, default=86400)
+    parser.add_argument('--cache_max_entries', help='Nombre maximum de datasets conservés dans le cache', type=int, default=500)
+    parser.add_argument('--credpath', help='Path du credential GCP de production (Production sa-replication.json)', required=True)
+    parser.add_argument('--repertoire_config', help='Nom du répertoire de configuration', required=True)
+    parser.add_argument('--fichier_config', help='Nom du fichier de configuration', required=True)
+    parser.add_argument('--exceptions', nargs='+', help='Tables dont le nom contient la valeur à ignorer (ancien comportement, utiliser --exclude pour les globs)')
+    parser.add_argument('--include', nargs='+', help='Tables à retenir : globs ou expressions régulières préfixées par re: (toutes si absent)')
+    parser.add_argument('--exclude', nargs='+', help='Tables à ignorer : globs ou expressions régulières préfixées par re:')
+    parser.add_argument('--partition_types', nargs='+', help='Types de partitionnement retenus (DAY, NUMBER, ..., NONE pour les tables non partitionnées)')
+    parser.add_argument('--min_table_bytes', help='Taille minimale des tables retenues en octets', type=int)
+    parser.add_argument('--max_table_bytes', help='Taille maximale des tables retenues en octets', type=int)
+    parser.add_argument('--rules', help='Fichier de règles de sélection (include=, exclude=, partition_type=, min_bytes=, max_bytes=)')
+    parser.add_argument('--snapshot', help='Enregistre également la liste de production dans un fichier horodaté <date>.txt', action='store_true')
+    parser.add_argument('--logFile', help='Path du fichier de log', default=curworkdir+"/logs/"+os.path.splitext(os.path.basename(__file__))[0]+time.strftime("_%Y%m%d_%H%M%S")+".log")
+    return parser
 
 ######################################################
 # save_file : enregistrer la liste des tables avec
 # les informations complémentaires dans le 
-# fichier de configuration
+# fichier de configuration (une ligne JSON par table)
 # In  : Liste de Tables
 #       fichier de configuration
 def save_file(tables_info, file):
     for table_info in tables_info:
-        file.write(str(table_info) + "\n")
+        write_record(file, table_info)
     file.close()
     
 ######################################################
-# get_partition : vérifie si la table est partitionnée
-# si c'est le cas, renvoie la clé de partition et son 
-# type. Sinon, renvoie False
-# In  : Table
-# Out : infos de partition (clé de partition et type)
-def get_partition(table):
-    partition_info = {}
-    if table.partitioning_type:
-        partition_info['partitioned'] = True
-        partition_info['partition_key'] = table.time_partitioning.field
-        partition_info['partition_type'] = table.time_partitioning.type_
+# log_merge_summary : trace le résumé de la fusion du fichier de configuration
+# In  : tables ajoutées, supprimées et modifiées
+def log_merge_summary(added, removed, changed):
+    if added or removed or changed:
+        logger.info(f"Mise à jour du fichier de configuration : {len(added)} table(s) ajoutée(s), {len(removed)} supprimée(s), {len(changed)} modifiée(s)")
+        for record in added:
+            logger.debug(f"  + {record['dataset_id']}.{record['table_id']}")
+        for record in removed:
+            logger.debug(f"  - {record['dataset_id']}.{record['table_id']}")
+        for old_record, new_record in changed:
+            logger.debug(f"  ~ {new_record['dataset_id']}.{new_record['table_id']} : {old_record['partition_info']} -> {new_record['partition_info']}")
     else:
-        partition_info['partitioned'] = False
-
-    return partition_info
-
-######################################################
-# ignore_tables : vérifie si une table doit être 
-# ignorée selon les règles d'exception
-# In  : Table name
-#       Liste d'exceptions
-# Out : True si la table doit être ignorée, False sinon
-def ignore_tables(table_name, exceptions):
-    if exceptions is not None :
-        for exception in exceptions :
-                if exception in table_name :
-                    return True
-    return False
+        logger.info("Aucune mise à jour nécessaire du fichier de configuration")
 
 ######################################################
 # lecture credential json pour extraire le projet GCP et le mail du compte de service
+# Les librairies Google ne sont chargées qu'à l'authentification
 # In  : json credential auth GCP
 # Out : GCP project ID
 #       Service account email
 #       GCP Credential 
 def get_credential( json_cred_file):
+    from google.oauth2 import service_account
     # lecture du json
     with open(json_cred_file) as cred_file:
       data = json.load(cred_file)
@@ -139,14 +98,102 @@ def get_credential( json_cred_file):
     
     return project_id, sa_account, gcp_cred
 
+######################################################
+# listed_datasets : datasets listés par une exécution, au format des clés du fichier de configuration
+# In  : Bigquery client
+#       liste de références de datasets ("dataset" ou "projet.dataset")
+# Out : ensemble des (project_id, dataset_id), le projet du client pour une référence sans projet
+def listed_datasets(client, dataset_refs):
+    listed = set()
+    for dataset_ref in dataset_refs:
+        project_id, dataset_id = parse_dataset_ref(dataset_ref)
+        listed.add((project_id or client.project, dataset_id))
+    return listed
 
+######################################################
+# update_config : crée ou met à jour le fichier de configuration à partir des tables de production
+# In  : Bigquery client
+#       liste de références de datasets ("dataset" ou "projet.dataset")
+#       chemin du fichier de configuration
+#       select, filtre de sélection des tables (build_selector) ou None
+#       nombre de threads de listing
+#       taille de page
+#       cache, dictionnaire des paramètres du cache (cache_dir, ttl, max_entries) ou None
+#       chemin du fichier horodaté de la liste de production (None pour ne pas l'écrire)
+# Out : tables ajoutées, supprimées et modifiées, None si le fichier a été créé
+#       Lève une RuntimeError si un dataset n'a pas pu être listé
+def update_config(client, dataset_refs, config_path, select=None, max_workers=8, page_size=None, cache=None, snapshot_path=None):
+    # Récupération de la liste des tables, les datasets sont listés en parallèle 
+    # et les tables transmises page par page à l'écriture du fichier de configuration
+    logger.info(f"Récupération des tables de {len(dataset_refs)} dataset(s)")
+    # Les lignes portent leur projet si un dataset d'un autre projet est listé, ou si
+    # le fichier de configuration existant les porte déjà (exécution précédente multi-projets)
+    with_project = any(parse_dataset_ref(dataset_ref)[0] for dataset_ref in dataset_refs)
+    if not with_project and os.path.exists(config_path):
+        with_project = config_has_project(config_path)
+    tables_info = iter_dataset_records(client, dataset_refs, max_workers, page_size, with_project, cache)
+    if select is not None:
+        tables_info = filter(select, tables_info)
+    if snapshot_path:
+        tables_info = list(tables_info)
 
+    # Enregistrement de la liste dans le fichier configuration
+    # Crée le fichier s'il n'existe pas, sinon fusionne la liste de production dans le fichier existant
+    result = None
+    if not os.path.exists(config_path):
+        config_dir = os.path.dirname(config_path)
+        if config_dir and not os.path.exists(config_dir):
+            logger.info(f"Création du répertoire configuration")
+            os.mkdir(config_dir)
+        logger.info(f"Création du fichier configuration")
+        write_config(config_path, None, tables_info)
+    else:
+        # Compare les tables de production et celles du fichier configuration actuel, par (dataset_id, table_id)
+        # Les tables des datasets non listés par cette exécution sont conservées, une table sans 
+        # project_id est rapprochée de la même table portant le projet du client
+        logger.info(f"Comparaison des tables de production et du fichier de configuration")
+        result = merge_config(config_path, tables_info, listed_datasets(client, dataset_refs), client.project)
+        log_merge_summary(*result)
+
+    # Enregistrement optionnel des informations de production dans un fichier horodaté
+    if snapshot_path:
+        logger.info(f"Enregistrement de la liste de production : {os.path.basename(snapshot_path)}")
+        with open(snapshot_path, 'w') as file:
+            write_header(file)
+            save_file(tables_info, file)
+    return result
 
 ################################################################################################################
 # main
 ################################################################################################################
 if __name__ == "__main__":
 
+    args = build_parser().parse_args()
+
+    ######################################################
+    # Parametrage du logging
+    ######################################################
+
+    # création du répertoire de logs si non existant
+    curlogdir = f"{curworkdir}/logs"
+    if not os.path.exists(curlogdir):
+        os.makedirs(curlogdir)
+
+    logger.setLevel(args.log)
+
+    # create formatter
+    formatter = logging.Formatter('%(asctime)s %(name)s %(levelname)-5s %(message)s')
+
+    # create console handler with a higher log level
+    ch = logging.StreamHandler(sys.stdout)
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
+
+    # create file handler which logs even debug messages
+    fh = logging.FileHandler(args.logFile)
+    fh.setFormatter(formatter)
+    logger.addHandler(fh)
+
     # Récupération du projet GCP
     # Authentification GCP avec credential json 
     logger.info(f"Lecture GCP credential")
@@ -156,109 +203,31 @@ if __name__ == "__main__":
         logger.error("Fichier credential inexistant : "+args.credpath)
         exit()
 
-    # Ajout de périodes au fichier credential
-
+    # Le client BigQuery n'est chargé que pour la découverte
+    from google.cloud import bigquery
     client = bigquery.Client(credentials = gcp_credentials, project = gcp_project_id)
 
-    # Récupération de la liste des tables
-    logger.info("Récupération des tables")
+    # Règles de sélection des tables, compilées une seule fois
+    # --exceptions garde son comportement historique (nom contenant la valeur)
     try :
-        tables_list = get_tables_list(client, args.dataset)
-    except :
-        print("Dataset non présent dans le projet")
+        select = build_selector(args.include, (args.exclude or []) + legacy_patterns(args.exceptions), args.partition_types,
+                                args.min_table_bytes, args.max_table_bytes, args.rules)
+    except (OSError, ValueError) as e:
+        logger.error(f"Règles de sélection invalides : {e}")
         exit()
 
-    # Liste pour stocker les informations des tables et de partitionnement
-    tables_info = []
-
-    # Liste des tables à ignorer
-    exceptions = args.exceptions 
-    
-    # Obtention des informations sur le partitionnement pour chaque table
-    logger.info(f"Obtention des informations sur le partitionnement pour chaque table")
-    for table in tables_list:
-        partition_info = get_partition(table)
-        table_name = table.table_id
-        # Vérifier si la table doit être ignorée
-        if not ignore_tables(table_name, exceptions):
-            if  table.partitioning_type: 
-                if table.time_partitioning.type_ == 'DAY': 
-                    partition_info['date_debut'] = "debut_DAY"
-                    partition_info['date_fin'] = "fin_DAY"
-                elif table.time_partitioning.type_ == 'NUMBER':
-                    partition_info['date_debut'] = "debut_NUM"
-                    partition_info['date_fin'] = "fin_NUM"
-            tables_info.append({
-                'table_id': table_name,
-                'dataset_id': table.dataset_id,
-                'partition_info': partition_info
-            })
-
-
-    # Enregistrement de la liste dans le fichier configuration
-    # Ouvre le fichier si il existe, le crée sinon
-    if not os.path.exists(f'{args.repertoire_config}/{args.fichier_config}'): 
-        try :
-            logger.info(f"Création du fichier configuration")
-            file =  open(f'{args.repertoire_config}/{args.fichier_config}', 'w')
-        except :
-            logger.info(f"Création du répertoire configuration")
-            os.mkdir(f'{args.repertoire_config}')
-            logger.info(f"Création du fichier configuration")
-            file =  open(f'{args.repertoire_config}/{args.fichier_config}', 'w')
-        file.write('---HEADER--- \n')
-        file.write('debut_DAY=\n')
-        file.write('fin_DAY=\n')
-        file.write('debut_NUM=\n')
-        file.write('fin_NUM=\n')
-        file.write('-----------\n')
-        save_file(tables_info, file)
-
-    # Création du nom de fichier avec horodatage
-    date = time.strftime('%Y_%m_%d_%H_%M_%S')
-    fichier_prod = f"{date}.txt"
-    # Enregistrement des informations du fichier de production avec le nouveau nom
-    with open(f'{args.repertoire_config}/{fichier_prod}', 'w') as file:
-        file.write('---HEADER--- \n')
-        file.write('debut_DAY=\n')
-        file.write('fin_DAY=\n')
-        file.write('debut_NUM=\n')
-        file.write('fin_NUM=\n')
-        file.write('-----------\n')
-        save_file(tables_info, file)
-
-
-    # Compare le fichier de production et le fichier configuration actuel afin de corriger les éventuelles erreurs
-    logger.info(f"Comparaison des fichiers de production et de configuration")
-
-    # Chargement du contenu du fichier de production
-    with open(f'{args.repertoire_config}/{fichier_prod}', 'r') as file:
-        prod_content = file.read()
+    # Les datasets dont la date de modification n'a pas changé sont lus depuis le cache
+    cache = None
+    if args.cache_dir:
+        cache = {'cache_dir': args.cache_dir, 'ttl': args.cache_ttl, 'max_entries': args.cache_max_entries}
 
-    # Chargement du contenu du fichier de configuration
-    with open(f'{args.repertoire_config}/{args.fichier_config}', 'r') as file:
-        conf_content = file.read()
+    snapshot_path = None
+    if args.snapshot:
+        snapshot_path = f"{args.repertoire_config}/{time.strftime('%Y_%m_%d_%H_%M_%S')}.txt"
 
-    # Utilisation de DeepDiff pour comparer les contenus des fichiers
-    diff = DeepDiff(prod_content, conf_content)
-
-   # Vérification s'il y a des différences entre les fichiers
-    if diff:
-        logger.info("Mise à jour nécessaire du fichier de configuration")
-        # Charger les nouvelles données du fichier de production
-        new_data = prod_content.split('\n')
-        with open(f'{args.repertoire_config}/{args.fichier_config}', 'r') as file:
-            conf_lines = file.readlines()
-        # Écrire uniquement les nouvelles données dans le fichier de configuration
-            i = 0
-            for data in new_data:
-                # Passe le header
-                i = i+1
-                if i<=6 :
-                    continue
-                else : 
-                    if data not in conf_content:
-                        file.write(data + '\n') 
-
-    else:
-        logger.info("Aucune mise à jour nécessaire du fichier de configuration")
\ No newline at end of file
+    try :
+        update_config(client, args.dataset, f'{args.repertoire_config}/{args.fichier_config}', select,
+                      args.max_workers, args.page_size, cache, snapshot_path)
+    except RuntimeError as e:
+        logger.error(f"Dataset non présent dans le projet ou inaccessible : {e}")
+        exit()
@@ -0,0 +1,185 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import random                           # génération reproductible des datasets synthétiques
+
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from refreshPartitions import TIME_TYPES, PARTITION_ID_FORMATS, add_partitions
+
+######################################################
+# Client BigQuery en mémoire pour les benchmarks
+#
+# FakeClient reproduit le sous-ensemble de bigquery.Client utilisé par
+# refreshDiscovery.py et refreshIncremental.py : get_dataset, list_tables
+# (pagination par .pages) et query(...).result() pour les requêtes sur
+# __TABLES__, INFORMATION_SCHEMA.PARTITIONS et INFORMATION_SCHEMA.VIEWS.
+# Les datasets sont générés de façon déterministe à partir d'une graine,
+# sans accès réseau.
+######################################################
+
+# Répartition des types de partitionnement des tables générées (NUMBER : plage d'entiers)
+PARTITION_MIX = [(None, 0.4), ('DAY', 0.35), ('HOUR', 0.04), ('MONTH', 0.04), ('YEAR', 0.02), ('NUMBER', 0.15)]
+
+# Proportion des tables partitionnées par date d'ingestion parmi les tables à partitionnement temporel
+INGESTION_RATIO = 0.1
+
+# Intervalles possibles des plages d'entiers
+RANGE_INTERVALS = [1, 10, 100]
+
+# Nombre maximum de partitions d'une table générée
+MAX_PARTITIONS = {'MONTH': 240, 'YEAR': 20}
+DEFAULT_MAX_PARTITIONS = 3650
+
+# Proportion de vues, chacune référençant une à trois tables générées avant elle
+VIEW_RATIO = 0.05
+
+# Taille de page par défaut de list_tables
+DEFAULT_PAGE_SIZE = 1000
+
+######################################################
+# Fonctions
+######################################################
+
+######################################################
+# fake_table : table synthétique
+# In  : projet, dataset, nom de la table
+#       type de partitionnement (None pour une table non partitionnée, NUMBER pour une plage d'entiers)
+#       volumétrie (num_bytes, num_rows, num_partitions)
+#       requête de la vue (None pour une table)
+#       partitionnement par date d'ingestion (pas de colonne de partitionnement)
+#       intervalle de la plage d'entiers
+# Out : objet exposant les attributs de bigquery.Table lus par la découverte
+def fake_table(project, dataset_id, table_id, partition_type, size_info, view_query=None, ingestion_time=False, interval=1):
+    time_partitioning, range_partitioning = None, None
+    if partition_type in TIME_TYPES:
+        time_partitioning = SimpleNamespace(field=None if ingestion_time else f"{table_id}_part", type_=partition_type)
+    elif partition_type is not None:
+        partition_range = SimpleNamespace(start=0, end=max(1, size_info['num_partitions']) * interval, interval=interval)
+        range_partitioning = SimpleNamespace(field=f"{table_id}_part", range_=partition_range)
+    return SimpleNamespace(project=project, dataset_id=dataset_id, table_id=table_id,
+                           partitioning_type=time_partitioning.type_ if time_partitioning else None,
+                           time_partitioning=time_partitioning, range_partitioning=range_partitioning,
+                           size_info=size_info, view_query=view_query)
+
+######################################################
+# generate_dataset : tables synthétiques d'un dataset
+# In  : projet, dataset
+#       nombre de tables
+#       graine du générateur aléatoire
+# Out : liste de tables
+def generate_dataset(project, dataset_id, num_tables, seed=0):
+    rng = random.Random(f"{seed}:{project}.{dataset_id}")
+    types = [partition_type for partition_type, weight in PARTITION_MIX]
+    weights = [weight for partition_type, weight in PARTITION_MIX]
+    tables = []
+    for i in range(num_tables):
+        if i > 0 and rng.random() < VIEW_RATIO:
+            sources = rng.sample(tables, min(len(tables), rng.randint(1, 3)))
+            view_query = f"SELECT * FROM `{project}.{dataset_id}.{sources[0].table_id}`"
+            for source in sources[1:]:
+                view_query += f" JOIN {dataset_id}.{source.table_id} USING (id)"
+            size_info = {'num_bytes': 0, 'num_rows': 0, 'num_partitions': 0}
+            tables.append(fake_table(project, dataset_id, f"view_{i:06d}", None, size_info, view_query))
+            continue
+        partition_type = rng.choices(types, weights)[0]
+        num_partitions = rng.randint(1, MAX_PARTITIONS.get(partition_type, DEFAULT_MAX_PARTITIONS)) if partition_type else 0
+        num_rows = rng.randint(0, 10**8)
+        size_info = {'num_bytes': num_rows * rng.randint(50, 500), 'num_rows': num_rows, 'num_partitions': num_partitions}
+        ingestion_time = partition_type in TIME_TYPES and rng.random() < INGESTION_RATIO
+        interval = rng.choice(RANGE_INTERVALS) if partition_type == 'NUMBER' else 1
+        tables.append(fake_table(project, dataset_id, f"table_{i:06d}", partition_type, size_info, None, ingestion_time, interval))
+    return tables
+
+######################################################
+# FakeClient : client BigQuery en mémoire
+######################################################
+class FakeClient:
+
+    ######################################################
+    # __init__ : création des datasets synthétiques
+    # In  : projet par défaut
+    #       dictionnaire dataset -> nombre de tables ("dataset" ou "projet.dataset")
+    #       graine du générateur aléatoire
+    def __init__(self, project, datasets, seed=0):
+        self.project = project
+        self.datasets = {}
+        modified = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        for dataset_ref, num_tables in datasets.items():
+            project_id, dataset_id = dataset_ref.split('.', 1) if '.' in dataset_ref else (project, dataset_ref)
+            self.datasets[(project_id, dataset_id)] = SimpleNamespace(
+                project=project_id, dataset_id=dataset_id, modified=modified,
+                tables=generate_dataset(project_id, dataset_id, num_tables, seed))
+
+    ######################################################
+    # get_dataset : métadonnées d'un dataset
+    # In  : référence "dataset" ou "projet.dataset"
+    # Out : dataset (project, dataset_id, modified)
+    def get_dataset(self, dataset_ref):
+        if isinstance(dataset_ref, str):
+            key = tuple(dataset_ref.split('.', 1)) if '.' in dataset_ref else (self.project, dataset_ref)
+        else:
+            key = (dataset_ref.project, dataset_ref.dataset_id)
+        if key not in self.datasets:
+            raise ValueError(f"Dataset inconnu : {'.'.join(key)}")
+        return self.datasets[key]
+
+    ######################################################
+    # list_tables : tables d'un dataset, paginées
+    # In  : dataset ou référence de dataset
+    #       taille de page (None pour la valeur par défaut)
+    # Out : objet exposant .pages, itérateur de listes de tables
+    def list_tables(self, dataset, page_size=None):
+        tables = self.get_dataset(dataset).tables
+        page_size = page_size or DEFAULT_PAGE_SIZE
+        pages = (tables[i:i + page_size] for i in range(0, len(tables), page_size))
+        return SimpleNamespace(pages=pages)
+
+    ######################################################
+    # query : exécution des requêtes de volumétrie et de partitions
+    # Seules les requêtes sur __TABLES__, INFORMATION_SCHEMA.PARTITIONS et INFORMATION_SCHEMA.VIEWS sont reconnues
+    # In  : requête SQL
+    # Out : job exposant result(), liste de lignes (dictionnaires)
+    def query(self, sql):
+        for (project_id, dataset_id), dataset in self.datasets.items():
+            if f"`{project_id}.{dataset_id}." in sql:
+                break
+        else:
+            raise ValueError("Requête sur un dataset inconnu")
+        if '__TABLES__' in sql:
+            rows = [{'table_id': table.table_id, 'size_bytes': table.size_info['num_bytes'],
+                     'row_count': table.size_info['num_rows'], 'num_partitions': table.size_info['num_partitions'] or None}
+                    for table in dataset.tables]
+        elif 'INFORMATION_SCHEMA.VIEWS' in sql:
+            rows = [{'table_name': table.table_id, 'view_definition': table.view_query}
+                    for table in dataset.tables if table.view_query]
+        elif 'INFORMATION_SCHEMA.PARTITIONS' in sql:
+            rows = []
+            for table in dataset.tables:
+                rows.extend(fake_partitions(table, dataset.modified))
+        else:
+            raise ValueError("Requête non supportée par le client de test")
+        return SimpleNamespace(result=lambda: iter(rows))
+
+######################################################
+# fake_partitions : lignes INFORMATION_SCHEMA.PARTITIONS d'une table
+# Les dernières partitions sont datées du jour de modification du dataset
+# In  : table synthétique
+#       date de modification du dataset
+# Out : liste de lignes (table_name, partition_id, last_modified_time)
+def fake_partitions(table, modified):
+    if table.time_partitioning is None and table.range_partitioning is None:
+        return [{'table_name': table.table_id, 'partition_id': None, 'last_modified_time': modified}]
+    rows = []
+    start = datetime(2024, 1, 1)
+    for i in range(table.size_info['num_partitions']):
+        if table.time_partitioning is not None:
+            partition_type = table.time_partitioning.type_
+            partition_id = add_partitions(start, partition_type, -i).strftime(PARTITION_ID_FORMATS[partition_type])
+        else:
+            partition_range = table.range_partitioning.range_
+            partition_id = str(partition_range.start + i * partition_range.interval)
+        rows.append({'table_name': table.table_id, 'partition_id': partition_id,
+                     'last_modified_time': modified - timedelta(days=i)})
+    return rows
@@ -0,0 +1,92 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import os                               # import for operating system commands
+import json                             # import for json functions
+import time                             # import time functions
+
+######################################################
+# Cache local des métadonnées de datasets
+#
+# Un fichier JSON par dataset contient les lignes de configuration de ses
+# tables (table_id, dataset_id, partition_info, size_info, ...). Une entrée n'est
+# valide que si la date de modification du dataset n'a pas changé et si
+# elle a moins de ttl secondes. Au-delà de max_entries fichiers, les
+# entrées les moins récemment utilisées sont supprimées.
+######################################################
+
+# Version du format des entrées, à incrémenter si le contenu des lignes de configuration change
+CACHE_VERSION = 4
+
+######################################################
+# Fonctions
+######################################################
+
+######################################################
+# cache_path : chemin du fichier de cache d'un dataset
+# In  : répertoire du cache
+#       identifiant complet du dataset (projet.dataset)
+# Out : chemin du fichier
+def cache_path(cache_dir, dataset_key):
+    return os.path.join(cache_dir, f"{dataset_key}.json")
+
+######################################################
+# cache_get : lecture de l'entrée de cache d'un dataset
+# In  : répertoire du cache
+#       identifiant complet du dataset
+#       date de modification actuelle du dataset
+#       durée de validité des entrées en secondes
+#       with_project, format des lignes attendu (avec ou sans project_id)
+# Out : liste des lignes de configuration, None si l'entrée est absente ou périmée
+def cache_get(cache_dir, dataset_key, modified, ttl, with_project):
+    path = cache_path(cache_dir, dataset_key)
+    try:
+        with open(path, 'r') as cache_file:
+            entry = json.load(cache_file)
+    except (OSError, ValueError):
+        return None
+    if (entry.get('version') != CACHE_VERSION or entry.get('modified') != modified
+            or entry.get('with_project') != with_project or time.time() - entry.get('cached_at', 0) > ttl):
+        return None
+    # Mise à jour de la date d'accès utilisée pour l'éviction
+    os.utime(path)
+    return entry['records']
+
+######################################################
+# cache_put : enregistrement de l'entrée de cache d'un dataset
+# In  : répertoire du cache
+#       identifiant complet du dataset
+#       date de modification du dataset
+#       lignes de configuration des tables
+#       with_project, format des lignes
+#       nombre maximum d'entrées conservées
+def cache_put(cache_dir, dataset_key, modified, records, with_project, max_entries):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = cache_path(cache_dir, dataset_key)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as cache_file:
+        json.dump({'version': CACHE_VERSION, 'dataset': dataset_key, 'modified': modified, 'with_project': with_project,
+                   'cached_at': time.time(), 'records': records}, cache_file)
+    os.replace(tmp_path, path)
+    cache_evict(cache_dir, max_entries)
+
+######################################################
+# cache_evict : supprime les entrées les moins récemment utilisées
+# In  : répertoire du cache
+#       nombre maximum d'entrées conservées
+def cache_evict(cache_dir, max_entries):
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith('.json'):
+            try:
+                entries.append((os.path.getmtime(os.path.join(cache_dir, name)), name))
+            except OSError:
+                continue
+    if len(entries) <= max_entries:
+        return
+    entries.sort()
+    for mtime, name in entries[:len(entries) - max_entries]:
+        try:
+            os.remove(os.path.join(cache_dir, name))
+        except OSError:
+            pass
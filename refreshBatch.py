@@ -0,0 +1,508 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import os                               # import for operating system commands
+import sys                              # import system commands
+import json                             # import for json functions
+import argparse                         # use argparse to parse arguments
+import time                             # import time functions
+import logging                          # standard library for logging
+import runpy                            # exécution de refreshSubEnv.py dans le processus courant
+import random                           # gigue des délais de relance
+import heapq                            # file des unités en attente de relance
+import collections
+
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+from refreshIncremental import watermark_line
+from refreshMetrics import metrics_line
+from refreshJournal import unit_id, load_journal, journal_line
+from refreshPlan import iter_plan
+
+######################################################
+# Rafraîchit une liste de tables dans un seul processus (ou un pool de
+# processus de longue durée) au lieu de lancer un interpréteur par table.
+# refreshSubEnv.py est exécuté en place : l'interpréteur et les librairies
+# Google ne sont chargés qu'une fois par processus.
+# Les unités sont lues dans le plan d'exécution (refreshPlan.py) ; le projet
+# et les environnements sont ceux de l'en-tête du plan s'ils ne sont pas
+# passés en paramètre.
+######################################################
+
+curworkdir = os.getcwd()
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+# Exceptions google.api_core considérées comme transitoires
+TRANSIENT_ERRORS = ['TooManyRequests', 'ResourceExhausted', 'ServiceUnavailable', 'InternalServerError', 'BadGateway', 'GatewayTimeout']
+# Raisons d'erreur BigQuery signalant un dépassement de quota ou de débit
+QUOTA_REASONS = ['rateLimitExceeded', 'quotaExceeded', 'backendError', 'jobBackendError']
+# Code retour d'un échec transitoire (EX_TEMPFAIL) : quota, limite de débit, service indisponible
+TRANSIENT_RC = 75
+# Fenêtre en secondes dans laquelle deux échecs sont considérés comme rapprochés
+FAILURE_WINDOW = 60
+
+######################################################
+# Fonctions
+######################################################
+
+######################################################
+# read_units : lecture du plan d'exécution
+# In  : chemin du plan généré par autoRefresh.py (ou d'un ancien fichier d'unités)
+# Out : en-tête du plan (vide pour un ancien fichier d'unités)
+#       liste des unités (dataset_id, table_id, bornes de partition éventuelles)
+#       Lève une ValueError si la version du plan n'est pas supportée
+def read_units(units_path):
+    plan = iter_plan(units_path)
+    header = next(plan)
+    return header, list(plan)
+
+######################################################
+# build_argv : construit les arguments de refreshSubEnv.py pour une unité
+# In  : projet, sous-environnement, environnement cible
+#       unit, unité de rafraîchissement (son project_id remplace le projet s'il est renseigné)
+# Out : liste d'arguments
+def build_argv(project, subenv, target_env, unit):
+    argv = ['--project', unit.get('project_id') or project, '--subenv', subenv, '--target_env', target_env,
+            '--datasets', unit['dataset_id'], '--tables', unit['table_id']]
+    if 'partition_start' in unit:
+        argv += ['--partition_date_start', unit['partition_start'], '--partition_date_end', unit['partition_end']]
+    return argv
+
+######################################################
+# format_command : ligne de commande équivalente, identique à celle affichée par le script bash en dryrun
+# (arguments séparés par un espace, suivis d'un espace final)
+# In  : projet, sous-environnement, environnement cible
+#       unit, unité de rafraîchissement (son project_id remplace le projet s'il est renseigné)
+# Out : ligne de commande
+def format_command(project, subenv, target_env, unit):
+    return ' '.join(['python3', './refreshSubEnv.py'] + build_argv(project, subenv, target_env, unit)) + ' '
+
+######################################################
+# snapshot_handlers : relève les handlers de logging existants
+# Out : dictionnaire logger -> liste de handlers
+def snapshot_handlers():
+    loggers = [logging.getLogger()] + [l for l in logging.Logger.manager.loggerDict.values() if isinstance(l, logging.Logger)]
+    return {l: list(l.handlers) for l in loggers}
+
+######################################################
+# run_unit : exécute refreshSubEnv.py dans le processus courant
+# Les handlers de logging ajoutés par le script sont retirés après chaque
+# exécution pour ne pas dupliquer les traces d'une table à l'autre
+# In  : chemin de refreshSubEnv.py
+#       arguments
+# Out : code retour (0 si le rafraîchissement a fonctionné, TRANSIENT_RC pour une erreur transitoire)
+def run_unit(script, argv):
+    saved_argv = sys.argv
+    handlers_before = snapshot_handlers()
+    sys.argv = [script] + argv
+    try:
+        runpy.run_path(script, run_name='__main__')
+        return 0
+    except SystemExit as e:
+        if e.code is None:
+            return 0
+        if isinstance(e.code, int):
+            return e.code
+        print(e.code, file=sys.stderr)
+        return 1
+    except Exception as e:
+        if is_quota_error(e):
+            logger.warning(f"Erreur de quota BigQuery lors de l'exécution de {script} {' '.join(argv)} : {e}")
+            return TRANSIENT_RC
+        logger.exception(f"Erreur lors de l'exécution de {script} {' '.join(argv)}")
+        return 1
+    finally:
+        sys.argv = saved_argv
+        for l, handlers in snapshot_handlers().items():
+            for handler in handlers:
+                if handler not in handlers_before.get(l, []):
+                    l.removeHandler(handler)
+                    handler.close()
+
+######################################################
+# is_quota_error : reconnaît une erreur de quota ou de limite de débit BigQuery
+# In  : exception levée par refreshSubEnv.py
+# Out : True si l'erreur est transitoire (quota, rate limit, service indisponible)
+def is_quota_error(exc):
+    if type(exc).__name__ in TRANSIENT_ERRORS:
+        return True
+    return any(reason in str(exc) for reason in QUOTA_REASONS)
+
+######################################################
+# backoff_delay : délai avant une nouvelle tentative, exponentiel avec gigue
+# In  : numéro de la tentative échouée (1 pour la première)
+#       retry, paramètres de relance (delay, max_delay)
+# Out : délai en secondes, entre la moitié et la totalité du délai exponentiel
+def backoff_delay(attempt, retry):
+    delay = min(retry['max_delay'], retry['delay'] * 2 ** (attempt - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+######################################################
+# run_units : exécute toutes les unités et retourne le résultat de chacune
+# Une unité en échec est relancée jusqu'à max_retries fois : immédiatement 
+# pour une erreur définitive, après un délai exponentiel avec gigue pour une
+# erreur transitoire (TRANSIENT_RC : quota, limite de débit). Avec 
+# max_parallel > 1, les unités sont réparties sur un pool de processus de 
+# longue durée, remplacé si un processus est arrêté brutalement (échec 
+# transitoire de l'unité en cours) ; lorsque les échecs transitoires se
+# rapprochent, la concurrence est divisée par deux puis remonte d'une unité
+# après une série de succès. Une unité n'est lancée qu'une fois
+# terminées les unités dont elle dépend ('depends_on') ; si l'une d'elles
+# échoue, toutes les unités en aval sont ignorées
+# In  : liste des unités, dans l'ordre de leurs dépendances
+#       liste des arguments de chaque unité
+#       chemin de refreshSubEnv.py
+#       nombre maximum de rafraîchissements en parallèle
+#       journal des unités terminées
+#       fichier des watermarks (mode incrémental uniquement)
+#       retry, paramètres de relance (max_retries, delay, max_delay)
+#       metrics, fichier des métriques et identifiant de l'exécution (path, run) ou None
+#       mp_context, contexte multiprocessing du pool (None pour celui par défaut de la plateforme)
+#       pool, pool de processus (new_pool) conservé par l'appelant d'une exécution à l'autre
+#       (None pour un pool créé et arrêté par l'exécution)
+# Out : liste de tuples (unité, code retour, nombre de tentatives), dans l'ordre de fin d'exécution
+#       Le code retour d'une unité ignorée est None
+def run_units(units, argvs, script, max_parallel, journal_path=None, watermarks_path=None, retry=None, metrics=None, mp_context=None, pool=None):
+    retry = retry or {'max_retries': 0, 'delay': 30, 'max_delay': 600}
+    results = []
+    attempts = [0] * len(units)
+    # Horodatages de mise en file et de premier lancement de chaque unité
+    queued = [time.time()] * len(units)
+    started = [None] * len(units)
+    remaining, dependents = dependency_graph(units)
+    skipped = set()
+    if max_parallel <= 1:
+        for i, unit in enumerate(units):
+            if i in skipped:
+                continue
+            queued[i] = started[i] = time.time()
+            while True:
+                attempts[i] += 1
+                rc = run_unit(script, argvs[i])
+                if rc == 0 or attempts[i] > retry['max_retries']:
+                    break
+                delay = backoff_delay(attempts[i], retry) if rc == TRANSIENT_RC else 0
+                logger.warning(f"Échec du rafraîchissement de {unit_label(unit)} (code retour {rc}), tentative {attempts[i] + 1} dans {delay:.0f}s")
+                time.sleep(delay)
+            results.append((unit, rc, attempts[i]))
+            log_result(unit, rc, attempts[i], journal_path, watermarks_path, metrics, (queued[i], started[i], time.time()))
+            if rc != 0:
+                skip_dependents(i, units, dependents, skipped, results)
+        return results
+
+    limit = max_parallel
+    successes = 0
+    failures = collections.deque()
+    ready = collections.deque(i for i in range(len(units)) if not remaining[i])
+    waiting = []
+    running = {}
+    own_pool = pool is None
+    if own_pool:
+        pool = new_pool(max_parallel, mp_context)
+    try:
+        while ready or waiting or running:
+            # Unités dont le délai avant nouvelle tentative est écoulé
+            now = time.monotonic()
+            while waiting and waiting[0][0] <= now:
+                ready.append(heapq.heappop(waiting)[1])
+            while ready and len(running) < limit:
+                i = ready.popleft()
+                attempts[i] += 1
+                if started[i] is None:
+                    started[i] = time.time()
+                running[pool_submit(pool, run_unit, script, argvs[i])] = i
+            timeout = max(0, waiting[0][0] - now) if waiting else None
+            if not running:
+                time.sleep(timeout)
+                continue
+            done, pending = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = running.pop(future)
+                unit = units[i]
+                try:
+                    rc = pool_result(pool, future)
+                except BrokenProcessPool:
+                    logger.error(f"Processus de rafraîchissement de {unit_label(unit)} arrêté brutalement (mémoire, signal)")
+                    rc = TRANSIENT_RC
+                except Exception:
+                    logger.exception(f"Erreur du processus de rafraîchissement de {unit_label(unit)}")
+                    rc = 1
+                if rc == 0:
+                    # Remontée progressive de la concurrence après une série de succès
+                    successes += 1
+                    if limit < max_parallel and successes >= limit:
+                        limit += 1
+                        successes = 0
+                        logger.info(f"Concurrence remontée à {limit}")
+                    results.append((unit, rc, attempts[i]))
+                    log_result(unit, rc, attempts[i], journal_path, watermarks_path, metrics, (queued[i], started[i], time.time()))
+                    # Les unités dont toutes les dépendances sont terminées deviennent prêtes
+                    for k in dependents[i]:
+                        remaining[k] -= 1
+                        if not remaining[k] and k not in skipped:
+                            ready.append(k)
+                    continue
+                now = time.monotonic()
+                delay = 0
+                if rc == TRANSIENT_RC:
+                    # Échecs transitoires rapprochés : la concurrence est divisée par deux
+                    successes = 0
+                    failures.append(now)
+                    while failures and now - failures[0] > FAILURE_WINDOW:
+                        failures.popleft()
+                    if len(failures) >= 2 and limit > 1:
+                        limit = max(1, limit // 2)
+                        failures.clear()
+                        logger.warning(f"Échecs transitoires rapprochés, concurrence réduite à {limit}")
+                    delay = backoff_delay(attempts[i], retry)
+                if attempts[i] <= retry['max_retries']:
+                    logger.warning(f"Échec du rafraîchissement de {unit_label(unit)} (code retour {rc}), tentative {attempts[i] + 1} dans {delay:.0f}s")
+                    heapq.heappush(waiting, (now + delay, i))
+                else:
+                    results.append((unit, rc, attempts[i]))
+                    log_result(unit, rc, attempts[i], journal_path, watermarks_path, metrics, (queued[i], started[i], time.time()))
+                    skip_dependents(i, units, dependents, skipped, results)
+    finally:
+        if own_pool:
+            close_pool(pool)
+    return results
+
+######################################################
+# new_pool : pool de processus de rafraîchissement, créé au premier lancement
+# In  : nombre de processus
+#       mp_context, contexte multiprocessing (None pour celui par défaut de la plateforme)
+# Out : dictionnaire du pool (max_workers, mp_context, executor, futures lancées -> executor)
+def new_pool(max_workers, mp_context=None):
+    return {'max_workers': max_workers, 'mp_context': mp_context, 'executor': None, 'futures': {}}
+
+######################################################
+# pool_submit : lance une tâche dans le pool
+# Un processus arrêté brutalement (mémoire, signal) rend le pool inutilisable : 
+# il est alors remplacé par un nouveau pool
+# In  : dictionnaire du pool (new_pool)
+#       fonction et arguments de la tâche
+# Out : Future de la tâche
+def pool_submit(pool, fn, *args):
+    future = None
+    if pool['executor'] is not None:
+        try:
+            future = pool['executor'].submit(fn, *args)
+        except BrokenProcessPool:
+            replace_pool(pool, pool['executor'])
+    if future is None:
+        pool['executor'] = ProcessPoolExecutor(max_workers=pool['max_workers'], mp_context=pool['mp_context'])
+        future = pool['executor'].submit(fn, *args)
+    pool['futures'][future] = pool['executor']
+    return future
+
+######################################################
+# pool_result : résultat d'une tâche terminée du pool
+# Une tâche interrompue par l'arrêt brutal d'un processus lève BrokenProcessPool ;
+# le pool qui l'exécutait est alors remplacé, pour que les tâches lancées ensuite
+# ne partent pas dans un pool déjà condamné
+# In  : dictionnaire du pool (new_pool)
+#       Future terminée, lancée par pool_submit
+# Out : résultat de la tâche
+def pool_result(pool, future):
+    executor = pool['futures'].pop(future, None)
+    try:
+        return future.result()
+    except BrokenProcessPool:
+        if executor is not None and executor is pool['executor']:
+            replace_pool(pool, executor)
+        raise
+
+######################################################
+# replace_pool : abandonne un pool interrompu, un nouveau pool est créé au prochain lancement
+# In  : dictionnaire du pool (new_pool)
+#       executor interrompu
+def replace_pool(pool, executor):
+    logger.warning("Pool de processus interrompu, création d'un nouveau pool")
+    executor.shutdown(wait=False)
+    pool['executor'] = None
+
+######################################################
+# close_pool : arrête les processus du pool
+# In  : dictionnaire du pool (new_pool)
+def close_pool(pool):
+    if pool['executor'] is not None:
+        pool['executor'].shutdown()
+        pool['executor'] = None
+    pool['futures'].clear()
+
+######################################################
+# dependency_graph : graphe des dépendances entre unités
+# Les dépendances absentes de la liste (déjà terminées lors d'une reprise, 
+# hors du plan) sont considérées comme satisfaites
+# In  : liste des unités
+# Out : nombre de dépendances de chaque unité, liste des unités dépendantes de chaque unité
+def dependency_graph(units):
+    positions = {unit_id(unit): i for i, unit in enumerate(units)}
+    pending = [0] * len(units)
+    dependents = [[] for unit in units]
+    for i, unit in enumerate(units):
+        for dep in unit.get('depends_on', []):
+            if dep in positions:
+                pending[i] += 1
+                dependents[positions[dep]].append(i)
+    return pending, dependents
+
+######################################################
+# skip_dependents : ignore toutes les unités en aval d'une unité en échec
+# In  : numéro de l'unité en échec
+#       liste des unités
+#       liste des unités dépendantes de chaque unité
+#       ensemble des unités ignorées, complété
+#       liste des résultats, complétée (code retour None)
+def skip_dependents(i, units, dependents, skipped, results):
+    stack = list(dependents[i])
+    while stack:
+        k = stack.pop()
+        if k in skipped:
+            continue
+        skipped.add(k)
+        logger.warning(f"Unité ignorée, {unit_label(units[i])} est en échec : {unit_label(units[k])}")
+        results.append((units[k], None, 0))
+        stack.extend(dependents[k])
+
+######################################################
+# unit_label : libellé d'une unité pour les traces
+# In  : unité de rafraîchissement
+# Out : [projet.]dataset.table, suivi de la plage de partitions pour une tranche
+def unit_label(unit):
+    label = f"{unit['dataset_id']}.{unit['table_id']}"
+    if unit.get('project_id'):
+        label = f"{unit['project_id']}.{label}"
+    if 'partition_start' in unit:
+        label += f" [{unit['partition_start']} - {unit['partition_end']}]"
+    return label
+
+######################################################
+# log_result : trace le résultat final du rafraîchissement d'une table
+# Une unité rafraîchie est ajoutée au journal et, en mode incrémental, son 
+# watermark au fichier des watermarks. Toute unité, en échec ou non, ajoute
+# son enregistrement au fichier des métriques
+# In  : unité de rafraîchissement
+#       code retour
+#       nombre de tentatives
+#       journal des unités terminées
+#       fichier des watermarks (mode incrémental uniquement)
+#       metrics, fichier des métriques et identifiant de l'exécution (path, run) ou None
+#       timing, horodatages (mise en file, premier lancement, fin)
+def log_result(unit, rc, attempts=1, journal_path=None, watermarks_path=None, metrics=None, timing=None):
+    if metrics and timing:
+        with open(metrics['path'], 'a') as metrics_file:
+            metrics_file.write(metrics_line(unit_id(unit), metrics['run'], *timing, unit.get('est_bytes'), attempts, rc) + "\n")
+    if rc != 0:
+        logger.error(f"Erreur du rafraîchissement de {unit_label(unit)} (code retour {rc}, {attempts} tentative(s))")
+        return
+    logger.info(f"Rafraîchissement de {unit_label(unit)} terminé ({attempts} tentative(s))")
+    if journal_path:
+        with open(journal_path, 'a') as journal_file:
+            journal_file.write(journal_line(unit) + "\n")
+    if watermarks_path and 'watermark' in unit:
+        with open(watermarks_path, 'a') as watermarks_file:
+            watermarks_file.write(watermark_line(unit) + "\n")
+
+################################################################################################################
+# main
+################################################################################################################
+if __name__ == "__main__":
+
+    ######################################################
+    # Parametrage du parser d'arguments
+    ######################################################
+
+    parser=argparse.ArgumentParser()
+    parser.add_argument('--log', help='Log level', choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"], default="INFO")
+    parser.add_argument('--project', help='Project Name (défaut : en-tête du plan)')
+    parser.add_argument('--subenv', help='Sous-environnement (défaut : en-tête du plan)')
+    parser.add_argument('--target_env', help='Environnement cible (défaut : en-tête du plan)')
+    parser.add_argument('--units', help='Plan d\'exécution (JSON Lines) généré par autoRefresh.py', required=True)
+    parser.add_argument('--max_parallel', help='Nombre maximum de rafraîchissements exécutés en parallèle', type=int, default=1)
+    parser.add_argument('--dryrun', help='Affiche uniquement les commandes sans exécuter le rafraîchissement', choices=["True", "False"], default="True")
+    parser.add_argument('--script', help='Chemin du script de rafraîchissement', default="./refreshSubEnv.py")
+    parser.add_argument('--max_retries', help='Nombre de relances d\'une unité en échec', type=int, default=2)
+    parser.add_argument('--retry_delay', help='Délai initial avant relance en secondes, doublé à chaque tentative', type=float, default=30)
+    parser.add_argument('--retry_max_delay', help='Délai maximum avant relance en secondes', type=float, default=600)
+    parser.add_argument('--journal', help='Journal des unités terminées, complété après chaque rafraîchissement réussi')
+    parser.add_argument('--resume', help='Reprise : ignore les unités présentes dans le journal', action='store_true')
+    parser.add_argument('--watermarks', help='Fichier des watermarks du mode incrémental, complété après chaque rafraîchissement réussi')
+    parser.add_argument('--metrics', help='Fichier des métriques, complété après chaque unité')
+    parser.add_argument('--run', help='Identifiant de l\'exécution inscrit dans les métriques', default=time.strftime("%Y%m%d_%H%M%S"))
+    parser.add_argument('--logFile', help='Path du fichier de log', default=curworkdir+"/logs/"+os.path.splitext(os.path.basename(__file__))[0]+time.strftime("_%Y%m%d_%H%M%S")+".log")
+
+    args = parser.parse_args()
+
+    ######################################################
+    # Parametrage du logging
+    ######################################################
+
+    # création du répertoire de logs si non existant
+    curlogdir = f"{curworkdir}/logs"
+    if not os.path.exists(curlogdir):
+        os.makedirs(curlogdir)
+
+    logger.setLevel(args.log)
+
+    # create formatter
+    formatter = logging.Formatter('%(asctime)s %(name)s %(levelname)-5s %(message)s')
+
+    # create console handler with a higher log level
+    ch = logging.StreamHandler(sys.stdout)
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
+
+    # create file handler which logs even debug messages
+    fh = logging.FileHandler(args.logFile)
+    fh.setFormatter(formatter)
+    logger.addHandler(fh)
+
+    try :
+        plan_header, units = read_units(args.units)
+    except (OSError, ValueError) as e:
+        logger.error(f"Lecture du plan impossible : {e}")
+        sys.exit(1)
+    for key in ('project', 'subenv', 'target_env'):
+        if getattr(args, key) is None:
+            setattr(args, key, plan_header.get(key))
+        if getattr(args, key) is None:
+            logger.error(f"--{key} absent de la ligne de commande et de l'en-tête du plan")
+            sys.exit(1)
+
+    # Mode dryrun : affichage des commandes uniquement
+    if args.dryrun == "True":
+        for unit in units:
+            print(format_command(args.project, args.subenv, args.target_env, unit))
+        sys.exit(0)
+
+    # Reprise : les unités déjà terminées ne sont pas relancées, sinon le journal est réinitialisé
+    if args.journal:
+        if args.resume:
+            done = load_journal(args.journal)
+            units = [unit for unit in units if unit_id(unit) not in done]
+            logger.info(f"Reprise : {len(done)} unité(s) déjà terminée(s)")
+        else:
+            open(args.journal, 'w').close()
+
+    logger.info(f"Rafraîchissement de {len(units)} unités, {args.max_parallel} en parallèle au maximum")
+    argvs = [build_argv(args.project, args.subenv, args.target_env, unit) for unit in units]
+    retry = {'max_retries': args.max_retries, 'delay': args.retry_delay, 'max_delay': args.retry_max_delay}
+    metrics = {'path': args.metrics, 'run': args.run} if args.metrics else None
+    results = run_units(units, argvs, args.script, args.max_parallel, args.journal, args.watermarks, retry, metrics)
+
+    # Bilan : unités relancées et unités en erreur
+    retried = [(unit, attempts) for unit, rc, attempts in results if attempts > 1]
+    for unit, attempts in retried:
+        logger.info(f"Unité relancée : {unit_label(unit)} ({attempts} tentatives)")
+    skipped = [unit for unit, rc, attempts in results if rc is None]
+    if skipped:
+        logger.error(f"Nombre d'unités ignorées (dépendance en échec) : {len(skipped)}")
+    errors = [unit for unit, rc, attempts in results if rc != 0]
+    if errors:
+        logger.error(f"Nombre d'unités en erreur : {len(errors)}")
+        sys.exit(3)
+    logger.info("Tous les rafraîchissements ont fonctionné")
+    sys.exit(0)
@@ -0,0 +1,211 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import os                               # import for operating system commands
+import json                             # import for json functions
+import ast                              # lecture sûre des anciennes lignes str(dict)
+import itertools
+
+######################################################
+# Lecture et écriture des fichiers de configuration
+#
+# Format d'un fichier de configuration :
+#   ---HEADER---
+#   debut_DAY=...
+#   fin_DAY=...
+#   debut_NUM=...
+#   fin_NUM=...
+#   debut_HOUR=... (optionnel, comme MONTH et YEAR : déduit de debut_DAY/fin_DAY si vide)
+#   fin_HOUR=...
+#   -----------
+#   une table par ligne, au format JSON Lines
+#
+# Les anciens fichiers dont les lignes sont au format str(dict) restent lisibles.
+######################################################
+
+HEADER_START = '---HEADER---'
+HEADER_END = '-----------'
+HEADER_KEYS = ['debut_DAY', 'fin_DAY', 'debut_NUM', 'fin_NUM', 'debut_HOUR', 'fin_HOUR', 'debut_MONTH', 'fin_MONTH', 'debut_YEAR', 'fin_YEAR']
+
+# Champs mis à jour à chaque découverte sans constituer une modification de la table
+VOLATILE_KEYS = ['size_info']
+# Champs renseignés à la main dans le fichier de configuration, conservés lors de la fusion
+DECLARED_KEYS = ['declared_depends_on']
+
+######################################################
+# Fonctions
+######################################################
+
+######################################################
+# read_header : lit le header du fichier de configuration
+# La lecture s'arrête sur la ligne de fin de header, le fichier est
+# ainsi positionné sur la première ligne de table
+# In  : fichier de configuration ouvert
+# Out : dictionnaire des valeurs du header
+def read_header(config_file):
+    header_values = {}
+    for line in config_file:
+        line = line.strip()
+        if line == HEADER_END:
+            break
+        if '=' in line:
+            key, value = line.split('=', 1)
+            header_values[key] = value
+    return header_values
+
+######################################################
+# parse_record : convertit une ligne de table en dictionnaire
+# In  : ligne au format JSON ou, pour les anciens fichiers, str(dict)
+# Out : dictionnaire de la table
+def parse_record(line):
+    try:
+        return json.loads(line)
+    except ValueError:
+        return ast.literal_eval(line)
+
+######################################################
+# iter_records : parcourt les lignes de table du fichier de configuration
+# In  : fichier de configuration ouvert, positionné après le header
+# Out : générateur de dictionnaires de table
+def iter_records(config_file):
+    for line in config_file:
+        line = line.strip()
+        if line: # Vérifie si la ligne n'est pas vide
+            yield parse_record(line)
+
+######################################################
+# iter_config : lit le fichier de configuration en une seule passe
+# Le premier élément produit est le dictionnaire du header, les suivants
+# sont les tables
+# In  : chemin du fichier de configuration
+# Out : générateur (header puis tables)
+def iter_config(config_path):
+    with open(config_path, 'r') as config_file:
+        yield read_header(config_file)
+        yield from iter_records(config_file)
+
+######################################################
+# write_header : écrit le header du fichier de configuration
+# In  : fichier de configuration ouvert en écriture
+#       header_values, valeurs du header (vides par défaut)
+def write_header(config_file, header_values=None):
+    header_values = header_values or {}
+    config_file.write(HEADER_START + ' \n')
+    for key in HEADER_KEYS:
+        config_file.write(f"{key}={header_values.get(key, '')}\n")
+    for key, value in header_values.items():
+        if key not in HEADER_KEYS:
+            config_file.write(f"{key}={value}\n")
+    config_file.write(HEADER_END + '\n')
+
+######################################################
+# write_record : écrit une table dans le fichier de configuration
+# In  : fichier de configuration ouvert en écriture
+#       dictionnaire de la table
+def write_record(config_file, record):
+    config_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+######################################################
+# record_key : clé d'une table dans le fichier de configuration
+# Une table sans project_id appartient au projet du credential : sa clé est la
+# même que celle de la table portant explicitement ce projet
+# In  : dictionnaire de la table
+#       projet du credential (None s'il est inconnu)
+# Out : tuple (project_id, dataset_id, table_id)
+def record_key(record, default_project=None):
+    return (record.get('project_id') or default_project, record['dataset_id'], record['table_id'])
+
+######################################################
+# config_has_project : vérifie si les tables du fichier de configuration portent leur projet
+# Seule la première table est lue
+# In  : chemin du fichier de configuration
+# Out : True si la première table porte un project_id
+def config_has_project(config_path):
+    config = iter_config(config_path)
+    next(config)
+    first_record = next(config, None)
+    config.close()
+    return bool(first_record and first_record.get('project_id'))
+
+######################################################
+# record_structure : champs structurels d'une table, hors volumétrie et champs déclarés
+# Le projet fait partie de la clé (record_key) et n'est pas comparé
+# In  : dictionnaire de la table
+# Out : dictionnaire sans project_id ni les champs de VOLATILE_KEYS et DECLARED_KEYS
+def record_structure(record):
+    return {key: value for key, value in record.items()
+            if key != 'project_id' and key not in VOLATILE_KEYS and key not in DECLARED_KEYS}
+
+######################################################
+# carry_declared : reporte les champs déclarés d'une table sur sa version de production
+# In  : table du fichier de configuration
+#       table de production
+# Out : table de production complétée des champs de DECLARED_KEYS
+def carry_declared(conf_record, prod_record):
+    declared = {key: conf_record[key] for key in DECLARED_KEYS if key in conf_record}
+    return dict(prod_record, **declared) if declared else prod_record
+
+######################################################
+# diff_records : compare les tables du fichier de configuration et celles de production
+# In  : dictionnaire clé -> table du fichier de configuration
+#       dictionnaire clé -> table de production
+#       listed, ensemble des (project_id, dataset_id) listés : seules les tables de ces
+#       datasets peuvent être supprimées
+# Out : tables ajoutées, tables supprimées, tables modifiées (couples configuration/production)
+#       Un changement de volumétrie seule n'est pas une modification
+def diff_records(conf_records, prod_records, listed):
+    added = [record for key, record in prod_records.items() if key not in conf_records]
+    removed = [record for key, record in conf_records.items() if key not in prod_records and key[:2] in listed]
+    changed = [(record, prod_records[key]) for key, record in conf_records.items()
+               if key in prod_records and record_structure(record) != record_structure(prod_records[key])]
+    return added, removed, changed
+
+######################################################
+# write_config : écrit le fichier de configuration de manière atomique
+# Le contenu est écrit dans un fichier temporaire du même répertoire qui
+# remplace ensuite le fichier de configuration
+# In  : chemin du fichier de configuration
+#       header_values, valeurs du header
+#       tables à écrire
+def write_config(config_path, header_values, records):
+    tmp_path = f"{config_path}.tmp"
+    try:
+        with open(tmp_path, 'w') as config_file:
+            write_header(config_file, header_values)
+            for record in records:
+                write_record(config_file, record)
+    except BaseException:
+        # Le fichier temporaire n'existe pas si son ouverture a échoué
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, config_path)
+
+######################################################
+# merge_config : fusionne les tables de production dans le fichier de configuration
+# Les valeurs du header et l'ordre des tables existantes sont conservés,
+# les tables modifiées sont remplacées, les tables supprimées retirées et
+# les nouvelles tables ajoutées en fin de fichier. La volumétrie est mise à jour,
+# les champs déclarés à la main (DECLARED_KEYS) sont conservés.
+# Seules les tables des datasets listés peuvent être supprimées : les tables
+# des autres datasets du fichier sont conservées telles quelles
+# In  : chemin du fichier de configuration
+#       tables de production (itérable)
+#       listed, ensemble des (project_id, dataset_id) listés, déduit des tables 
+#       de production si absent
+#       projet du credential, projet des tables sans project_id (record_key)
+# Out : tables ajoutées, tables supprimées, tables modifiées
+def merge_config(config_path, prod_records, listed=None, default_project=None):
+    config = iter_config(config_path)
+    header_values = next(config)
+    conf_records = {record_key(record, default_project): record for record in config}
+    prod_records = {record_key(record, default_project): record for record in prod_records}
+    if listed is None:
+        listed = {key[:2] for key in prod_records}
+    added, removed, changed = diff_records(conf_records, prod_records, listed)
+    removed_keys = {record_key(record, default_project) for record in removed}
+    merged = {key: carry_declared(record, prod_records[key]) if key in prod_records else record
+              for key, record in conf_records.items() if key not in removed_keys}
+    if added or removed or any(merged[key] != conf_records[key] for key in merged):
+        write_config(config_path, header_values, itertools.chain(merged.values(), added))
+    return added, removed, changed
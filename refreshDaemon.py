@@ -0,0 +1,502 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import os                               # import for operating system commands
+import sys                              # import system commands
+import json                             # import for json functions
+import argparse                         # use argparse to parse arguments
+import time                             # import time functions
+import logging                          # standard library for logging
+import socket                           # socket de contrôle local (unix)
+import signal                           # arrêt propre sur SIGTERM
+import threading                        # thread du socket de contrôle
+import multiprocessing                  # contexte spawn du pool de rafraîchissement
+
+from datetime import datetime, timedelta
+
+from autoRefresh import build_parser, plan_units, refresh_name
+from createRefreshConfigFile import update_config
+from refreshBatch import build_argv, format_command, run_units, new_pool, close_pool
+from refreshConfig import iter_config
+from refreshIncremental import get_client
+from refreshMetrics import load_metrics, summarize_run, write_prometheus
+
+######################################################
+# Mode service du rafraîchissement
+#
+# Le daemon garde en mémoire le client BigQuery authentifié et la
+# configuration lue, relue uniquement lorsque le fichier change (date de
+# modification ou taille). Il enchaîne, selon un calendrier, la découverte
+# des tables (createRefreshConfigFile.update_config) et le rafraîchissement
+# (autoRefresh.plan_units puis refreshBatch.run_units, refreshSubEnv.py
+# étant exécuté dans le processus du daemon ou, avec --max_parallel > 1,
+# dans un pool de processus créé au démarrage et conservé d'un cycle à
+# l'autre : l'interpréteur et les librairies Google ne sont chargés
+# qu'une fois par processus). Le rafraîchissement planifié peut être
+# limité à une fenêtre horaire (--window 22:00-06:00).
+#
+# Un socket unix local accepte une commande par connexion et répond une
+# ligne JSON :
+#   status   : état du daemon, dernières exécutions et prochaines échéances
+#   refresh  : lance un rafraîchissement (hors fenêtre horaire)
+#   discover : lance une découverte des tables
+#   reload   : relit la configuration
+#   stop     : arrête le daemon à la fin de l'exécution en cours
+######################################################
+
+curworkdir = os.getcwd()
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+# Commandes acceptées par le socket de contrôle
+COMMANDS = ['status', 'refresh', 'discover', 'reload', 'stop']
+
+# Loggers des modules appelés par le daemon, qui reçoivent les mêmes handlers
+MODULE_LOGGERS = ['autoRefresh.py', 'createRefreshConfigFile.py', 'refreshBatch.py']
+
+# Taille maximale d'une commande reçue sur le socket
+MAX_COMMAND = 1024
+
+######################################################
+# Fonctions
+######################################################
+
+######################################################
+# control_parser : parser du mode client (envoi d'une commande au daemon)
+# Out : ArgumentParser
+def control_parser():
+    parser=argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--control', help='Envoie une commande au daemon lancé et affiche sa réponse', choices=COMMANDS)
+    parser.add_argument('--socket', help='Chemin du socket de contrôle', default=curworkdir+"/refreshDaemon.sock")
+    return parser
+
+######################################################
+# daemon_parser : parser des arguments du daemon
+# Reprend les options de autoRefresh.py (planification, sélection, relances)
+# Out : ArgumentParser
+def daemon_parser():
+    parser = build_parser()
+    parser.add_argument('--control', help='Envoie une commande au daemon lancé et affiche sa réponse', choices=COMMANDS)
+    parser.add_argument('--socket', help='Chemin du socket de contrôle', default=curworkdir+"/refreshDaemon.sock")
+    parser.add_argument('--dataset', nargs='+', help='Datasets découverts (projet.dataset pour un autre projet que celui du credential), pas de découverte si absent')
+    parser.add_argument('--discovery_interval', help='Intervalle entre deux découvertes en secondes (0 : uniquement sur commande)', type=int, default=86400)
+    parser.add_argument('--refresh_interval', help='Intervalle entre deux rafraîchissements en secondes (0 : uniquement sur commande)', type=int, default=86400)
+    parser.add_argument('--window', help='Fenêtre horaire des rafraîchissements planifiés (HH:MM-HH:MM, éventuellement à cheval sur minuit)')
+    parser.add_argument('--dryrun', help='Affiche uniquement les commandes sans exécuter le rafraîchissement', choices=["True", "False"], default="True")
+    parser.add_argument('--script', help='Chemin du script de rafraîchissement', default="./refreshSubEnv.py")
+    parser.add_argument('--max_workers', help='Nombre de datasets listés en parallèle', type=int, default=8)
+    parser.add_argument('--page_size', help='Nombre de tables par page de listing (défaut de l\'API si absent)', type=int)
+    parser.add_argument('--cache_dir', help='Répertoire du cache des métadonnées de datasets (pas de cache si absent)')
+    parser.add_argument('--cache_ttl', help='Durée de validité du cache en secondes', type=int, default=86400)
+    parser.add_argument('--cache_max_entries', help='Nombre maximum de datasets conservés dans le cache', type=int, default=500)
+    parser.set_defaults(logFile=curworkdir+"/logs/"+os.path.splitext(os.path.basename(__file__))[0]+time.strftime("_%Y%m%d_%H%M%S")+".log")
+    return parser
+
+######################################################
+# send_command : envoie une commande au daemon
+# In  : chemin du socket de contrôle
+#       commande
+# Out : réponse du daemon (ligne JSON)
+#       Lève une OSError si le daemon n'est pas joignable
+def send_command(socket_path, command):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path)
+        client.sendall(command.encode() + b"\n")
+        client.shutdown(socket.SHUT_WR)
+        chunks = []
+        while True:
+            chunk = client.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    return b"".join(chunks).decode().strip()
+
+######################################################
+# parse_window : lecture de la fenêtre horaire des rafraîchissements planifiés
+# In  : fenêtre HH:MM-HH:MM, None si aucune
+# Out : tuple (début, fin) en minutes depuis minuit, None si aucune
+#       Lève une ValueError si la fenêtre est invalide
+def parse_window(window):
+    if not window:
+        return None
+    try:
+        bounds = []
+        for bound in window.split('-'):
+            hours, minutes = bound.split(':')
+            bounds.append(datetime.strptime(f"{int(hours):02d}:{int(minutes):02d}", '%H:%M'))
+        start, end = bounds
+    except ValueError as e:
+        raise ValueError(f"Fenêtre horaire invalide : {window} (attendu HH:MM-HH:MM)") from e
+    return start.hour * 60 + start.minute, end.hour * 60 + end.minute
+
+######################################################
+# window_delay : délai avant l'ouverture de la fenêtre horaire
+# In  : date courante
+#       fenêtre (début, fin) en minutes, None si aucune
+# Out : délai en secondes, 0 si la date est dans la fenêtre
+def window_delay(now, window):
+    if window is None:
+        return 0
+    start, end = window
+    minute = now.hour * 60 + now.minute
+    inside = start <= minute < end if start <= end else (minute >= start or minute < end)
+    if inside:
+        return 0
+    opening = now.replace(hour=start // 60, minute=start % 60, second=0, microsecond=0)
+    if opening <= now:
+        opening += timedelta(days=1)
+    return (opening - now).total_seconds()
+
+######################################################
+# load_config : configuration en mémoire, relue uniquement si le fichier a changé
+# In  : chemin du fichier de configuration
+#       configuration en mémoire (None au premier chargement)
+#       force, relit le fichier même s'il n'a pas changé
+# Out : dictionnaire (signature, header, records, loaded), le même objet si le fichier n'a pas changé
+#       Lève une OSError si le fichier n'existe pas
+def load_config(config_path, config=None, force=False):
+    stat = os.stat(config_path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    if config is not None and config['signature'] == signature and not force:
+        return config
+    records = iter_config(config_path)
+    header_values = next(records)
+    config = {'signature': signature, 'header': header_values, 'records': list(records), 'loaded': time.time()}
+    logger.info(f"Configuration chargée : {len(config['records'])} table(s) ({config_path})")
+    return config
+
+######################################################
+# run_discovery : découverte des tables et mise à jour du fichier de configuration
+# In  : client BigQuery
+#       args, arguments du daemon
+# Out : dictionnaire du résultat (added, removed, changed, error)
+def run_discovery(client, args):
+    cache = None
+    if args.cache_dir:
+        cache = {'cache_dir': args.cache_dir, 'ttl': args.cache_ttl, 'max_entries': args.cache_max_entries}
+    try :
+        result = update_config(client, args.dataset, args.emplacement_config, None, args.max_workers, args.page_size, cache)
+    except RuntimeError as e:
+        logger.error(f"Dataset non présent dans le projet ou inaccessible : {e}")
+        return {'error': str(e)}
+    if result is None:
+        return {'created': True}
+    added, removed, changed = result
+    return {'added': len(added), 'removed': len(removed), 'changed': len(changed)}
+
+######################################################
+# run_refresh : rafraîchissement des tables de la configuration en mémoire
+# Les unités sont exécutées dans le processus du daemon (ou dans le pool de
+# processus du daemon avec --max_parallel > 1)
+# In  : client BigQuery (None si aucun credential)
+#       args, arguments du daemon
+#       configuration en mémoire
+#       pool de processus du daemon (new_pool), None pour une exécution dans le processus
+# Out : dictionnaire du résultat (units, errors, skipped, deferred, error)
+def run_refresh(client, args, config, pool=None):
+    if not config['records']:
+        logger.error(f"Aucune table dans le fichier de configuration : {args.emplacement_config}")
+        return {'error': 'Aucune table dans le fichier de configuration'}
+    nom_refresh = refresh_name(config['records'][0]['dataset_id'], config['header'])
+    try :
+        units, watermarks_path, deferred = plan_units(args, config['header'], iter(config['records']), client,
+                                                      deferred_path=f"{args.repertoire_bash}/{nom_refresh}.deferred.jsonl")
+    except RuntimeError as e:
+        logger.error(str(e))
+        return {'error': str(e)}
+    if args.dryrun == "True":
+        for unit in units:
+            logger.info(format_command(args.project, args.subenv, args.target_env, unit))
+        return {'units': len(units), 'errors': 0, 'skipped': 0, 'deferred': len(deferred), 'dryrun': True}
+
+    journal_path = f"{args.repertoire_bash}/{nom_refresh}.journal.jsonl"
+    metrics = {'path': f"{args.repertoire_bash}/{nom_refresh}.metrics.jsonl", 'run': time.strftime("%Y%m%d_%H%M%S")}
+    open(journal_path, 'w').close()
+    run_start = time.time()
+    argvs = [build_argv(args.project, args.subenv, args.target_env, unit) for unit in units]
+    retry = {'max_retries': args.max_retries, 'delay': args.retry_delay, 'max_delay': args.retry_max_delay}
+    results = run_units(units, argvs, args.script, args.max_parallel, journal_path, watermarks_path, retry, metrics, pool=pool)
+    errors = sum(1 for unit, rc, attempts in results if rc != 0)
+    skipped = sum(1 for unit, rc, attempts in results if rc is None)
+    if args.prometheus:
+        summary = summarize_run(load_metrics(metrics['path'], metrics['run']))
+        write_prometheus(args.prometheus, summary, nom_refresh, run_start, time.time(), errors)
+    if errors:
+        logger.error(f"Nombre d'unités en erreur : {errors}")
+    else:
+        logger.info("Tous les rafraîchissements ont fonctionné")
+    return {'units': len(units), 'errors': errors, 'skipped': skipped, 'deferred': len(deferred), 'run': metrics['run']}
+
+######################################################
+# format_time : horodatage lisible d'un epoch
+# In  : epoch, None si inconnu
+# Out : date ISO, None si inconnu
+def format_time(epoch):
+    if epoch is None:
+        return None
+    return datetime.fromtimestamp(epoch).isoformat(timespec='seconds')
+
+######################################################
+# status_line : état du daemon renvoyé par la commande status
+# In  : état partagé du daemon
+# Out : ligne JSON
+def status_line(state):
+    config = state['config']
+    return json.dumps({
+        'pid': os.getpid(),
+        'started': format_time(state['started']),
+        'running': state['running'],
+        'pending': sorted(state['triggers']),
+        'config': {'path': state['config_path'], 'tables': len(config['records']) if config else None,
+                   'loaded': format_time(config['loaded']) if config else None},
+        'last_discovery': state['last_discovery'],
+        'last_refresh': state['last_refresh'],
+        'next_discovery': format_time(state['next_discovery']),
+        'next_refresh': format_time(state['next_refresh'])
+    })
+
+######################################################
+# handle_command : traite une commande reçue sur le socket de contrôle
+# Les commandes autres que status sont mises en file et traitées par la
+# boucle principale, à la fin de l'exécution en cours
+# In  : commande
+#       état partagé du daemon
+#       verrou de l'état
+#       événement réveillant la boucle principale
+# Out : réponse (ligne JSON)
+def handle_command(command, state, lock, wakeup):
+    if command not in COMMANDS:
+        return json.dumps({'ok': False, 'error': f"Commande inconnue : {command} ({', '.join(COMMANDS)})"})
+    with lock:
+        if command == 'status':
+            return status_line(state)
+        state['triggers'].add(command)
+    wakeup.set()
+    return json.dumps({'ok': True, 'queued': command, 'running': state['running']})
+
+######################################################
+# serve_control : boucle du socket de contrôle, exécutée dans un thread
+# In  : socket unix en écoute
+#       état partagé du daemon
+#       verrou de l'état
+#       événement réveillant la boucle principale
+def serve_control(server, state, lock, wakeup):
+    while True:
+        try:
+            connection, address = server.accept()
+        except OSError:
+            return # Socket fermé à l'arrêt du daemon
+        with connection:
+            try:
+                connection.settimeout(5)
+                data = b""
+                while b"\n" not in data and len(data) < MAX_COMMAND:
+                    chunk = connection.recv(MAX_COMMAND)
+                    if not chunk:
+                        break
+                    data += chunk
+                command = data.decode(errors='replace').strip()
+                logger.debug(f"Commande reçue : {command}")
+                connection.sendall(handle_command(command, state, lock, wakeup).encode() + b"\n")
+            except OSError as e:
+                logger.warning(f"Erreur sur le socket de contrôle : {e}")
+
+######################################################
+# open_control_socket : crée le socket de contrôle, accessible au seul utilisateur du daemon
+# In  : chemin du socket
+# Out : socket en écoute
+#       Lève une RuntimeError si un daemon écoute déjà sur ce socket
+def open_control_socket(socket_path):
+    if os.path.exists(socket_path):
+        try:
+            send_command(socket_path, 'status')
+        except OSError:
+            os.remove(socket_path) # Socket d'un daemon arrêté sans nettoyage
+        else:
+            raise RuntimeError(f"Un daemon écoute déjà sur {socket_path}")
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # Le socket est créé directement en 0600 : aucun autre utilisateur ne peut s'y connecter entre bind et chmod
+    umask = os.umask(0o177)
+    try:
+        server.bind(socket_path)
+    finally:
+        os.umask(umask)
+    os.chmod(socket_path, 0o600)
+    server.listen()
+    return server
+
+######################################################
+# run_daemon : boucle principale du daemon
+# In  : args, arguments du daemon
+#       client BigQuery (None si aucun credential)
+#       socket de contrôle en écoute
+def run_daemon(args, client, server):
+    window = parse_window(args.window)
+    now = time.time()
+    state = {'started': now, 'config_path': args.emplacement_config, 'config': None, 'running': None, 'triggers': set(),
+             'last_discovery': None, 'last_refresh': None,
+             'next_discovery': now if args.dataset and args.discovery_interval > 0 else None,
+             'next_refresh': now + window_delay(datetime.now(), window) if args.refresh_interval > 0 else None}
+    lock = threading.Lock()
+    wakeup = threading.Event()
+    # Pool de rafraîchissement conservé pendant toute la vie du daemon, ses processus démarrés au premier
+    # cycle gardent leurs imports. Le thread du socket de contrôle tourne en parallèle : les workers
+    # sont démarrés par spawn, un fork pourrait hériter d'un verrou tenu par ce thread (logging)
+    pool = new_pool(args.max_parallel, multiprocessing.get_context('spawn')) if args.max_parallel > 1 else None
+    threading.Thread(target=serve_control, args=(server, state, lock, wakeup), daemon=True).start()
+
+    # Arrêt propre : l'exécution en cours se termine avant l'arrêt
+    def request_stop(signum, frame):
+        with lock:
+            state['triggers'].add('stop')
+        wakeup.set()
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    logger.info(f"Daemon démarré (pid {os.getpid()}), socket de contrôle : {args.socket}")
+    try:
+        daemon_loop(args, client, state, lock, wakeup, window, pool)
+    finally:
+        if pool is not None:
+            close_pool(pool)
+    logger.info("Arrêt du daemon")
+
+######################################################
+# daemon_loop : enchaîne les cycles planifiés et les commandes jusqu'à l'arrêt
+# In  : args, arguments du daemon
+#       client BigQuery (None si aucun credential)
+#       état partagé du daemon, verrou et évènement de réveil
+#       fenêtre horaire (parse_window)
+#       pool de processus du daemon, None pour une exécution dans le processus
+def daemon_loop(args, client, state, lock, wakeup, window, pool):
+    while True:
+        wakeup.clear()
+        now = time.time()
+        with lock:
+            triggers = set(state['triggers'])
+            state['triggers'].clear()
+        if 'stop' in triggers:
+            break
+        if state['next_discovery'] is not None and now >= state['next_discovery']:
+            triggers.add('discover')
+        if state['next_refresh'] is not None and now >= state['next_refresh']:
+            delay = window_delay(datetime.now(), window)
+            if delay:
+                state['next_refresh'] = now + delay
+                logger.info(f"Hors de la fenêtre horaire {args.window}, rafraîchissement reporté au {format_time(state['next_refresh'])}")
+            else:
+                triggers.add('refresh')
+
+        if 'discover' in triggers:
+            if args.dataset and client is not None:
+                state['running'] = 'discover'
+                start = time.time()
+                result = run_discovery(client, args)
+                state['last_discovery'] = dict(result, start=format_time(start), duration=round(time.time() - start, 3))
+            else:
+                logger.error("La découverte nécessite --dataset et --credpath")
+            if state['next_discovery'] is not None:
+                state['next_discovery'] = time.time() + args.discovery_interval
+
+        if 'reload' in triggers or 'refresh' in triggers:
+            try:
+                state['config'] = load_config(args.emplacement_config, state['config'], 'reload' in triggers)
+            except (OSError, ValueError, StopIteration) as e:
+                logger.error(f"Lecture de la configuration impossible : {args.emplacement_config} ({e})")
+                triggers.discard('refresh')
+
+        if 'refresh' in triggers:
+            state['running'] = 'refresh'
+            start = time.time()
+            result = run_refresh(client, args, state['config'], pool)
+            state['last_refresh'] = dict(result, start=format_time(start), duration=round(time.time() - start, 3))
+            if state['next_refresh'] is not None:
+                next_refresh = time.time() + args.refresh_interval
+                state['next_refresh'] = next_refresh + window_delay(datetime.fromtimestamp(next_refresh), window)
+        state['running'] = None
+
+        # Attente de la prochaine échéance ou d'une commande
+        deadlines = [deadline for deadline in (state['next_discovery'], state['next_refresh']) if deadline is not None]
+        wakeup.wait(max(0, min(deadlines) - time.time()) if deadlines else None)
+
+################################################################################################################
+# main
+################################################################################################################
+if __name__ == "__main__":
+
+    # Mode client : envoi d'une commande au daemon lancé
+    control_args, remaining = control_parser().parse_known_args()
+    if control_args.control:
+        try :
+            print(send_command(control_args.socket, control_args.control))
+        except OSError as e:
+            print(f"Daemon non joignable sur {control_args.socket} : {e}", file=sys.stderr)
+            sys.exit(1)
+        sys.exit(0)
+
+    ######################################################
+    # Parametrage du parser d'arguments
+    ######################################################
+
+    args = daemon_parser().parse_args()
+
+    ######################################################
+    # Parametrage du logging
+    ######################################################
+
+    # création du répertoire de logs si non existant
+    curlogdir = f"{curworkdir}/logs"
+    if not os.path.exists(curlogdir):
+        os.makedirs(curlogdir)
+
+    # create formatter
+    formatter = logging.Formatter('%(asctime)s %(name)s %(levelname)-5s %(message)s')
+
+    # create console handler with a higher log level
+    ch = logging.StreamHandler(sys.stdout)
+    ch.setFormatter(formatter)
+
+    # create file handler which logs even debug messages
+    fh = logging.FileHandler(args.logFile)
+    fh.setFormatter(formatter)
+
+    # Les traces des modules appelés sont écrites dans les mêmes fichiers
+    for name in [os.path.basename(__file__)] + MODULE_LOGGERS:
+        module_logger = logging.getLogger(name)
+        module_logger.setLevel(args.log)
+        module_logger.addHandler(ch)
+        module_logger.addHandler(fh)
+
+    try :
+        parse_window(args.window)
+    except ValueError as e:
+        logger.error(str(e))
+        sys.exit(1)
+    if args.dataset and not args.credpath:
+        logger.error("La découverte (--dataset) nécessite --credpath")
+        sys.exit(1)
+
+    # Client BigQuery authentifié une seule fois pour toute la durée du daemon
+    client = None
+    if args.credpath:
+        logger.info(f"Lecture GCP credential")
+        try :
+            client = get_client(args.credpath)
+        except Exception:
+            logger.error("Fichier credential inexistant : "+args.credpath)
+            sys.exit(1)
+
+    if not os.path.exists(args.repertoire_bash):
+        logger.info(f"Création du repertoire Bash")
+        os.makedirs(args.repertoire_bash)
+
+    try :
+        server = open_control_socket(args.socket)
+    except (OSError, RuntimeError) as e:
+        logger.error(f"Ouverture du socket de contrôle impossible : {e}")
+        sys.exit(1)
+    try :
+        run_daemon(args, client, server)
+    finally:
+        server.close()
+        os.remove(args.socket)
@@ -0,0 +1,235 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import queue                            # file d'échange entre les threads de listing et le consommateur
+import re                               # extraction des tables référencées par les vues
+
+from concurrent.futures import ThreadPoolExecutor, Future
+
+from metadataCache import cache_get, cache_put
+from refreshPartitions import RANGE_TYPE, INGESTION_COLUMNS, INGESTION_COLUMN, header_keys
+
+######################################################
+# Découverte des tables BigQuery
+#
+# Les datasets sont listés en parallèle sur un pool de threads partageant
+# un seul client BigQuery. Les lignes de configuration des tables sont
+# transmises au consommateur page par page, au fil des réponses de l'API.
+######################################################
+
+# Volumétrie des tables d'un dataset : taille, nombre de lignes et nombre de partitions
+SIZES_QUERY = """
+SELECT t.table_id, t.size_bytes, t.row_count, p.num_partitions
+FROM `{project}.{dataset}.__TABLES__` t
+LEFT JOIN (
+    SELECT table_name, COUNT(*) AS num_partitions
+    FROM `{project}.{dataset}.INFORMATION_SCHEMA.PARTITIONS`
+    WHERE partition_id IS NOT NULL
+    GROUP BY table_name
+) p ON t.table_id = p.table_name
+"""
+
+# Définition des vues d'un dataset, pour en déduire les tables dont elles dépendent
+VIEWS_QUERY = """
+SELECT table_name, view_definition
+FROM `{project}.{dataset}.INFORMATION_SCHEMA.VIEWS`
+"""
+
+# Table référencée après FROM ou JOIN : `projet.dataset.table`, `dataset`.`table` ou dataset.table
+REFERENCE_RE = re.compile(r"\b(?:FROM|JOIN)\s+(`[^`]+`(?:\.`[^`]+`)*|[A-Za-z_][\w-]*(?:\.[A-Za-z_][\w-]*){1,2})", re.IGNORECASE)
+
+######################################################
+# Fonctions
+######################################################
+
+######################################################
+# parse_dataset_ref : découpe une référence de dataset
+# In  : référence "dataset" ou "projet.dataset"
+# Out : tuple (projet, dataset), projet à None s'il n'est pas précisé
+def parse_dataset_ref(dataset_ref):
+    if '.' in dataset_ref:
+        project_id, dataset_id = dataset_ref.split('.', 1)
+        return project_id, dataset_id
+    return None, dataset_ref
+
+######################################################
+# range_partitioning_of : plage d'entiers d'une table partitionnée par range_partitioning
+# Le listing des tables (TableListItem) n'expose pas toujours range_partitioning :
+# la plage est alors lue dans la ressource brute de l'API (rangePartitioning)
+# In  : Table
+# Out : tuple (colonne, {start, end, interval}), None si la table n'est pas partitionnée par plage
+def range_partitioning_of(table):
+    range_partitioning = getattr(table, 'range_partitioning', None)
+    if range_partitioning is not None:
+        partition_range = range_partitioning.range_
+        return range_partitioning.field, {'start': int(partition_range.start), 'end': int(partition_range.end),
+                                          'interval': int(partition_range.interval)}
+    resource = (getattr(table, '_properties', None) or {}).get('rangePartitioning')
+    if resource:
+        partition_range = resource.get('range', {})
+        return resource.get('field'), {key: int(partition_range[key]) for key in ('start', 'end', 'interval') if key in partition_range}
+    return None
+
+######################################################
+# get_partition : vérifie si la table est partitionnée
+# si c'est le cas, renvoie la clé de partition et son
+# type. Sinon, renvoie False
+# Partitionnement temporel (HOUR, DAY, MONTH, YEAR) : la clé d'une table
+# partitionnée par date d'ingestion est la pseudo-colonne correspondante.
+# Partitionnement par plage d'entiers : type NUMBER et plage (start, end, interval)
+# In  : Table
+# Out : infos de partition (clé de partition et type)
+def get_partition(table):
+    partition_info = {}
+    time_partitioning = getattr(table, 'time_partitioning', None)
+    range_partitioning = range_partitioning_of(table)
+    if time_partitioning is not None:
+        partition_info['partitioned'] = True
+        partition_type = time_partitioning.type_
+        partition_info['partition_key'] = time_partitioning.field
+        partition_info['partition_type'] = partition_type
+        if time_partitioning.field is None:
+            partition_info['partition_key'] = INGESTION_COLUMNS.get(partition_type, INGESTION_COLUMN)
+            partition_info['ingestion_time'] = True
+    elif range_partitioning is not None:
+        partition_info['partitioned'] = True
+        partition_info['partition_key'], partition_info['range'] = range_partitioning
+        partition_info['partition_type'] = partition_type = RANGE_TYPE
+    else:
+        partition_info['partitioned'] = False
+    if partition_info['partitioned']:
+        partition_info['date_debut'], partition_info['date_fin'] = header_keys(partition_type)
+
+    return partition_info
+
+######################################################
+# build_record : construit la ligne de configuration d'une table
+# In  : Table
+#       with_project, ajoute l'identifiant du projet (datasets de plusieurs projets)
+#       size_info, volumétrie de la table (num_bytes, num_rows, num_partitions) si connue
+#       depends_on, tables référencées par la vue (vide pour une table)
+# Out : dictionnaire de la table
+def build_record(table, with_project=False, size_info=None, depends_on=None):
+    record = {
+        'table_id': table.table_id,
+        'dataset_id': table.dataset_id,
+        'partition_info': get_partition(table)
+    }
+    if size_info is not None:
+        record['size_info'] = size_info
+    if depends_on:
+        record['depends_on'] = depends_on
+    if with_project:
+        record['project_id'] = table.project
+    return record
+
+######################################################
+# query_table_sizes : volumétrie des tables d'un dataset
+# In  : Bigquery client
+#       projet
+#       dataset
+# Out : dictionnaire table -> {num_bytes, num_rows, num_partitions}
+def query_table_sizes(client, project, dataset):
+    sizes = {}
+    for row in client.query(SIZES_QUERY.format(project=project, dataset=dataset)).result():
+        sizes[row['table_id']] = {
+            'num_bytes': row['size_bytes'],
+            'num_rows': row['row_count'],
+            'num_partitions': row['num_partitions'] or 0
+        }
+    return sizes
+
+######################################################
+# parse_references : tables référencées par une requête
+# Les noms à un seul composant (CTE, alias) et les vues INFORMATION_SCHEMA sont ignorés
+# In  : requête SQL
+#       projet de la vue
+# Out : liste triée des tables, "dataset.table" pour le projet de la vue, "projet.dataset.table" sinon
+def parse_references(sql, project):
+    references = set()
+    for match in REFERENCE_RE.finditer(sql or ''):
+        parts = match.group(1).replace('`', '').split('.')
+        if len(parts) < 2 or 'INFORMATION_SCHEMA' in (part.upper() for part in parts):
+            continue
+        if len(parts) == 3 and parts[0] != project:
+            references.add('.'.join(parts))
+        else:
+            references.add('.'.join(parts[-2:]))
+    return sorted(references)
+
+######################################################
+# query_view_dependencies : tables dont dépendent les vues d'un dataset
+# In  : Bigquery client
+#       projet
+#       dataset
+# Out : dictionnaire vue -> liste des tables référencées
+def query_view_dependencies(client, project, dataset):
+    dependencies = {}
+    for row in client.query(VIEWS_QUERY.format(project=project, dataset=dataset)).result():
+        references = [reference for reference in parse_references(row['view_definition'], project)
+                      if reference != f"{dataset}.{row['table_name']}"]
+        if references:
+            dependencies[row['table_name']] = references
+    return dependencies
+
+######################################################
+# list_dataset : liste les tables d'un dataset page par page
+# Chaque page de lignes de configuration est déposée dans la file dès sa
+# réception. Avec un cache, un dataset dont la date de modification n'a
+# pas changé est servi depuis le cache après un simple get_dataset
+# In  : Bigquery client
+#       référence du dataset
+#       taille de page (None pour la valeur par défaut de l'API)
+#       with_project, ajoute l'identifiant du projet aux lignes
+#       file de sortie
+#       cache, dictionnaire des paramètres du cache (cache_dir, ttl, max_entries) ou None
+def list_dataset(client, dataset_ref, page_size, with_project, out_queue, cache=None):
+    dataset = client.get_dataset(dataset_ref)
+    if cache is not None:
+        dataset_key = f"{dataset.project}.{dataset.dataset_id}"
+        modified = dataset.modified.isoformat() if dataset.modified else None
+        records = cache_get(cache['cache_dir'], dataset_key, modified, cache['ttl'], with_project)
+        if records is not None:
+            out_queue.put(records)
+            return
+        listed = []
+    sizes = query_table_sizes(client, dataset.project, dataset.dataset_id)
+    dependencies = query_view_dependencies(client, dataset.project, dataset.dataset_id)
+    for page in client.list_tables(dataset, page_size=page_size).pages:
+        records = [build_record(table, with_project, sizes.get(table.table_id), dependencies.get(table.table_id)) for table in page]
+        out_queue.put(records)
+        if cache is not None:
+            listed.extend(records)
+    if cache is not None:
+        cache_put(cache['cache_dir'], dataset_key, modified, listed, with_project, cache['max_entries'])
+
+######################################################
+# iter_dataset_records : liste les tables de plusieurs datasets en parallèle
+# In  : Bigquery client, partagé par les threads
+#       liste de références de datasets ("dataset" ou "projet.dataset")
+#       nombre de threads
+#       taille de page
+#       with_project, ajoute l'identifiant du projet aux lignes
+#       cache, dictionnaire des paramètres du cache ou None
+# Out : générateur de lignes de configuration, dans l'ordre d'arrivée des pages
+#       Lève une RuntimeError si un dataset n'a pas pu être listé
+def iter_dataset_records(client, dataset_refs, max_workers=8, page_size=None, with_project=False, cache=None):
+    out_queue = queue.Queue()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for dataset_ref in dataset_refs:
+            future = executor.submit(list_dataset, client, dataset_ref, page_size, with_project, out_queue, cache)
+            futures[future] = dataset_ref
+            # La fin du listing d'un dataset est signalée en déposant le future dans la file
+            future.add_done_callback(out_queue.put)
+        pending = len(futures)
+        while pending:
+            page = out_queue.get()
+            if isinstance(page, Future):
+                pending -= 1
+                if page.exception() is not None:
+                    for future in futures:
+                        future.cancel()
+                    raise RuntimeError(f"Dataset {futures[page]} : {page.exception()}") from page.exception()
+                continue
+            yield from page
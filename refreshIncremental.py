@@ -0,0 +1,187 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import os                               # import for operating system commands
+import json                             # import for json functions
+
+from datetime import datetime, timedelta
+
+from refreshPartitions import TIME_TYPES, detect_date_format, partition_bound, in_window
+
+######################################################
+# Rafraîchissement incrémental
+#
+# Pour chaque table, le fichier des watermarks conserve la date de
+# dernière modification (last_modified_time de INFORMATION_SCHEMA.PARTITIONS)
+# prise en compte par le dernier rafraîchissement réussi. Seules les
+# partitions modifiées depuis sont rafraîchies, les tables sans
+# modification sont ignorées.
+#
+# Le fichier des watermarks est au format JSON Lines, une ligne est
+# ajoutée après chaque rafraîchissement réussi :
+#   {"table": "dataset.table", "watermark": "2024-01-01T00:00:00+00:00"}
+# Pour une table dont la plage est découpée en tranches, chaque tranche ajoute
+# sa ligne ("chunk", "chunks") et le watermark n'est retenu que lorsque toutes
+# les tranches ont été rafraîchies.
+#
+# Le watermark ne couvre que les modifications effectivement rafraîchies :
+# tant qu'une partition modifiée hors de la fenêtre du header reste à
+# rafraîchir, il est maintenu juste avant sa date de modification.
+######################################################
+
+# Identifiants de partitions spéciales : valeurs nulles ou données non encore partitionnées
+SPECIAL_PARTITIONS = ['__NULL__', '__UNPARTITIONED__']
+
+PARTITIONS_QUERY = """
+SELECT table_name, partition_id, last_modified_time
+FROM `{project}.{dataset}.INFORMATION_SCHEMA.PARTITIONS`
+"""
+
+######################################################
+# Fonctions
+######################################################
+
+######################################################
+# get_client : création du client BigQuery à partir d'un credential json
+# Les librairies Google ne sont chargées qu'en mode incrémental
+# In  : json credential auth GCP
+# Out : Bigquery client
+def get_client(json_cred_file):
+    from google.oauth2 import service_account
+    from google.cloud import bigquery
+    gcp_cred = service_account.Credentials.from_service_account_file(json_cred_file)
+    return bigquery.Client(credentials = gcp_cred, project = gcp_cred.project_id)
+
+######################################################
+# unit_key : identifiant d'une table dans le fichier des watermarks
+# In  : ligne de configuration ou unité de rafraîchissement
+# Out : "dataset.table", préfixé par le projet s'il est renseigné
+def unit_key(record):
+    key = f"{record['dataset_id']}.{record['table_id']}"
+    if record.get('project_id'):
+        key = f"{record['project_id']}.{key}"
+    return key
+
+######################################################
+# load_watermarks : lecture du fichier des watermarks
+# In  : chemin du fichier
+# Out : dictionnaire identifiant de table -> watermark (datetime)
+def load_watermarks(watermarks_path):
+    watermarks = {}
+    if not os.path.exists(watermarks_path):
+        return watermarks
+    # Tranches rafraîchies par (table, watermark) pour les tables découpées
+    chunks_done = {}
+    with open(watermarks_path, 'r') as watermarks_file:
+        for line in watermarks_file:
+            if line.strip(): # Vérifie si la ligne n'est pas vide
+                entry = json.loads(line)
+                if 'chunks' in entry:
+                    done = chunks_done.setdefault((entry['table'], entry['watermark']), set())
+                    done.add(entry['chunk'])
+                    if len(done) < entry['chunks']:
+                        continue
+                watermark = datetime.fromisoformat(entry['watermark'])
+                if entry['table'] not in watermarks or watermarks[entry['table']] < watermark:
+                    watermarks[entry['table']] = watermark
+    return watermarks
+
+######################################################
+# watermark_line : ligne à ajouter au fichier des watermarks après le rafraîchissement d'une unité
+# In  : unité de rafraîchissement
+# Out : ligne JSON, chaîne vide si l'unité n'a pas de watermark
+def watermark_line(unit):
+    if 'watermark' not in unit:
+        return ""
+    entry = {'table': unit['table'], 'watermark': unit['watermark']}
+    if 'chunks' in unit:
+        entry['chunk'] = unit['chunk']
+        entry['chunks'] = unit['chunks']
+    return json.dumps(entry)
+
+######################################################
+# query_partitions : dates de modification des partitions d'un dataset
+# In  : Bigquery client
+#       projet
+#       dataset
+# Out : dictionnaire table -> liste de (partition_id, last_modified_time)
+#       partition_id vaut None pour une table non partitionnée
+def query_partitions(client, project, dataset):
+    partitions = {}
+    rows = client.query(PARTITIONS_QUERY.format(project=project, dataset=dataset)).result()
+    for row in rows:
+        partitions.setdefault(row['table_name'], []).append((row['partition_id'], row['last_modified_time']))
+    return partitions
+
+######################################################
+# covered_watermark : watermark d'une table après le rafraîchissement des partitions couvertes
+# Les partitions modifiées hors de la fenêtre ne sont pas rafraîchies : le watermark 
+# reste strictement antérieur à la plus ancienne d'entre elles pour qu'elle soit
+# reprise par une fenêtre ultérieure
+# In  : liste de (partition_id, last_modified_time) des partitions modifiées rafraîchies
+#       liste des last_modified_time des partitions modifiées hors de la fenêtre
+# Out : watermark (datetime)
+def covered_watermark(covered, pending):
+    watermark = max(modified for partition_id, modified in covered)
+    if pending:
+        watermark = min(watermark, min(pending) - timedelta(microseconds=1))
+    return watermark
+
+######################################################
+# plan_incremental : restreint une unité de rafraîchissement aux partitions modifiées
+# In  : unité de rafraîchissement construite depuis le header
+#       ligne de configuration de la table
+#       liste de (partition_id, last_modified_time) de la table, None si inconnue
+#       watermark de la table (None si jamais rafraîchie)
+# Out : unité à rafraîchir avec son watermark, None si la table n'a pas été modifiée
+#       ou si aucune partition modifiée ne recoupe la fenêtre du header
+def plan_incremental(unit, record, partitions, watermark):
+    # Pas d'information de partition (vue, table externe...) : rafraîchissement complet
+    if not partitions:
+        return unit
+    changed = [(partition_id, modified) for partition_id, modified in partitions
+               if watermark is None or modified > watermark]
+    if not changed:
+        return None
+    unit = dict(unit)
+    unit['table'] = unit_key(record)
+    # Table non partitionnée : toute la table est rafraîchie
+    if 'partition_start' not in unit:
+        unit['watermark'] = covered_watermark(changed, []).isoformat()
+        return unit
+    partition_type = record['partition_info'].get('partition_type')
+    # Une partition d'une plage d'entiers couvre "interval" valeurs à partir de son identifiant
+    interval = int(record['partition_info'].get('range', {}).get('interval', 1))
+    covered, pending, special = [], [], False
+    for partition_id, modified in changed:
+        if partition_id is None or partition_id in SPECIAL_PARTITIONS:
+            special = True
+            covered.append((partition_id, modified))
+        elif in_window(partition_id, partition_type, unit['partition_start'], unit['partition_end'], interval):
+            covered.append((partition_id, modified))
+        else:
+            pending.append(modified)
+    if not covered:
+        return None
+    unit['watermark'] = covered_watermark(covered, pending).isoformat()
+    # Partitions spéciales modifiées : fenêtre du header conservée, les partitions
+    # hors fenêtre restent en attente comme pour les autres partitions
+    if special:
+        return unit
+    partition_ids = [partition_id for partition_id, modified in covered]
+    if partition_type in TIME_TYPES:
+        date_format = detect_date_format(unit['partition_start'], partition_type)
+        partition_ids.sort()
+        unit['partition_start'] = partition_bound(partition_ids[0], partition_type, date_format)
+        unit['partition_end'] = partition_bound(partition_ids[-1], partition_type, date_format)
+    else:
+        # Partitions entières : de la première valeur de la première partition à la dernière
+        # valeur de la dernière, restreint à la fenêtre du header
+        partition_ids.sort(key=int)
+        start, end = int(partition_ids[0]), int(partition_ids[-1]) + interval - 1
+        if unit['partition_start']:
+            start = max(start, int(unit['partition_start']))
+        if unit['partition_end']:
+            end = min(end, int(unit['partition_end']))
+        unit['partition_start'], unit['partition_end'] = str(start), str(end)
+    return unit
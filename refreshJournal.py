@@ -0,0 +1,54 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import os                               # import for operating system commands
+import json                             # import for json functions
+
+from datetime import datetime
+
+######################################################
+# Journal des unités de rafraîchissement terminées
+#
+# Une ligne JSON est ajoutée au journal après chaque unité rafraîchie :
+#   {"unit": "[projet.]dataset.table:debut:fin", "at": "2024-01-01T00:00:00"}
+# Avec l'option --resume, les unités présentes dans le journal ne sont pas
+# relancées. Le même format est écrit par le script bash et par refreshBatch.py.
+######################################################
+
+######################################################
+# Fonctions
+######################################################
+
+######################################################
+# unit_id : identifiant d'une unité de rafraîchissement
+# In  : unité de rafraîchissement
+# Out : "dataset.table", préfixé par le projet s'il est renseigné et suivi 
+#       de ":debut:fin" pour une table partitionnée
+def unit_id(unit):
+    key = f"{unit['dataset_id']}.{unit['table_id']}"
+    if unit.get('project_id'):
+        key = f"{unit['project_id']}.{key}"
+    if 'partition_start' in unit:
+        key += f":{unit['partition_start']}:{unit['partition_end']}"
+    return key
+
+######################################################
+# load_journal : lecture du journal
+# In  : chemin du journal
+# Out : ensemble des identifiants d'unités terminées
+def load_journal(journal_path):
+    done = set()
+    if not os.path.exists(journal_path):
+        return done
+    with open(journal_path, 'r') as journal_file:
+        for line in journal_file:
+            if line.strip(): # Vérifie si la ligne n'est pas vide
+                done.add(json.loads(line)['unit'])
+    return done
+
+######################################################
+# journal_line : ligne du journal pour une unité terminée
+# In  : unité de rafraîchissement
+# Out : ligne JSON
+def journal_line(unit):
+    return json.dumps({'unit': unit_id(unit), 'at': datetime.now().isoformat(timespec='seconds')})
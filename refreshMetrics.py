@@ -0,0 +1,230 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import os                               # import for operating system commands
+import sys                              # import system commands
+import json                             # import for json functions
+import argparse                         # use argparse to parse arguments
+import time                             # import time functions
+import logging                          # standard library for logging
+
+from datetime import datetime, timedelta
+
+######################################################
+# Métriques des exécutions de rafraîchissement
+#
+# Chaque unité rafraîchie (ou en échec) ajoute un enregistrement au
+# fichier des métriques, au format JSON Lines, conservé d'une exécution
+# à l'autre :
+#   {"run": "20240101_000000", "unit": "dataset.table:debut:fin",
+#    "start": "2024-01-01T00:00:05", "end": "2024-01-01T00:01:10",
+#    "duration": 65.0, "wait": 5.0, "est_bytes": 1000, "attempts": 1, "status": 0}
+# duration couvre toutes les tentatives, wait le temps passé dans la file
+# du pool avant le premier lancement. Le même format est écrit par le
+# script bash et par refreshBatch.py.
+#
+# En fin d'exécution, un résumé peut être écrit au format textfile du
+# node_exporter Prometheus. Le rapport (--report) liste les tables les
+# plus lentes et leur évolution sur les derniers jours.
+######################################################
+
+curworkdir = os.getcwd()
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+# Préfixe des métriques Prometheus
+METRIC_PREFIX = 'autorefresh_run'
+
+######################################################
+# Fonctions
+######################################################
+
+######################################################
+# metrics_line : enregistrement des métriques d'une unité
+# In  : identifiant de l'unité
+#       identifiant de l'exécution
+#       horodatages (epoch) de mise en file, de premier lancement et de fin
+#       volume estimé en octets (None si inconnu)
+#       nombre de tentatives
+#       code retour final
+# Out : ligne JSON
+def metrics_line(unit_key, run_id, queued, start, end, est_bytes, attempts, status):
+    return json.dumps({'run': run_id, 'unit': unit_key,
+                       'start': datetime.fromtimestamp(start).isoformat(timespec='seconds'),
+                       'end': datetime.fromtimestamp(end).isoformat(timespec='seconds'),
+                       'duration': round(end - start, 6), 'wait': round(max(0, start - queued), 6),
+                       'est_bytes': est_bytes, 'attempts': attempts, 'status': status})
+
+######################################################
+# load_metrics : lecture du fichier des métriques
+# In  : chemin du fichier
+#       identifiant d'exécution (None pour toutes les exécutions)
+#       date minimale de début (None pour ne pas filtrer)
+# Out : liste des enregistrements
+def load_metrics(metrics_path, run_id=None, since=None):
+    records = []
+    if not os.path.exists(metrics_path):
+        return records
+    with open(metrics_path, 'r') as metrics_file:
+        for line in metrics_file:
+            if line.strip(): # Vérifie si la ligne n'est pas vide
+                record = json.loads(line)
+                if run_id is not None and record['run'] != run_id:
+                    continue
+                if since is not None and datetime.fromisoformat(record['start']) < since:
+                    continue
+                records.append(record)
+    return records
+
+######################################################
+# table_of : table d'un identifiant d'unité
+# In  : identifiant d'unité (dataset.table[:debut:fin])
+# Out : dataset.table
+def table_of(unit_key):
+    return unit_key.split(':', 1)[0]
+
+######################################################
+# summarize_run : résumé d'une exécution
+# In  : enregistrements de l'exécution
+# Out : dictionnaire (units, failed, retries, wait, max_duration, est_bytes)
+def summarize_run(records):
+    return {
+        'units': len(records),
+        'failed': sum(1 for record in records if record['status'] != 0),
+        'retries': sum(record['attempts'] - 1 for record in records),
+        'wait': sum(record['wait'] for record in records),
+        'max_duration': max((record['duration'] for record in records), default=0),
+        'est_bytes': sum(record['est_bytes'] or 0 for record in records)
+    }
+
+######################################################
+# read_prometheus_value : valeur d'une métrique dans un fichier textfile existant
+# In  : chemin du fichier
+#       nom de la métrique
+# Out : valeur, None si le fichier ou la métrique est absent
+def read_prometheus_value(prometheus_path, name):
+    try:
+        with open(prometheus_path, 'r') as prometheus_file:
+            for line in prometheus_file:
+                if line.startswith(name + '{') or line.startswith(name + ' '):
+                    return float(line.rsplit(' ', 1)[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+######################################################
+# write_prometheus : écrit le résumé d'une exécution au format textfile Prometheus
+# Le fichier est remplacé de manière atomique pour ne jamais être lu partiellement
+# par le node_exporter. L'horodatage du dernier succès est conservé après un échec
+# In  : chemin du fichier .prom
+#       résumé de l'exécution
+#       nom du script de rafraîchissement (label refresh)
+#       horodatages (epoch) de début et de fin de l'exécution
+#       nombre d'erreurs de l'exécution
+def write_prometheus(prometheus_path, summary, refresh, run_start, run_end, errors):
+    last_success = run_end if errors == 0 else read_prometheus_value(prometheus_path, f"{METRIC_PREFIX}_last_success_timestamp_seconds")
+    metrics = [
+        ('start_timestamp_seconds', 'Début de la dernière exécution', run_start),
+        ('end_timestamp_seconds', 'Fin de la dernière exécution', run_end),
+        ('duration_seconds', 'Durée de la dernière exécution', run_end - run_start),
+        ('units', 'Unités exécutées', summary['units']),
+        ('failed_units', 'Unités en échec après relances', summary['failed']),
+        ('retries', 'Relances effectuées', summary['retries']),
+        ('wait_seconds', 'Temps cumulé passé en file avant lancement', summary['wait']),
+        ('unit_max_duration_seconds', 'Durée de l\'unité la plus lente', summary['max_duration']),
+        ('estimated_bytes', 'Volume estimé des unités exécutées', summary['est_bytes']),
+        ('success', '1 si tous les rafraîchissements ont fonctionné', 1 if errors == 0 else 0),
+        ('last_success_timestamp_seconds', 'Fin de la dernière exécution sans erreur', last_success)
+    ]
+    tmp_path = f"{prometheus_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as prometheus_file:
+        for name, help_text, value in metrics:
+            if value is None:
+                continue
+            prometheus_file.write(f"# HELP {METRIC_PREFIX}_{name} {help_text}\n")
+            prometheus_file.write(f"# TYPE {METRIC_PREFIX}_{name} gauge\n")
+            prometheus_file.write(f"{METRIC_PREFIX}_{name}{{refresh=\"{refresh}\"}} {value}\n")
+    os.replace(tmp_path, prometheus_path)
+
+######################################################
+# table_report : durée des tables sur une période
+# In  : enregistrements de la période
+# Out : liste de (table, durée moyenne, dernière durée, nombre d'exécutions),
+#       des tables les plus lentes aux plus rapides
+def table_report(records):
+    durations = {}
+    for record in records:
+        if record['status'] == 0:
+            # Les tranches d'une même table et d'une même exécution sont cumulées
+            runs = durations.setdefault(table_of(record['unit']), {})
+            runs[record['run']] = runs.get(record['run'], 0) + record['duration']
+    report = []
+    for table, runs in durations.items():
+        values = [runs[run_id] for run_id in sorted(runs)]
+        report.append((table, sum(values) / len(values), values[-1], len(values)))
+    report.sort(key=lambda entry: entry[1], reverse=True)
+    return report
+
+################################################################################################################
+# main
+################################################################################################################
+if __name__ == "__main__":
+
+    ######################################################
+    # Parametrage du parser d'arguments
+    ######################################################
+
+    parser=argparse.ArgumentParser()
+    parser.add_argument('--log', help='Log level', choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"], default="INFO")
+    parser.add_argument('--metrics', help='Fichier JSON Lines des métriques', required=True)
+    parser.add_argument('--run', help='Identifiant de l\'exécution à résumer')
+    parser.add_argument('--run_start', help='Début de l\'exécution (epoch, en secondes)', type=float)
+    parser.add_argument('--errors', help='Nombre d\'erreurs de l\'exécution', type=int, default=0)
+    parser.add_argument('--prometheus', help='Fichier textfile Prometheus (.prom) recevant le résumé de l\'exécution --run')
+    parser.add_argument('--refresh', help='Nom du script de rafraîchissement, utilisé comme label Prometheus', default='')
+    parser.add_argument('--report', help='Affiche les N tables les plus lentes', type=int, default=0)
+    parser.add_argument('--days', help='Période du rapport en jours', type=int, default=30)
+    parser.add_argument('--logFile', help='Path du fichier de log', default=curworkdir+"/logs/"+os.path.splitext(os.path.basename(__file__))[0]+time.strftime("_%Y%m%d_%H%M%S")+".log")
+
+    args = parser.parse_args()
+
+    ######################################################
+    # Parametrage du logging
+    ######################################################
+
+    # création du répertoire de logs si non existant
+    curlogdir = f"{curworkdir}/logs"
+    if not os.path.exists(curlogdir):
+        os.makedirs(curlogdir)
+
+    logger.setLevel(args.log)
+
+    # create formatter
+    formatter = logging.Formatter('%(asctime)s %(name)s %(levelname)-5s %(message)s')
+
+    # create console handler with a higher log level
+    ch = logging.StreamHandler(sys.stdout)
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
+
+    # create file handler which logs even debug messages
+    fh = logging.FileHandler(args.logFile)
+    fh.setFormatter(formatter)
+    logger.addHandler(fh)
+
+    # Résumé Prometheus de l'exécution
+    if args.prometheus:
+        if not args.run:
+            logger.error("L'écriture du fichier Prometheus nécessite --run")
+            sys.exit(1)
+        run_end = time.time()
+        summary = summarize_run(load_metrics(args.metrics, args.run))
+        write_prometheus(args.prometheus, summary, args.refresh, args.run_start or run_end, run_end, args.errors)
+        logger.info(f"Résumé de l'exécution {args.run} écrit dans {args.prometheus} : {summary['units']} unité(s), {summary['failed']} en échec")
+
+    # Rapport des tables les plus lentes sur la période
+    if args.report:
+        records = load_metrics(args.metrics, since=datetime.now() - timedelta(days=args.days))
+        for table, mean, last, runs in table_report(records)[:args.report]:
+            trend = f"{(last / mean - 1) * 100:+.0f}%" if mean else "n/a"
+            print(f"{table:<60} moyenne {mean:10.1f}s  dernière {last:10.1f}s ({trend})  {runs} exécution(s)")
@@ -0,0 +1,174 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+from datetime import datetime, timedelta
+
+######################################################
+# Types de partitionnement et bornes de rafraîchissement
+#
+# Partitionnement temporel (time_partitioning) : HOUR, DAY, MONTH, YEAR,
+# sur une colonne ou sur la date d'ingestion (pseudo-colonnes
+# _PARTITIONTIME / _PARTITIONDATE). Partitionnement par plage d'entiers
+# (range_partitioning) : type NUMBER, avec le début, la fin et
+# l'intervalle de la plage.
+#
+# Chaque type lit ses bornes dans le header (debut_HOUR/fin_HOUR,
+# debut_DAY/fin_DAY, debut_MONTH/fin_MONTH, debut_YEAR/fin_YEAR,
+# debut_NUM/fin_NUM). Une borne HOUR, MONTH ou YEAR absente est déduite
+# de la fenêtre debut_DAY/fin_DAY.
+#
+# Formats des bornes (le second correspond aux identifiants de partition) :
+#   HOUR  : 2024-01-01T00 ou 2024010100
+#   DAY   : 2024-01-01    ou 20240101
+#   MONTH : 2024-01       ou 202401
+#   YEAR  : 2024
+######################################################
+
+TIME_TYPES = ['HOUR', 'DAY', 'MONTH', 'YEAR']
+RANGE_TYPE = 'NUMBER'
+
+# Formats de date acceptés pour les bornes du header, par type ; le premier est le format par défaut
+DATE_FORMATS = {
+    'HOUR': ['%Y-%m-%dT%H', '%Y%m%d%H'],
+    'DAY': ['%Y-%m-%d', '%Y%m%d'],
+    'MONTH': ['%Y-%m', '%Y%m'],
+    'YEAR': ['%Y', '%Y']
+}
+
+# Format des identifiants de partition BigQuery (INFORMATION_SCHEMA.PARTITIONS)
+PARTITION_ID_FORMATS = {'HOUR': '%Y%m%d%H', 'DAY': '%Y%m%d', 'MONTH': '%Y%m', 'YEAR': '%Y'}
+
+# Suffixe des clés du header par type de partitionnement
+HEADER_SUFFIXES = {'HOUR': 'HOUR', 'DAY': 'DAY', 'MONTH': 'MONTH', 'YEAR': 'YEAR', RANGE_TYPE: 'NUM'}
+
+# Pseudo-colonnes des tables partitionnées par date d'ingestion
+INGESTION_COLUMNS = {'DAY': '_PARTITIONDATE'}
+INGESTION_COLUMN = '_PARTITIONTIME'
+
+######################################################
+# Fonctions
+######################################################
+
+######################################################
+# header_keys : clés du header portant les bornes d'un type de partitionnement
+# In  : type de partitionnement
+# Out : tuple (clé de début, clé de fin), debut_NUM/fin_NUM pour un type non temporel
+def header_keys(partition_type):
+    suffix = HEADER_SUFFIXES.get(partition_type, HEADER_SUFFIXES[RANGE_TYPE])
+    return f"debut_{suffix}", f"fin_{suffix}"
+
+######################################################
+# detect_date_format : format de date d'une borne du header
+# In  : valeur du header
+#       type de partitionnement temporel
+# Out : format strftime, le format par défaut du type si la valeur n'est pas reconnue
+def detect_date_format(value, partition_type='DAY'):
+    for date_format in DATE_FORMATS[partition_type]:
+        try:
+            datetime.strptime(value, date_format)
+            return date_format
+        except (TypeError, ValueError):
+            continue
+    return DATE_FORMATS[partition_type][0]
+
+######################################################
+# parse_bound : lecture d'une borne
+# In  : borne au format du header
+#       type de partitionnement
+# Out : datetime (partitionnement temporel) ou entier
+#       Lève une ValueError si la borne est invalide
+def parse_bound(value, partition_type):
+    if partition_type in TIME_TYPES:
+        return datetime.strptime(value, detect_date_format(value, partition_type))
+    return int(value)
+
+######################################################
+# add_partitions : décale une date d'un nombre de partitions
+# In  : date (début de partition)
+#       type de partitionnement temporel
+#       nombre de partitions, éventuellement négatif
+# Out : date décalée
+def add_partitions(value, partition_type, count):
+    if partition_type == 'HOUR':
+        return value + timedelta(hours=count)
+    if partition_type == 'DAY':
+        return value + timedelta(days=count)
+    if partition_type == 'MONTH':
+        years, month = divmod(value.month - 1 + count, 12)
+        return value.replace(year=value.year + years, month=month + 1, day=1)
+    return value.replace(year=value.year + count, month=1, day=1)
+
+######################################################
+# partition_count : nombre de partitions temporelles entre deux bornes incluses
+# In  : dates de début et de fin
+#       type de partitionnement temporel
+# Out : nombre de partitions
+def partition_count(start, end, partition_type):
+    if partition_type == 'HOUR':
+        return int((end - start).total_seconds() // 3600) + 1
+    if partition_type == 'DAY':
+        return (end - start).days + 1
+    if partition_type == 'MONTH':
+        return (end.year - start.year) * 12 + end.month - start.month + 1
+    return end.year - start.year + 1
+
+######################################################
+# day_bound : borne d'un type temporel déduite d'une borne DAY du header
+# Le format retenu correspond à celui de la borne DAY (avec ou sans séparateurs)
+# In  : borne DAY
+#       type de partitionnement temporel
+#       is_end, borne de fin (dernière heure du jour pour HOUR)
+# Out : borne au format du type, chaîne vide si la borne DAY est invalide
+def day_bound(value, partition_type, is_end):
+    day_format = detect_date_format(value, 'DAY')
+    try:
+        day = datetime.strptime(value, day_format)
+    except ValueError:
+        return ''
+    if partition_type == 'HOUR' and is_end:
+        day = day.replace(hour=23)
+    return day.strftime(DATE_FORMATS[partition_type][DATE_FORMATS['DAY'].index(day_format)])
+
+######################################################
+# header_bounds : bornes de rafraîchissement d'un type de partitionnement
+# In  : header_values, valeurs du header
+#       type de partitionnement
+# Out : tuple (début, fin), chaînes vides si non renseignées
+def header_bounds(header_values, partition_type):
+    start_key, end_key = header_keys(partition_type)
+    start, end = header_values.get(start_key, ''), header_values.get(end_key, '')
+    if partition_type in TIME_TYPES and partition_type != 'DAY':
+        if not start and header_values.get('debut_DAY'):
+            start = day_bound(header_values['debut_DAY'], partition_type, False)
+        if not end and header_values.get('fin_DAY'):
+            end = day_bound(header_values['fin_DAY'], partition_type, True)
+    return start, end
+
+######################################################
+# partition_bound : convertit un identifiant de partition en borne de rafraîchissement
+# In  : identifiant de partition (YYYYMMDDHH, YYYYMMDD, YYYYMM, YYYY ou début de la plage d'entiers)
+#       type de partitionnement
+#       format de date du header
+# Out : borne au format du header
+def partition_bound(partition_id, partition_type, date_format):
+    if partition_type in TIME_TYPES:
+        return datetime.strptime(partition_id, PARTITION_ID_FORMATS[partition_type]).strftime(date_format)
+    return partition_id
+
+######################################################
+# in_window : vérifie qu'une partition recoupe la fenêtre du header
+# Une borne vide n'est pas limitante
+# In  : identifiant de partition
+#       type de partitionnement
+#       bornes de la fenêtre (format du header)
+#       intervalle de la plage d'entiers (partitionnement NUMBER)
+# Out : True si la partition recoupe la fenêtre
+def in_window(partition_id, partition_type, start, end, interval=1):
+    if partition_type in TIME_TYPES:
+        first = last = datetime.strptime(partition_id, PARTITION_ID_FORMATS[partition_type])
+    else:
+        first = int(partition_id)
+        last = first + interval - 1
+    start = parse_bound(start, partition_type) if start else None
+    end = parse_bound(end, partition_type) if end else None
+    return (start is None or last >= start) and (end is None or first <= end)
@@ -0,0 +1,76 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import os                               # import for operating system commands
+import json                             # import for json functions
+
+from datetime import datetime
+
+######################################################
+# Plan d'exécution
+#
+# Le plan liste les unités de rafraîchissement produites par autoRefresh.py,
+# au format JSON Lines compact : une ligne d'en-tête versionnée, puis une
+# unité par ligne, dans l'ordre d'exécution :
+#   {"plan_version": 1, "project": "...", "subenv": "...", "target_env": "...", "created": "..."}
+#   {"dataset_id": "ds", "table_id": "t", "partition_type": "DAY", "partition_start": "...", ...}
+# Le plan est écrit au fil de l'eau, sans conserver les unités en mémoire,
+# puis remplacé de manière atomique. refreshBatch.py l'exécute.
+# Les anciens fichiers d'unités, sans en-tête, restent lisibles.
+######################################################
+
+PLAN_VERSION = 1
+
+######################################################
+# Fonctions
+######################################################
+
+######################################################
+# write_plan : écrit le plan d'exécution
+# In  : chemin du plan
+#       unités de rafraîchissement (itérable, consommé au fil de l'écriture)
+#       paramètres de l'exécution (project, subenv, target_env)
+# Out : nombre d'unités écrites
+def write_plan(plan_path, units, meta):
+    header = dict({'plan_version': PLAN_VERSION}, **meta, created=datetime.now().isoformat(timespec='seconds'))
+    tmp_path = f"{plan_path}.tmp"
+    count = 0
+    try:
+        with open(tmp_path, 'w') as plan_file:
+            plan_file.write(json.dumps(header, ensure_ascii=False, separators=(',', ':')) + "\n")
+            for unit in units:
+                plan_file.write(json.dumps(unit, ensure_ascii=False, separators=(',', ':')) + "\n")
+                count += 1
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, plan_path)
+    return count
+
+######################################################
+# iter_plan : lecture du plan d'exécution
+# Le premier élément produit est l'en-tête (dictionnaire vide pour un ancien
+# fichier d'unités sans en-tête), puis chaque unité
+# In  : chemin du plan
+# Out : générateur (en-tête, puis unités)
+#       Lève une ValueError si la version du plan n'est pas supportée
+def iter_plan(plan_path):
+    with open(plan_path, 'r') as plan_file:
+        header = None
+        for line in plan_file:
+            if not line.strip(): # Vérifie si la ligne n'est pas vide
+                continue
+            entry = json.loads(line)
+            if header is None:
+                header = {}
+                if 'plan_version' in entry:
+                    if entry['plan_version'] > PLAN_VERSION:
+                        raise ValueError(f"Version de plan non supportée : {entry['plan_version']} (maximum {PLAN_VERSION}) : {plan_path}")
+                    header = entry
+                    yield header
+                    continue
+                yield header
+            yield entry
+        if header is None:
+            yield {}
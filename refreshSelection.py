@@ -0,0 +1,186 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import re                               # compilation des motifs de sélection
+import fnmatch                          # traduction des globs en expressions régulières
+
+######################################################
+# Sélection des tables
+#
+# Les règles d'inclusion et d'exclusion sont des globs (par défaut) ou des
+# expressions régulières (préfixe "re:"). Un motif sans point est comparé au
+# seul nom de la table ; un motif qualifié (glob contenant un ".", expression
+# régulière contenant un "\.") est comparé au nom complet dataset.table
+# (et projet.dataset.table si le projet est renseigné). Une table est retenue
+# si elle correspond à une règle d'inclusion (toutes les tables en l'absence
+# d'inclusion) et à aucune règle d'exclusion. Les motifs de chaque liste sont
+# compilés en une expression régulière par forme (nom de table, nom qualifié).
+#
+# Filtres complémentaires : types de partitionnement (NONE pour une table
+# non partitionnée) et taille de la table (size_info.num_bytes), une table
+# de taille inconnue n'étant pas filtrée.
+#
+# Fichier de règles, une règle par ligne (lignes vides et # ignorées) :
+#   include=ventes_*
+#   exclude=re:.*_tmp$
+#   partition_type=DAY
+#   min_bytes=1000000
+#   max_bytes=1000000000000
+######################################################
+
+REGEX_PREFIX = 're:'
+GLOB_PREFIX = 'glob:'
+
+# Type de partitionnement d'une table non partitionnée dans les filtres
+NO_PARTITION = 'NONE'
+
+######################################################
+# Fonctions
+######################################################
+
+######################################################
+# pattern_source : expression régulière d'un motif
+# In  : motif, glob ou expression régulière préfixée par "re:"
+# Out : source de l'expression régulière, ancrée sur tout le nom
+def pattern_source(pattern):
+    if pattern.startswith(REGEX_PREFIX):
+        return f"(?:{pattern[len(REGEX_PREFIX):]})\\Z"
+    if pattern.startswith(GLOB_PREFIX):
+        pattern = pattern[len(GLOB_PREFIX):]
+    return fnmatch.translate(pattern)
+
+######################################################
+# is_qualified : vérifie si un motif porte sur le nom qualifié de la table
+# In  : motif, glob ou expression régulière préfixée par "re:"
+# Out : True pour un glob contenant un "." ou une expression régulière contenant un "\."
+def is_qualified(pattern):
+    if pattern.startswith(REGEX_PREFIX):
+        return '\\.' in pattern
+    return '.' in pattern
+
+######################################################
+# compile_patterns : compile une liste de motifs en une seule expression régulière
+# In  : liste de motifs
+# Out : expression régulière compilée, None si la liste est vide
+#       Lève une ValueError si un motif est invalide
+def compile_patterns(patterns):
+    if not patterns:
+        return None
+    for pattern in patterns:
+        try:
+            re.compile(pattern_source(pattern))
+        except re.error as e:
+            raise ValueError(f"Motif de sélection invalide : {pattern} ({e})") from e
+    return re.compile('|'.join(f"(?:{pattern_source(pattern)})" for pattern in patterns))
+
+######################################################
+# load_rules : lecture d'un fichier de règles
+# In  : chemin du fichier
+# Out : dictionnaire include, exclude, partition_types (listes), min_bytes, max_bytes
+#       Lève une ValueError sur une ligne invalide
+def load_rules(rules_path):
+    rules = {'include': [], 'exclude': [], 'partition_types': [], 'min_bytes': None, 'max_bytes': None}
+    with open(rules_path, 'r') as rules_file:
+        for number, line in enumerate(rules_file, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            key, sep, value = line.partition('=')
+            key, value = key.strip(), value.strip()
+            if not sep or not value:
+                raise ValueError(f"{rules_path}:{number} : règle invalide : {line}")
+            if key in ('include', 'exclude'):
+                rules[key].append(value)
+            elif key == 'partition_type':
+                rules['partition_types'].extend(item.strip().upper() for item in value.split(','))
+            elif key in ('min_bytes', 'max_bytes'):
+                rules[key] = int(value)
+            else:
+                raise ValueError(f"{rules_path}:{number} : règle inconnue : {key}")
+    return rules
+
+######################################################
+# qualified_names : noms qualifiés d'une table comparés aux motifs qualifiés
+# In  : ligne de configuration
+# Out : tuple (dataset.table[, projet.dataset.table])
+def qualified_names(record):
+    names = (f"{record['dataset_id']}.{record['table_id']}",)
+    if record.get('project_id'):
+        names += (f"{record['project_id']}.{record['dataset_id']}.{record['table_id']}",)
+    return names
+
+######################################################
+# build_matcher : compile une liste de motifs en un test sur une ligne de configuration
+# Les motifs sans point sont comparés au nom de la table, les motifs qualifiés
+# aux noms qualifiés (is_qualified)
+# In  : liste de motifs
+# Out : fonction ligne de configuration -> True si un motif correspond, None si la liste est vide
+#       Lève une ValueError si un motif est invalide
+def build_matcher(patterns):
+    if not patterns:
+        return None
+    table_re = compile_patterns([pattern for pattern in patterns if not is_qualified(pattern)])
+    qualified_re = compile_patterns([pattern for pattern in patterns if is_qualified(pattern)])
+
+    def match(record):
+        if table_re is not None and table_re.match(record['table_id']):
+            return True
+        return qualified_re is not None and any(qualified_re.match(name) for name in qualified_names(record))
+
+    return match
+
+######################################################
+# legacy_patterns : motifs d'exclusion équivalents aux valeurs de --exceptions
+# L'ancien --exceptions excluait les tables dont le nom contenait la valeur : 
+# une valeur sans joker X devient le glob *X*, les globs et les expressions
+# régulières sont conservés
+# In  : liste des valeurs de --exceptions
+# Out : liste de motifs
+def legacy_patterns(patterns):
+    return [pattern if pattern.startswith((REGEX_PREFIX, GLOB_PREFIX)) or any(char in pattern for char in '*?[')
+            else f"*{pattern}*" for pattern in patterns or []]
+
+######################################################
+# build_selector : construit le filtre de sélection des tables
+# Les règles du fichier s'ajoutent à celles passées en paramètre
+# In  : motifs d'inclusion
+#       motifs d'exclusion
+#       types de partitionnement retenus (DAY, NUMBER, ..., NONE)
+#       taille minimale et maximale en octets
+#       chemin du fichier de règles
+# Out : fonction ligne de configuration -> True si la table est retenue,
+#       None si aucune règle n'est définie
+def build_selector(include=None, exclude=None, partition_types=None, min_bytes=None, max_bytes=None, rules_path=None):
+    include, exclude, partition_types = list(include or []), list(exclude or []), list(partition_types or [])
+    if rules_path:
+        rules = load_rules(rules_path)
+        include += rules['include']
+        exclude += rules['exclude']
+        partition_types += rules['partition_types']
+        min_bytes = rules['min_bytes'] if min_bytes is None else min_bytes
+        max_bytes = rules['max_bytes'] if max_bytes is None else max_bytes
+    if not (include or exclude or partition_types) and min_bytes is None and max_bytes is None:
+        return None
+    include_match = build_matcher(include)
+    exclude_match = build_matcher(exclude)
+    partition_types = {partition_type.upper() for partition_type in partition_types}
+
+    def select(record):
+        if include_match is not None and not include_match(record):
+            return False
+        if exclude_match is not None and exclude_match(record):
+            return False
+        if partition_types:
+            partition_info = record['partition_info']
+            partition_type = partition_info.get('partition_type') if partition_info['partitioned'] else NO_PARTITION
+            if partition_type not in partition_types:
+                return False
+        num_bytes = (record.get('size_info') or {}).get('num_bytes')
+        if num_bytes is not None:
+            if min_bytes is not None and num_bytes < min_bytes:
+                return False
+            if max_bytes is not None and num_bytes > max_bytes:
+                return False
+        return True
+
+    return select
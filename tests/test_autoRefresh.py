@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+import logging
+
+from datetime import datetime, timezone
+
+from autoRefresh import build_unit, chunk_unit, iter_units, make_args, order_units, plan_units, schedule_units, stream_units
+from fakeBigquery import FakeClient
+from refreshJournal import unit_id
+
+
+def unit(table, partition_type=None, start=None, end=None, requires=None, project=None):
+    result = {'dataset_id': 'ds', 'table_id': table}
+    if project:
+        result['project_id'] = project
+    if partition_type:
+        result.update(partition_type=partition_type, partition_start=start, partition_end=end)
+    if requires:
+        result['requires'] = requires
+    return result
+
+
+def bounds(units):
+    return [(chunk['partition_start'], chunk['partition_end']) for chunk in units]
+
+
+def test_chunk_days():
+    chunks = chunk_unit(unit('t', 'DAY', '2024-01-01', '2024-01-10'), 4, 0)
+    assert bounds(chunks) == [('2024-01-01', '2024-01-04'), ('2024-01-05', '2024-01-08'), ('2024-01-09', '2024-01-10')]
+
+
+def test_chunk_hours_keep_whole_days():
+    chunks = chunk_unit(unit('t', 'HOUR', '2024010100', '2024010323'), 2, 0)
+    assert bounds(chunks) == [('2024010100', '2024010223'), ('2024010300', '2024010323')]
+
+
+def test_chunk_months_and_years_rounded_from_days():
+    chunks = chunk_unit(unit('t', 'MONTH', '2023-11', '2024-01'), 10, 0)
+    assert bounds(chunks) == [('2023-11', '2023-11'), ('2023-12', '2023-12'), ('2024-01', '2024-01')]
+    chunks = chunk_unit(unit('t', 'MONTH', '2020-01', '2024-12'), 365, 0)
+    assert bounds(chunks) == [('2020-01', '2020-12'), ('2021-01', '2021-12'), ('2022-01', '2022-12'),
+                              ('2023-01', '2023-12'), ('2024-01', '2024-12')]
+    chunks = chunk_unit(unit('t', 'YEAR', '2020', '2024'), 730, 0)
+    assert bounds(chunks) == [('2020', '2021'), ('2022', '2023'), ('2024', '2024')]
+    assert bounds(chunk_unit(unit('t', 'YEAR', '2020', '2021'), 30, 0)) == [('2020', '2020'), ('2021', '2021')]
+
+
+def test_chunk_values_aligned_on_range_intervals():
+    partition_range = {'start': 0, 'end': 1000, 'interval': 10}
+    chunks = chunk_unit(unit('r', 'NUMBER', '5', '44'), 0, 15, partition_range)
+    assert bounds(chunks) == [('5', '19'), ('20', '39'), ('40', '44')]
+
+
+def test_chunk_without_split():
+    original = unit('t', 'DAY', '2024-01-01', '2024-01-03')
+    assert chunk_unit(original, 0, 0) == [original]
+    assert chunk_unit(original, 5, 0) == [original]
+    assert chunk_unit(unit('t', 'DAY', '', ''), 1, 0) == [unit('t', 'DAY', '', '')]
+
+
+def test_chunk_carries_watermark_position():
+    original = dict(unit('t', 'DAY', '2024-01-01', '2024-01-04'), table='ds.t', watermark='2024-03-01T00:00:00+00:00')
+    chunks = chunk_unit(original, 2, 0)
+    assert [(chunk['chunk'], chunk['chunks']) for chunk in chunks] == [(0, 2), (1, 2)]
+
+
+def test_build_unit_carries_project():
+    record = {'project_id': 'p2', 'dataset_id': 'ds', 'table_id': 't', 'partition_info': {'partitioned': False}}
+    assert unit_id(build_unit(record, {})) == 'p2.ds.t'
+    del record['project_id']
+    assert unit_id(build_unit(record, {})) == 'ds.t'
+
+
+def test_order_units_dependencies_first():
+    units = [unit('v', requires=['ds.t']), unit('t', 'DAY', '2024-01-01', '2024-01-02'),
+             unit('t', 'DAY', '2024-01-03', '2024-01-04'), unit('u')]
+    ordered = order_units(units)
+    # Parmi les unités prêtes, l'ordre d'entrée est conservé
+    assert [unit_id(item) for item in ordered] == ['ds.t:2024-01-01:2024-01-02', 'ds.t:2024-01-03:2024-01-04', 'ds.v', 'ds.u']
+    assert ordered[2]['depends_on'] == ['ds.t:2024-01-01:2024-01-02', 'ds.t:2024-01-03:2024-01-04']
+    assert all('requires' not in item for item in ordered)
+
+
+def test_order_units_ignores_missing_and_self_references():
+    ordered = order_units([unit('v', requires=['ds.absent', 'ds.v', 'autre_projet.ds.u']), unit('u')])
+    assert [item['table_id'] for item in ordered] == ['u', 'v']
+    assert ordered[1]['depends_on'] == ['ds.u']
+
+
+def test_order_units_cycle():
+    ordered = order_units([unit('a', requires=['ds.b']), unit('b', requires=['ds.a']), unit('c')])
+    assert [item['table_id'] for item in ordered] == ['c', 'a', 'b']
+
+
+def test_order_units_projects():
+    units = [unit('v', requires=['ds.t'], project='p2'), unit('t', project='p1'), unit('t', project='p2'),
+             unit('w', requires=['p1.ds.t'], project='p2')]
+    by_id = {unit_id(item): item for item in order_units(units)}
+    assert by_id['p2.ds.v']['depends_on'] == ['p2.ds.t']
+    assert by_id['p2.ds.w']['depends_on'] == ['p1.ds.t']
+
+
+def test_stream_units_holds_dependent_units():
+    units = [unit('v', requires=['ds.t', 'ds.w']), unit('t'), unit('w', requires=['ds.u']), unit('u')]
+    streamed = list(stream_units(iter(units)))
+    assert [item['table_id'] for item in streamed] == ['t', 'u', 'w', 'v']
+    assert streamed[2]['depends_on'] == ['ds.u']
+    assert streamed[3]['depends_on'] == ['ds.t', 'ds.w']
+
+
+def test_stream_units_is_lazy():
+    def produce():
+        yield unit('t')
+        raise AssertionError("unité lue avant d'être demandée")
+    assert next(stream_units(produce()))['table_id'] == 't'
+
+
+def test_iter_units_incremental_with_fake_client():
+    client = FakeClient('p', {'ds': 10})
+    records = [{'dataset_id': 'ds', 'table_id': table.table_id,
+                'partition_info': {'partitioned': table.time_partitioning is not None and table.time_partitioning.type_ == 'DAY',
+                                   'partition_key': 'd', 'partition_type': 'DAY'}}
+               for table in client.get_dataset('ds').tables if table.view_query is None]
+    header = {'debut_DAY': '2023-12-01', 'fin_DAY': '2024-01-31'}
+    # Watermark postérieur à toutes les modifications : aucune table à rafraîchir
+    after = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    assert list(iter_units(records, header, client, {f"ds.{record['table_id']}": after for record in records})) == []
+    units = list(iter_units(records, header, client, {}))
+    assert len(units) == len(records)
+    assert all('watermark' in item for item in units)
+
+
+def sized(table, num_bytes):
+    return {'dataset_id': 'ds', 'table_id': table, 'partition_info': {'partitioned': False}, 'size_info': {'num_bytes': num_bytes}}
+
+
+def test_schedule_units_largest_first_within_budget():
+    units = [dict(unit(table), est_bytes=size) for table, size in [('a', 10), ('b', 30), ('c', 20)]]
+    selected, deferred = schedule_units(units, 2, 45)
+    assert [item['table_id'] for item in selected] == ['b', 'a']
+    assert [item['table_id'] for item in deferred] == ['c']
+    # Les tables reportées par l'exécution précédente passent en premier
+    selected, deferred = schedule_units(units, 2, 45, {'ds.c': '2024-01-01T00:00:00'})
+    assert [item['table_id'] for item in selected] == ['c', 'a']
+    assert [item['table_id'] for item in deferred] == ['b']
+
+
+def test_deferred_units_run_first_next_time(tmp_path, caplog):
+    caplog.set_level(logging.WARNING)
+    args = make_args(project='p', subenv='s', target_env='e', repertoire_bash=str(tmp_path), emplacement_config='config.txt',
+                     max_bytes=100)
+    records = [sized('a', 60), sized('b', 50), sized('c', 40), sized('huge', 500)]
+    deferred_path = str(tmp_path / 'refresh.deferred.jsonl')
+    runs = []
+    for i in range(3):
+        units, watermarks_path, deferred = plan_units(args, {}, iter(records), deferred_path=deferred_path)
+        runs.append(sorted(item['table_id'] for item in units))
+    # Les tables qui tiennent dans le budget sont rafraîchies à tour de rôle
+    assert runs == [['a', 'c'], ['b', 'c'], ['a', 'c']]
+    assert [item['table_id'] for item in deferred] == ['huge', 'b']
+    assert 'ds.huge' in caplog.text and 'plus volumineuse que le budget' in caplog.text
+    assert 'reportée(s) au prochain lancement' in caplog.text
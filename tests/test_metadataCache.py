@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+from datetime import datetime, timezone
+
+from createRefreshConfigFile import update_config
+from fakeBigquery import FakeClient
+from metadataCache import cache_get, cache_path, cache_put
+
+MODIFIED = '2024-01-01T00:00:00+00:00'
+RECORDS = [{'dataset_id': 'ds', 'table_id': 't', 'partition_info': {'partitioned': False}}]
+
+
+def test_put_then_get(tmp_path):
+    cache_put(str(tmp_path), 'p.ds', MODIFIED, RECORDS, False, 10)
+    assert cache_get(str(tmp_path), 'p.ds', MODIFIED, 60, False) == RECORDS
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.tmp')]
+
+
+def test_stale_entries_are_misses(tmp_path, monkeypatch):
+    cache_put(str(tmp_path), 'p.ds', MODIFIED, RECORDS, False, 10)
+    assert cache_get(str(tmp_path), 'p.ds', '2024-02-01T00:00:00+00:00', 60, False) is None
+    assert cache_get(str(tmp_path), 'p.ds', MODIFIED, 60, True) is None
+    assert cache_get(str(tmp_path), 'p.other', MODIFIED, 60, False) is None
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 120)
+    assert cache_get(str(tmp_path), 'p.ds', MODIFIED, 60, False) is None
+    assert cache_get(str(tmp_path), 'p.ds', MODIFIED, 180, False) == RECORDS
+
+
+def test_corrupt_entry_is_a_miss(tmp_path):
+    open(cache_path(str(tmp_path), 'p.ds'), 'w').write('{')
+    assert cache_get(str(tmp_path), 'p.ds', MODIFIED, 60, False) is None
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    for i, dataset_key in enumerate(['p.a', 'p.b', 'p.c']):
+        cache_put(str(tmp_path), dataset_key, MODIFIED, RECORDS, False, 3)
+        os.utime(cache_path(str(tmp_path), dataset_key), (1000 + i, 1000 + i))
+    # Une lecture rend l'entrée la plus récente
+    assert cache_get(str(tmp_path), 'p.a', MODIFIED, 10**10, False) == RECORDS
+    cache_put(str(tmp_path), 'p.d', MODIFIED, RECORDS, False, 3)
+    assert sorted(os.listdir(tmp_path)) == ['p.a.json', 'p.c.json', 'p.d.json']
+
+
+def test_update_config_reads_unchanged_datasets_from_cache(tmp_path):
+    client = FakeClient('p1', {'a': 4, 'b': 2})
+    config_path = str(tmp_path / 'config.txt')
+    cache = {'cache_dir': str(tmp_path / 'cache'), 'ttl': 3600, 'max_entries': 10}
+    update_config(client, ['a', 'b'], config_path, cache=cache)
+    # Les datasets sont listés en parallèle : l'ordre des lignes peut changer
+    expected = sorted(open(config_path).read().splitlines())
+    os.remove(config_path)
+    queries = []
+    query = client.query
+    client.query = lambda sql: queries.append(sql) or query(sql)
+    client.datasets[('p1', 'b')].modified = datetime(2024, 3, 1, tzinfo=timezone.utc)
+    update_config(client, ['a', 'b'], config_path, cache=cache)
+    assert queries and all('`p1.b.' in sql for sql in queries)
+    assert sorted(open(config_path).read().splitlines()) == expected
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+import os
+import logging
+import subprocess
+import time
+
+import pytest
+
+from autoRefresh import generate_script, make_args
+from refreshBatch import TRANSIENT_RC, build_argv, format_command, read_units, run_unit, run_units
+from refreshConfig import write_config
+from refreshMetrics import load_metrics
+
+# Relances avec un délai trop long pour être attendu par les tests
+SLOW_RETRY = {'max_retries': 1, 'delay': 60, 'max_delay': 60}
+
+# Script de rafraîchissement de test : le comportement dépend du nom de la table
+#   ok*    : succès
+#   bad*   : échec (code retour 1) à chaque tentative
+#   flaky* : échec à la première tentative, succès ensuite
+#   crash* : arrêt brutal du processus à la première tentative, succès ensuite
+#   quota* : erreur de quota à la première tentative, succès ensuite
+#   error* : exception à chaque tentative
+STUB_SCRIPT = '''
+import os, sys
+class TooManyRequests(Exception):
+    pass
+table = sys.argv[sys.argv.index('--tables') + 1]
+calls = os.path.join(os.path.dirname(__file__), table + '.calls')
+count = int(open(calls).read()) + 1 if os.path.exists(calls) else 1
+# Écriture atomique : un processus du pool peut être tué pendant l'écriture
+open(calls + '.tmp', 'w').write(str(count))
+os.replace(calls + '.tmp', calls)
+if table.startswith('bad'):
+    sys.exit(1)
+if table.startswith('flaky') and count == 1:
+    sys.exit(1)
+if table.startswith('crash') and count == 1:
+    os._exit(9)
+if table.startswith('quota') and count == 1:
+    raise TooManyRequests('429 rateLimitExceeded')
+if table.startswith('error'):
+    raise RuntimeError('table absente')
+'''
+
+FAST_RETRY = {'max_retries': 2, 'delay': 0.01, 'max_delay': 0.01}
+
+
+@pytest.fixture
+def script(tmp_path):
+    script_path = tmp_path / 'refreshSubEnv.py'
+    script_path.write_text(STUB_SCRIPT)
+    return str(script_path)
+
+
+def calls(script, table):
+    calls_path = os.path.join(os.path.dirname(script), table + '.calls')
+    return int(open(calls_path).read()) if os.path.exists(calls_path) else 0
+
+
+def units_of(*tables):
+    return [{'dataset_id': 'ds', 'table_id': table} for table in tables]
+
+
+def run(script, units, max_parallel, retry=FAST_RETRY, **options):
+    argvs = [build_argv('p', 's', 'e', unit) for unit in units]
+    return {unit['table_id']: (rc, attempts) for unit, rc, attempts in run_units(units, argvs, script, max_parallel, retry=retry, **options)}
+
+
+@pytest.mark.parametrize('max_parallel', [1, 3])
+def test_results_and_retries(script, max_parallel):
+    results = run(script, units_of('ok1', 'ok2', 'flaky', 'bad'), max_parallel)
+    assert results['ok1'] == (0, 1)
+    assert results['ok2'] == (0, 1)
+    assert results['flaky'] == (0, 2)
+    assert results['bad'] == (1, 3)
+
+
+def test_journal_written_for_successes_only(script, tmp_path):
+    journal_path = str(tmp_path / 'journal.jsonl')
+    run(script, units_of('ok1', 'bad'), 1, journal_path=journal_path)
+    with open(journal_path) as journal_file:
+        journal = journal_file.read()
+    assert '"ds.ok1"' in journal
+    assert '"ds.bad"' not in journal
+
+
+def test_crashed_worker_replaces_the_pool(script):
+    results = run(script, units_of('crash', 'ok1', 'ok2', 'ok3'), 2)
+    assert results['crash'][0] == 0
+    assert calls(script, 'crash') == 2
+    # Les unités en cours dans le pool interrompu sont relancées dans le nouveau pool
+    assert all(results[table][0] == 0 for table in ('ok1', 'ok2', 'ok3'))
+
+
+def test_crashed_worker_without_retry_is_a_failure(script):
+    results = run(script, units_of('crash', 'ok1'), 2, retry={'max_retries': 0, 'delay': 0, 'max_delay': 0})
+    assert results['crash'][0] != 0
+
+
+def test_unit_project_replaces_command_project():
+    unit = {'project_id': 'p2', 'dataset_id': 'ds', 'table_id': 't'}
+    assert build_argv('p1', 's', 'e', unit)[:2] == ['--project', 'p2']
+    assert format_command('p1', 's', 'e', unit).startswith('python3 ./refreshSubEnv.py --project p2 ')
+    assert build_argv('p1', 's', 'e', {'dataset_id': 'ds', 'table_id': 't'})[:2] == ['--project', 'p1']
+
+
+def test_run_unit_classifies_errors(script):
+    assert run_unit(script, build_argv('p', 's', 'e', units_of('quota')[0])) == TRANSIENT_RC
+    assert run_unit(script, build_argv('p', 's', 'e', units_of('error')[0])) == 1
+    assert run_unit(script, build_argv('p', 's', 'e', units_of('bad')[0])) == 1
+
+
+@pytest.mark.parametrize('max_parallel', [1, 3])
+def test_hard_failures_are_retried_without_backoff(script, max_parallel):
+    start = time.monotonic()
+    results = run(script, units_of('bad', 'error', 'ok'), max_parallel, SLOW_RETRY)
+    assert time.monotonic() - start < 30
+    assert results == {'bad': (1, 2), 'error': (1, 2), 'ok': (0, 1)}
+
+
+def test_only_transient_failures_reduce_concurrency(script, caplog):
+    caplog.set_level(logging.WARNING)
+    results = run(script, units_of('bad1', 'bad2', 'bad3', 'bad4'), 4)
+    assert all(rc == 1 for rc, attempts in results.values())
+    assert 'concurrence réduite' not in caplog.text
+    results = run(script, units_of('quota1', 'quota2', 'quota3', 'quota4'), 4)
+    assert all(result == (0, 2) for result in results.values())
+    assert 'concurrence réduite à 2' in caplog.text
+
+
+def test_metrics_written_for_every_unit(script, tmp_path):
+    metrics = {'path': str(tmp_path / 'metrics.jsonl'), 'run': 'r'}
+    run(script, units_of('ok', 'flaky', 'bad'), 1, metrics=metrics)
+    records = {record['unit']: record for record in load_metrics(metrics['path'], 'r')}
+    assert {unit: (record['attempts'], record['status']) for unit, record in records.items()} == \
+        {'ds.ok': (1, 0), 'ds.flaky': (2, 0), 'ds.bad': (3, 1)}
+
+
+@pytest.mark.parametrize('max_parallel', [1, 3])
+def test_failed_unit_skips_its_dependents(script, max_parallel):
+    units = units_of('bad', 'ok1', 'ok2', 'ok3', 'ok4')
+    units[1]['depends_on'] = ['ds.bad']
+    units[2]['depends_on'] = ['ds.ok1']
+    units[4]['depends_on'] = ['ds.ok3']
+    results = run(script, units, max_parallel)
+    assert results == {'bad': (1, 3), 'ok1': (None, 0), 'ok2': (None, 0), 'ok3': (0, 1), 'ok4': (0, 1)}
+    assert calls(script, 'ok1') == calls(script, 'ok2') == 0
+
+
+def test_dependents_start_after_their_dependencies(script, tmp_path):
+    journal_path = str(tmp_path / 'journal.jsonl')
+    units = units_of('flaky', 'ok1', 'ok2')
+    units[1]['depends_on'] = ['ds.flaky']
+    units[2]['depends_on'] = ['ds.ok1', 'ds.absent']
+    run(script, units, 3, journal_path=journal_path)
+    with open(journal_path) as journal_file:
+        done = [line.split('"')[3] for line in journal_file]
+    assert done == ['ds.flaky', 'ds.ok1', 'ds.ok2']
+
+
+def test_dryrun_commands_match_the_bash_script(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    day = {'partitioned': True, 'partition_key': 'd', 'partition_type': 'DAY', 'date_debut': 'debut_DAY', 'date_fin': 'fin_DAY'}
+    records = [{'dataset_id': 'ds', 'table_id': 'a', 'partition_info': {'partitioned': False}},
+               {'dataset_id': 'ds', 'table_id': 'b', 'partition_info': day},
+               {'project_id': 'p2', 'dataset_id': 'ds', 'table_id': 'c', 'partition_info': {'partitioned': False}}]
+    write_config('config.txt', {'debut_DAY': '2024-01-01', 'fin_DAY': '2024-01-31', 'debut_NUM': '1', 'fin_NUM': '2'}, records)
+    options = dict(project='p', subenv='s', target_env='e', repertoire_bash='out', emplacement_config='config.txt')
+    script_path = generate_script(make_args(**options))
+    output = subprocess.run(['bash', script_path, 'True'], capture_output=True, text=True).stdout
+    bash_commands = [line for line in output.splitlines() if line.startswith('python3 ./refreshSubEnv.py')]
+    generate_script(make_args(batch=True, **options))
+    header, units = read_units(os.path.splitext(script_path)[0] + '.jsonl')
+    assert [format_command('p', 's', 'e', unit) for unit in units] == bash_commands
+    assert bash_commands[0] == 'python3 ./refreshSubEnv.py --project p --subenv s --target_env e --datasets ds --tables a '
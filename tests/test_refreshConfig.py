@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import pytest
+
+from createRefreshConfigFile import update_config
+from fakeBigquery import FakeClient
+from refreshConfig import iter_config, merge_config, write_config
+
+HEADER = {'debut_DAY': '2024-01-01', 'fin_DAY': '2024-01-31', 'debut_NUM': '1', 'fin_NUM': '5'}
+DAY = {'partitioned': True, 'partition_key': 'd', 'partition_type': 'DAY'}
+NONE = {'partitioned': False}
+
+
+def record(dataset, table, partition_info=NONE, **fields):
+    return dict({'dataset_id': dataset, 'table_id': table, 'partition_info': partition_info}, **fields)
+
+
+def read(config_path):
+    config = iter_config(config_path)
+    return next(config), list(config)
+
+
+def test_write_then_read(tmp_path):
+    config_path = str(tmp_path / 'config.txt')
+    records = [record('ds', 'a', DAY), record('ds', 'é', size_info={'num_bytes': 3})]
+    write_config(config_path, HEADER, records)
+    header, read_records = read(config_path)
+    assert {key: header[key] for key in HEADER} == HEADER
+    assert read_records == records
+
+
+def test_legacy_lines_are_read_without_eval(tmp_path):
+    config_path = tmp_path / 'config.txt'
+    config_path.write_text("---HEADER--- \ndebut_DAY=2024-01-01\nfin_DAY=\n-----------\n"
+                           + str(record('ds', 'a', DAY)) + "\n\n"
+                           + str(record('ds', 'b')) + "\n")
+    header, records = read(str(config_path))
+    assert header == {'debut_DAY': '2024-01-01', 'fin_DAY': ''}
+    assert records == [record('ds', 'a', DAY), record('ds', 'b')]
+
+
+def test_header_values_may_contain_equal_sign(tmp_path):
+    config_path = tmp_path / 'config.txt'
+    config_path.write_text("---HEADER---\nfiltre=a=b\n-----------\n")
+    assert read(str(config_path)) == ({'filtre': 'a=b'}, [])
+
+
+def test_read_is_lazy(tmp_path):
+    config_path = tmp_path / 'config.txt'
+    config_path.write_text("---HEADER---\n-----------\n" + str(record('ds', 'a')) + "\nligne invalide\n")
+    config = iter_config(str(config_path))
+    next(config)
+    assert next(config) == record('ds', 'a')
+
+
+def test_write_config_failure_keeps_original(tmp_path):
+    config_path = str(tmp_path / 'config.txt')
+    write_config(config_path, HEADER, [record('ds', 'a')])
+
+    def failing():
+        yield record('ds', 'b')
+        raise RuntimeError("listing interrompu")
+
+    with pytest.raises(RuntimeError):
+        write_config(config_path, HEADER, failing())
+    assert read(config_path)[1] == [record('ds', 'a')]
+    assert os.listdir(str(tmp_path)) == ['config.txt']
+
+
+def test_write_config_open_error_is_not_masked(tmp_path):
+    with pytest.raises(FileNotFoundError) as error:
+        write_config(str(tmp_path / 'absent' / 'config.txt'), HEADER, [])
+    # L'erreur d'ouverture est celle remontée, sans erreur de suppression du fichier temporaire
+    assert error.value.__context__ is None
+
+
+def test_merge_added_removed_changed(tmp_path):
+    config_path = str(tmp_path / 'config.txt')
+    write_config(config_path, HEADER, [record('ds', 'a'), record('ds', 'b'), record('ds', 'c')])
+    added, removed, changed = merge_config(config_path, [record('ds', 'c'), record('ds', 'a', DAY), record('ds', 'd')])
+    assert [item['table_id'] for item in added] == ['d']
+    assert [item['table_id'] for item in removed] == ['b']
+    assert [(old['table_id'], new['partition_info']) for old, new in changed] == [('a', DAY)]
+    header, records = read(config_path)
+    assert {key: header[key] for key in HEADER} == HEADER
+    # Ordre des tables existantes conservé, nouvelles tables en fin de fichier
+    assert [item['table_id'] for item in records] == ['a', 'c', 'd']
+
+
+def test_merge_size_only_is_not_a_change_and_declared_fields_are_kept(tmp_path):
+    config_path = str(tmp_path / 'config.txt')
+    write_config(config_path, HEADER, [record('ds', 'a', size_info={'num_bytes': 1}, declared_depends_on=['ds.b'])])
+    added, removed, changed = merge_config(config_path, [record('ds', 'a', size_info={'num_bytes': 2})])
+    assert (added, removed, changed) == ([], [], [])
+    assert read(config_path)[1] == [record('ds', 'a', size_info={'num_bytes': 2}, declared_depends_on=['ds.b'])]
+
+
+def test_merge_without_change_does_not_rewrite(tmp_path):
+    config_path = str(tmp_path / 'config.txt')
+    write_config(config_path, HEADER, [record('ds', 'a')])
+    modified = os.stat(config_path).st_mtime_ns
+    assert merge_config(config_path, [record('ds', 'a')]) == ([], [], [])
+    assert os.stat(config_path).st_mtime_ns == modified
+
+
+def test_merge_keeps_tables_of_datasets_not_listed(tmp_path):
+    config_path = str(tmp_path / 'config.txt')
+    write_config(config_path, HEADER, [record('a', 't1'), record('b', 't1'), record('b', 't2')])
+    added, removed, changed = merge_config(config_path, [], {(None, 'a')})
+    assert [(item['dataset_id'], item['table_id']) for item in removed] == [('a', 't1')]
+    assert [(item['dataset_id'], item['table_id']) for item in read(config_path)[1]] == [('b', 't1'), ('b', 't2')]
+
+
+def test_merge_listed_datasets_default_to_production(tmp_path):
+    config_path = str(tmp_path / 'config.txt')
+    write_config(config_path, HEADER, [record('a', 't1'), record('a', 't2'), record('b', 't1')])
+    added, removed, changed = merge_config(config_path, [record('a', 't1')])
+    assert [(item['dataset_id'], item['table_id']) for item in removed] == [('a', 't2')]
+    assert len(read(config_path)[1]) == 2
+
+
+def test_update_config_only_removes_listed_datasets(tmp_path):
+    config_path = str(tmp_path / 'config.txt')
+    update_config(FakeClient('p', {'a': 5, 'b': 5}), ['a', 'b'], config_path)
+    assert update_config(FakeClient('p', {'a': 5, 'b': 5}), ['a'], config_path) == ([], [], [])
+    assert len(read(config_path)[1]) == 10
+    added, removed, changed = update_config(FakeClient('p', {'a': 3, 'b': 5}), ['a'], config_path)
+    assert {item['dataset_id'] for item in removed} == {'a'}
+    assert len(read(config_path)[1]) == 8
+
+
+def test_merge_keys_include_project(tmp_path):
+    config_path = str(tmp_path / 'config.txt')
+    write_config(config_path, HEADER, [record('ds', 't', project_id='p1'), record('ds', 't', project_id='p2')])
+    added, removed, changed = merge_config(config_path, [record('ds', 't', project_id='p1')], {('p1', 'ds')})
+    assert (added, removed, changed) == ([], [], [])
+    assert len(read(config_path)[1]) == 2
+
+
+def test_merge_table_without_project_is_in_default_project(tmp_path):
+    config_path = str(tmp_path / 'config.txt')
+    write_config(config_path, HEADER, [record('ds', 't')])
+    added, removed, changed = merge_config(config_path, [record('ds', 't', project_id='p1')], {('p1', 'ds')}, 'p1')
+    assert (added, removed, changed) == ([], [], [])
+    assert read(config_path)[1] == [record('ds', 't', project_id='p1')]
+
+
+@pytest.mark.parametrize('first, second', [(['a', 'p2.b'], ['a']), (['a'], ['a', 'p2.b'])])
+def test_update_config_with_and_without_qualified_datasets(tmp_path, first, second):
+    config_path = str(tmp_path / 'config.txt')
+    client = FakeClient('p1', {'a': 5, 'p2.b': 3})
+    update_config(client, first, config_path)
+    update_config(client, second, config_path)
+    records = read(config_path)[1]
+    keys = [(item.get('project_id'), item['dataset_id'], item['table_id']) for item in records]
+    assert len(keys) == len(set(keys)) == 5 + 3 * ('p2.b' in first + second)
+    # Une fois écrit, le projet reste porté par toutes les lignes
+    assert all(item.get('project_id') for item in records)
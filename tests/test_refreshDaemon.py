@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import multiprocessing
+from datetime import datetime
+
+import pytest
+
+from refreshBatch import close_pool, new_pool
+from refreshConfig import write_config
+from refreshDaemon import daemon_parser, load_config, parse_window, run_refresh, window_delay
+
+# Script de rafraîchissement de test : chaque exécution ajoute le pid de son processus
+STUB_SCRIPT = '''
+import os
+with open(os.path.join(os.path.dirname(__file__), 'pids'), 'a') as pids_file:
+    pids_file.write(f"{os.getpid()}\\n")
+'''
+
+
+def at(hour, minute=0):
+    return datetime(2024, 1, 1, hour, minute)
+
+
+def test_parse_window():
+    assert parse_window(None) is None
+    assert parse_window('22:00-06:30') == (22 * 60, 6 * 60 + 30)
+    assert parse_window('8:05-9:00') == (8 * 60 + 5, 9 * 60)
+    for window in ['25:00-06:00', '22:00', '22:00-06:00-07:00', 'soir']:
+        with pytest.raises(ValueError):
+            parse_window(window)
+
+
+def test_window_delay():
+    window = parse_window('08:00-18:00')
+    assert window_delay(at(12), None) == 0
+    assert window_delay(at(8), window) == 0
+    assert window_delay(at(7, 30), window) == 30 * 60
+    assert window_delay(at(18), window) == 14 * 3600
+
+
+def test_window_delay_across_midnight():
+    window = parse_window('22:00-06:00')
+    assert window_delay(at(23), window) == 0
+    assert window_delay(at(2), window) == 0
+    assert window_delay(at(6), window) == 16 * 3600
+    assert window_delay(at(21, 59), window) == 60
+
+
+def test_load_config_only_rereads_a_changed_file(tmp_path):
+    config_path = str(tmp_path / 'config.txt')
+    records = [{'dataset_id': 'ds', 'table_id': 't', 'partition_info': {'partitioned': False}}]
+    write_config(config_path, {'debut_NUM': '1'}, records)
+    config = load_config(config_path)
+    assert load_config(config_path, config) is config
+    assert load_config(config_path, config, force=True) is not config
+    write_config(config_path, {'debut_NUM': '1'}, records * 2)
+    os.utime(config_path, ns=(time.time_ns(), config['signature'][0] + 10**9))
+    assert len(load_config(config_path, config)['records']) == 2
+
+
+def test_refresh_cycles_share_the_daemon_pool(tmp_path):
+    script_path = tmp_path / 'refreshSubEnv.py'
+    script_path.write_text(STUB_SCRIPT)
+    config_path = str(tmp_path / 'config.txt')
+    records = [{'dataset_id': 'ds', 'table_id': f"t{i}", 'partition_info': {'partitioned': False}} for i in range(4)]
+    write_config(config_path, {'debut_NUM': '1', 'fin_NUM': '2'}, records)
+    args = daemon_parser().parse_args(['--project', 'p', '--subenv', 's', '--target_env', 'e', '--repertoire_bash', str(tmp_path),
+                                       '--emplacement_config', config_path, '--dryrun', 'False', '--script', str(script_path),
+                                       '--max_parallel', '2'])
+    pool = new_pool(2, multiprocessing.get_context('spawn'))
+    try:
+        config = load_config(config_path)
+        assert run_refresh(None, args, config, pool)['errors'] == 0
+        executor = pool['executor']
+        assert run_refresh(None, args, config, pool)['errors'] == 0
+        assert pool['executor'] is executor
+    finally:
+        close_pool(pool)
+    pids = (tmp_path / 'pids').read_text().split()
+    # Deux cycles de quatre unités exécutés par les deux mêmes processus
+    assert len(pids) == 8
+    assert len(set(pids)) <= 2
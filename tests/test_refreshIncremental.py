@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from datetime import datetime, timezone
+
+from refreshIncremental import load_watermarks, plan_incremental, watermark_line
+
+DAY_RECORD = {'dataset_id': 'ds', 'table_id': 't', 'partition_info': {'partitioned': True, 'partition_key': 'd', 'partition_type': 'DAY'}}
+RANGE_RECORD = {'dataset_id': 'ds', 'table_id': 'r',
+                'partition_info': {'partitioned': True, 'partition_key': 'id', 'partition_type': 'NUMBER',
+                                   'range': {'start': 0, 'end': 1000, 'interval': 10}}}
+
+
+def at(day, hour=0):
+    return datetime(2024, 3, day, hour, tzinfo=timezone.utc)
+
+
+def day_unit(start, end):
+    return {'dataset_id': 'ds', 'table_id': 't', 'partition_type': 'DAY', 'partition_start': start, 'partition_end': end}
+
+
+def write_lines(path, entries):
+    with open(path, 'w') as watermarks_file:
+        for entry in entries:
+            watermarks_file.write(json.dumps(entry) + "\n")
+
+
+def test_unmodified_table_is_skipped():
+    partitions = [('20240105', at(1))]
+    assert plan_incremental(day_unit('2024-01-01', '2024-01-31'), DAY_RECORD, partitions, at(2)) is None
+
+
+def test_unit_restricted_to_changed_partitions():
+    partitions = [('20240103', at(1)), ('20240110', at(5)), ('20240120', at(6))]
+    unit = plan_incremental(day_unit('2024-01-01', '2024-01-31'), DAY_RECORD, partitions, at(2))
+    assert (unit['partition_start'], unit['partition_end']) == ('2024-01-10', '2024-01-20')
+    assert unit['table'] == 'ds.t'
+    assert unit['watermark'] == at(6).isoformat()
+
+
+def test_header_date_format_is_kept():
+    unit = plan_incremental(day_unit('20240101', '20240131'), DAY_RECORD, [('20240110', at(5))], None)
+    assert (unit['partition_start'], unit['partition_end']) == ('20240110', '20240110')
+
+
+def test_no_partition_information_refreshes_whole_table():
+    unit = day_unit('2024-01-01', '2024-01-31')
+    assert plan_incremental(unit, DAY_RECORD, None, at(1)) is unit
+
+
+def test_special_partition_keeps_header_window():
+    partitions = [('20240110', at(1)), ('__NULL__', at(5))]
+    unit = plan_incremental(day_unit('2024-01-01', '2024-01-31'), DAY_RECORD, partitions, at(2))
+    assert (unit['partition_start'], unit['partition_end']) == ('2024-01-01', '2024-01-31')
+    assert unit['watermark'] == at(5).isoformat()
+
+
+
+def test_special_partition_does_not_cover_changes_outside_window():
+    partitions = [('__UNPARTITIONED__', at(5)), ('20240210', at(2))]
+    unit = plan_incremental(day_unit('2024-01-01', '2024-01-31'), DAY_RECORD, partitions, at(1))
+    assert (unit['partition_start'], unit['partition_end']) == ('2024-01-01', '2024-01-31')
+    watermark = datetime.fromisoformat(unit['watermark'])
+    assert at(1) <= watermark < at(2)
+    # La partition spéciale, toujours après le watermark, garde la fenêtre de février entière
+    unit = plan_incremental(day_unit('2024-02-01', '2024-02-29'), DAY_RECORD, partitions, watermark)
+    assert (unit['partition_start'], unit['partition_end']) == ('2024-02-01', '2024-02-29')
+    assert unit['watermark'] == at(5).isoformat()
+
+
+def test_unpartitioned_table_is_covered_whole():
+    unit = {'dataset_id': 'ds', 'table_id': 'n'}
+    record = {'dataset_id': 'ds', 'table_id': 'n', 'partition_info': {'partitioned': False}}
+    unit = plan_incremental(unit, record, [(None, at(3))], at(1))
+    assert unit['watermark'] == at(3).isoformat()
+    assert plan_incremental(unit, record, [(None, at(3))], at(3)) is None
+
+def test_change_outside_window_is_refreshed_by_a_later_window(tmp_path):
+    # Janvier et février modifiés, seule la fenêtre de janvier est rafraîchie
+    partitions = [('20240105', at(1)), ('20240210', at(2))]
+    watermarks_path = str(tmp_path / 'watermarks.jsonl')
+    unit = plan_incremental(day_unit('2024-01-01', '2024-01-31'), DAY_RECORD, partitions, None)
+    assert (unit['partition_start'], unit['partition_end']) == ('2024-01-05', '2024-01-05')
+    write_lines(watermarks_path, [json.loads(watermark_line(unit))])
+    watermark = load_watermarks(watermarks_path)['ds.t']
+    assert watermark < at(2)
+    unit = plan_incremental(day_unit('2024-02-01', '2024-02-29'), DAY_RECORD, partitions, watermark)
+    assert unit is not None
+    assert (unit['partition_start'], unit['partition_end']) == ('2024-02-10', '2024-02-10')
+    assert unit['watermark'] == at(2).isoformat()
+
+
+def test_earlier_change_outside_window_holds_back_the_watermark():
+    partitions = [('20240105', at(5)), ('20240210', at(2))]
+    unit = plan_incremental(day_unit('2024-01-01', '2024-01-31'), DAY_RECORD, partitions, at(1))
+    assert datetime.fromisoformat(unit['watermark']) < at(2)
+    assert datetime.fromisoformat(unit['watermark']) >= at(1)
+
+
+def test_changes_outside_window_only():
+    assert plan_incremental(day_unit('2024-01-01', '2024-01-31'), DAY_RECORD, [('20240210', at(2))], None) is None
+
+
+def test_range_partitions_cover_whole_bucket_clipped_to_window():
+    unit = {'dataset_id': 'ds', 'table_id': 'r', 'partition_type': 'NUMBER', 'partition_start': '5', 'partition_end': '35'}
+    partitions = [('0', at(2)), ('20', at(3)), ('40', at(4))]
+    unit = plan_incremental(unit, RANGE_RECORD, partitions, at(1))
+    assert (unit['partition_start'], unit['partition_end']) == ('5', '29')
+
+
+def test_load_watermarks_keeps_latest(tmp_path):
+    watermarks_path = str(tmp_path / 'watermarks.jsonl')
+    write_lines(watermarks_path, [{'table': 'ds.t', 'watermark': at(3).isoformat()},
+                                  {'table': 'ds.t', 'watermark': at(2).isoformat()},
+                                  {'table': 'ds.u', 'watermark': at(1).isoformat()}])
+    assert load_watermarks(watermarks_path) == {'ds.t': at(3), 'ds.u': at(1)}
+
+
+def test_load_watermarks_missing_file(tmp_path):
+    assert load_watermarks(str(tmp_path / 'absent.jsonl')) == {}
+
+
+def test_chunked_watermark_needs_every_chunk(tmp_path):
+    watermarks_path = str(tmp_path / 'watermarks.jsonl')
+    unit = dict(day_unit('2024-01-01', '2024-01-10'), table='ds.t', watermark=at(3).isoformat())
+    lines = [json.loads(watermark_line(dict(unit, chunk=i, chunks=3))) for i in range(3)]
+    write_lines(watermarks_path, lines[:2])
+    assert load_watermarks(watermarks_path) == {}
+    # Une tranche relancée ne compte qu'une fois
+    write_lines(watermarks_path, lines[:2] + [lines[1]])
+    assert load_watermarks(watermarks_path) == {}
+    write_lines(watermarks_path, lines[:2] + [lines[2]])
+    assert load_watermarks(watermarks_path) == {'ds.t': at(3)}
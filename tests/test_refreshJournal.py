@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+
+from refreshJournal import journal_line, load_journal, unit_id
+
+TABLE = {'dataset_id': 'ds', 'table_id': 't'}
+CHUNK = dict(TABLE, partition_type='DAY', partition_start='2024-01-01', partition_end='2024-01-31')
+
+
+def test_unit_id():
+    assert unit_id(TABLE) == 'ds.t'
+    assert unit_id(dict(TABLE, project_id='p')) == 'p.ds.t'
+    assert unit_id(CHUNK) == 'ds.t:2024-01-01:2024-01-31'
+
+
+def test_journal_lines_are_read_back(tmp_path):
+    journal_path = tmp_path / 'journal.jsonl'
+    journal_path.write_text(journal_line(TABLE) + "\n\n" + journal_line(CHUNK) + "\n" + journal_line(TABLE) + "\n")
+    assert load_journal(str(journal_path)) == {'ds.t', 'ds.t:2024-01-01:2024-01-31'}
+
+
+def test_missing_journal_is_empty(tmp_path):
+    assert load_journal(str(tmp_path / 'absent.jsonl')) == set()
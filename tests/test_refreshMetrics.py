@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+
+from refreshMetrics import load_metrics, metrics_line, summarize_run, table_report, write_prometheus
+
+START = datetime(2024, 1, 1).timestamp()
+
+
+def write_lines(metrics_path, lines):
+    with open(metrics_path, 'w') as metrics_file:
+        for line in lines:
+            metrics_file.write(line + "\n")
+
+
+def test_metrics_line_is_read_back(tmp_path):
+    metrics_path = str(tmp_path / 'metrics.jsonl')
+    write_lines(metrics_path, [metrics_line('ds.t', 'r1', START, START + 5, START + 65, 1000, 2, 0),
+                               metrics_line('ds.u', 'r2', START, START, START + 1, None, 1, 1)])
+    record = load_metrics(metrics_path, 'r1')[0]
+    assert (record['unit'], record['duration'], record['wait'], record['attempts'], record['status']) == ('ds.t', 60, 5, 2, 0)
+    assert record['start'] == '2024-01-01T00:00:05'
+    assert len(load_metrics(metrics_path)) == 2
+    assert load_metrics(metrics_path, since=datetime(2024, 1, 2)) == []
+    assert load_metrics(str(tmp_path / 'absent.jsonl')) == []
+
+
+def test_summarize_run(tmp_path):
+    metrics_path = str(tmp_path / 'metrics.jsonl')
+    write_lines(metrics_path, [metrics_line('ds.t', 'r', START, START + 5, START + 65, 1000, 3, 0),
+                               metrics_line('ds.u', 'r', START, START + 1, START + 11, None, 1, 1)])
+    summary = summarize_run(load_metrics(metrics_path, 'r'))
+    assert summary == {'units': 2, 'failed': 1, 'retries': 2, 'wait': 6, 'max_duration': 60, 'est_bytes': 1000}
+
+
+def test_table_report_adds_chunks_of_a_run(tmp_path):
+    metrics_path = str(tmp_path / 'metrics.jsonl')
+    write_lines(metrics_path, [metrics_line('ds.t:1:2', 'r1', START, START, START + 10, None, 1, 0),
+                               metrics_line('ds.t:3:4', 'r1', START, START, START + 20, None, 1, 0),
+                               metrics_line('ds.t', 'r2', START, START, START + 40, None, 1, 0),
+                               metrics_line('ds.u', 'r1', START, START, START + 5, None, 1, 0),
+                               metrics_line('ds.v', 'r1', START, START, START + 90, None, 1, 1)])
+    assert table_report(load_metrics(metrics_path)) == [('ds.t', 35, 40, 2), ('ds.u', 5, 5, 1)]
+
+
+def test_prometheus_keeps_last_success_after_a_failure(tmp_path):
+    prometheus_path = str(tmp_path / 'refresh.prom')
+    summary = summarize_run([])
+    write_prometheus(prometheus_path, summary, 'refresh_ds', START, START + 60, 0)
+    write_prometheus(prometheus_path, summary, 'refresh_ds', START + 3600, START + 3660, 2)
+    content = open(prometheus_path).read()
+    assert f'autorefresh_run_last_success_timestamp_seconds{{refresh="refresh_ds"}} {START + 60}' in content
+    assert 'autorefresh_run_success{refresh="refresh_ds"} 0' in content
+    assert '# TYPE autorefresh_run_units gauge' in content
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+from refreshPartitions import day_bound, header_bounds, header_keys, in_window
+
+HEADER = {'debut_DAY': '2024-01-01', 'fin_DAY': '2024-02-15', 'debut_NUM': '1', 'fin_NUM': '5'}
+
+
+def test_header_keys():
+    assert header_keys('DAY') == ('debut_DAY', 'fin_DAY')
+    assert header_keys('NUMBER') == ('debut_NUM', 'fin_NUM')
+
+
+def test_day_bound_keeps_day_format():
+    assert day_bound('2024-01-31', 'HOUR', False) == '2024-01-31T00'
+    assert day_bound('2024-01-31', 'HOUR', True) == '2024-01-31T23'
+    assert day_bound('20240131', 'HOUR', True) == '2024013123'
+    assert day_bound('2024-01-31', 'MONTH', True) == '2024-01'
+    assert day_bound('20240131', 'MONTH', False) == '202401'
+    assert day_bound('2024-01-31', 'YEAR', False) == '2024'
+    assert day_bound('invalide', 'MONTH', False) == ''
+
+
+def test_header_bounds_per_type():
+    assert header_bounds(HEADER, 'DAY') == ('2024-01-01', '2024-02-15')
+    assert header_bounds(HEADER, 'NUMBER') == ('1', '5')
+    assert header_bounds(HEADER, 'HOUR') == ('2024-01-01T00', '2024-02-15T23')
+    assert header_bounds(HEADER, 'MONTH') == ('2024-01', '2024-02')
+    assert header_bounds(HEADER, 'YEAR') == ('2024', '2024')
+
+
+def test_header_bounds_explicit_values_win():
+    header = dict(HEADER, debut_MONTH='2023-06', fin_MONTH='')
+    assert header_bounds(header, 'MONTH') == ('2023-06', '2024-02')
+
+
+def test_header_bounds_empty():
+    assert header_bounds({}, 'DAY') == ('', '')
+    assert header_bounds({'debut_DAY': '', 'fin_DAY': ''}, 'HOUR') == ('', '')
+
+
+def test_in_window():
+    assert in_window('20240105', 'DAY', '2024-01-01', '2024-01-31')
+    assert not in_window('20240210', 'DAY', '2024-01-01', '2024-01-31')
+    assert in_window('20240210', 'DAY', '', '')
+    assert in_window('202401', 'MONTH', '2024-01', '')
+    # Une partition d'entiers recoupe la fenêtre si l'un de ses entiers y appartient
+    assert in_window('0', 'NUMBER', '5', '35', 10)
+    assert not in_window('40', 'NUMBER', '5', '35', 10)
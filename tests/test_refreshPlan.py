@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import pytest
+
+from refreshPlan import PLAN_VERSION, iter_plan, write_plan
+
+UNITS = [{'dataset_id': 'ds', 'table_id': 'é'},
+         {'dataset_id': 'ds', 'table_id': 't', 'partition_type': 'DAY', 'partition_start': '2024-01-01', 'partition_end': '2024-01-31'}]
+
+
+def read(plan_path):
+    plan = iter_plan(plan_path)
+    return next(plan), list(plan)
+
+
+def test_write_then_read(tmp_path):
+    plan_path = str(tmp_path / 'plan.jsonl')
+    assert write_plan(plan_path, iter(UNITS), {'project': 'p', 'subenv': 's', 'target_env': 'e'}) == 2
+    header, units = read(plan_path)
+    assert header['plan_version'] == PLAN_VERSION
+    assert (header['project'], header['subenv'], header['target_env']) == ('p', 's', 'e')
+    assert units == UNITS
+    assert os.listdir(tmp_path) == ['plan.jsonl']
+
+
+def test_newer_plan_version_is_rejected(tmp_path):
+    plan_path = tmp_path / 'plan.jsonl'
+    plan_path.write_text('{"plan_version": %d}\n{"dataset_id": "ds", "table_id": "t"}\n' % (PLAN_VERSION + 1))
+    with pytest.raises(ValueError):
+        read(str(plan_path))
+
+
+def test_legacy_units_file_without_header(tmp_path):
+    plan_path = tmp_path / 'units.jsonl'
+    plan_path.write_text('{"dataset_id": "ds", "table_id": "a"}\n\n{"dataset_id": "ds", "table_id": "b"}\n')
+    header, units = read(str(plan_path))
+    assert header == {}
+    assert [unit['table_id'] for unit in units] == ['a', 'b']
+    (tmp_path / 'empty.jsonl').write_text('')
+    assert read(str(tmp_path / 'empty.jsonl')) == ({}, [])
+
+
+def test_failed_write_keeps_the_previous_plan(tmp_path):
+    plan_path = str(tmp_path / 'plan.jsonl')
+    write_plan(plan_path, UNITS, {})
+
+    def failing_units():
+        yield UNITS[0]
+        raise RuntimeError('interruption')
+    with pytest.raises(RuntimeError):
+        write_plan(plan_path, failing_units(), {})
+    assert read(plan_path)[1] == UNITS
+    assert os.listdir(tmp_path) == ['plan.jsonl']
+
+
+def test_open_error_is_not_masked(tmp_path):
+    with pytest.raises(FileNotFoundError) as error:
+        write_plan(str(tmp_path / 'absent' / 'plan.jsonl'), UNITS, {})
+    assert error.value.__context__ is None
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from refreshSelection import build_selector, legacy_patterns
+
+
+def record(dataset, table, partition_type=None, num_bytes=None, project=None):
+    result = {'dataset_id': dataset, 'table_id': table,
+              'partition_info': {'partitioned': True, 'partition_type': partition_type} if partition_type else {'partitioned': False}}
+    if num_bytes is not None:
+        result['size_info'] = {'num_bytes': num_bytes}
+    if project:
+        result['project_id'] = project
+    return result
+
+
+def test_no_rule():
+    assert build_selector() is None
+
+
+def test_bare_glob_matches_table_name_only():
+    select = build_selector(exclude=['*tmp*'])
+    assert select(record('ds', 'ventes_tmp')) is False
+    assert select(record('tmp_ds', 'ventes')) is True
+
+
+def test_bare_name_is_exact():
+    select = build_selector(exclude=['tmp'])
+    assert select(record('ds', 'tmp')) is False
+    assert select(record('ds', 'customer_tmpl')) is True
+
+
+def test_qualified_glob():
+    select = build_selector(include=['ventes.*', 'p2.ds.*'])
+    assert select(record('ventes', 'a')) is True
+    assert select(record('ventes_old', 'a')) is False
+    assert select(record('ds', 'a', project='p2')) is True
+    assert select(record('ds', 'a', project='p1')) is False
+
+
+def test_regex_patterns():
+    select = build_selector(include=['re:.*_\\d{8}', 're:ventes\\..*'])
+    assert select(record('ds', 'jour_20240101')) is True
+    assert select(record('ds_20240101', 'jour')) is False
+    assert select(record('ventes', 'a')) is True
+    assert select(record('ds', 'a')) is False
+
+
+def test_include_then_exclude():
+    select = build_selector(include=['ventes_*'], exclude=['*_old'])
+    assert select(record('ds', 'ventes_2024')) is True
+    assert select(record('ds', 'ventes_old')) is False
+    assert select(record('ds', 'achats')) is False
+
+
+def test_partition_types_and_sizes():
+    select = build_selector(partition_types=['day', 'NONE'], min_bytes=10, max_bytes=100)
+    assert select(record('ds', 'a', 'DAY', 50)) is True
+    assert select(record('ds', 'a', num_bytes=50)) is True
+    assert select(record('ds', 'a', 'NUMBER', 50)) is False
+    assert select(record('ds', 'a', 'DAY', 5)) is False
+    assert select(record('ds', 'a', 'DAY', 500)) is False
+    # Taille inconnue : pas de filtre
+    assert select(record('ds', 'a', 'DAY')) is True
+
+
+def test_rules_file(tmp_path):
+    rules_path = tmp_path / 'rules.txt'
+    rules_path.write_text("# règles\ninclude=ventes_*\n\nexclude=re:.*_tmp\npartition_type=DAY,NONE\nmin_bytes=10\n")
+    select = build_selector(rules_path=str(rules_path))
+    assert select(record('ds', 'ventes_a', 'DAY', 20)) is True
+    assert select(record('ds', 'ventes_tmp', 'DAY', 20)) is False
+    assert select(record('ds', 'ventes_a', 'DAY', 5)) is False
+
+
+def test_invalid_rules(tmp_path):
+    with pytest.raises(ValueError):
+        build_selector(include=['re:('])
+    rules_path = tmp_path / 'rules.txt'
+    rules_path.write_text("inconnu=1\n")
+    with pytest.raises(ValueError):
+        build_selector(rules_path=str(rules_path))
+
+
+def test_legacy_patterns_keep_substring_semantics():
+    assert legacy_patterns(['tmp', '*old*', 're:x', 'glob:a', 'test_?']) == ['*tmp*', '*old*', 're:x', 'glob:a', 'test_?']
+    assert legacy_patterns(None) == []
+    select = build_selector(exclude=legacy_patterns(['tmp']))
+    assert select(record('ds', 'customer_tmpl')) is False
+    assert select(record('tmp_ds', 'ventes')) is True